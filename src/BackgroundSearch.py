@@ -0,0 +1,75 @@
+import pickle
+import threading
+
+'''
+Runs ChessAI searches on a background thread so the game loop keeps drawing
+and handling events while the AI thinks. The search gets its own copy of the
+board, so the one on screen is never touched mid-search.
+
+While the human is thinking, the AI can ponder: it searches the position after
+the reply it expects, with no time limit, until the human moves. The
+transposition table is shared with the real search that follows, which then
+starts from everything pondering found.
+'''
+
+# Seconds between repeated stop requests while waiting for a search to end
+STOP_RETRY_INTERVAL = 0.05
+
+class BackgroundSearch:
+    def __init__(self, ai):
+        self.ai = ai
+        self.thread = None
+        self.result = None
+        self.pondering = False
+
+    def start(self, board):
+        """
+        Start searching for the AI's move in the board's position. Stops any search already running.
+        """
+        self.cancel()
+        self.run(pickle.loads(pickle.dumps(board)), ponder=False)
+
+    def start_pondering(self, board):
+        """
+        Search on the human's time, from the position after the reply found by the last search.
+        Does nothing when there is no expected reply.
+        """
+        self.cancel()
+        expected_reply = self.ai.get_principal_variation(board, 1)
+        if not expected_reply:
+            return
+        ponder_board = pickle.loads(pickle.dumps(board))
+        ponder_board.make_move(expected_reply[0])
+        self.run(ponder_board, ponder=True)
+
+    def run(self, board, ponder):
+        self.result = None
+        self.pondering = ponder
+        self.thread = threading.Thread(target=self.search, args=(board, ponder), daemon=True)
+        self.thread.start()
+
+    def search(self, board, ponder):
+        self.result = self.ai.calculate_move(board, ponder)
+
+    def is_thinking(self):
+        # Pondering does not count: the human is free to move meanwhile
+        return self.thread is not None and not self.pondering
+
+    def poll(self):
+        """
+        Return the AI's move once the search has finished, and None until then.
+        """
+        if self.thread is None or self.pondering or self.thread.is_alive():
+            return None
+        self.thread = None
+        return self.result
+
+    def cancel(self):
+        # The search notices within a few hundred nodes
+        if self.thread is not None:
+            # Asked again until the thread ends, as a search only just starting clears the request
+            while self.thread.is_alive():
+                self.ai.stop()
+                self.thread.join(STOP_RETRY_INTERVAL)
+            self.thread = None
+        self.pondering = False
@@ -0,0 +1,135 @@
+import argparse
+import json
+import sys
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from Board import Board
+from ChessAI import ChessAI
+from Move import move_name
+
+'''
+Analyse a stream of positions, one FEN or EPD line each, and write one JSON
+line per position in the same order:
+
+    python3 src/BatchAnalysis.py positions.epd --depth 4 --workers 4 > results.jsonl
+    cat positions.fen | python3 src/BatchAnalysis.py --movetime 0.5
+
+Lines are read and results written as the analysis goes, with only a few
+positions per worker in flight, so memory use does not grow with the input.
+Every position gets a fresh search, so results do not depend on the number of
+workers or the order positions are handed out in.
+'''
+
+# Positions in flight per worker, enough to keep workers busy between results
+POSITIONS_PER_WORKER = 4
+
+# Search limits and table size, set in each worker process by init_worker
+analysis_settings = None
+
+
+def init_worker(settings):
+    global analysis_settings
+    analysis_settings = settings
+
+
+def analyse_line(line):
+    """
+    Search the position on one FEN/EPD line. Returns the result as a JSON string.
+    """
+    settings = analysis_settings
+    fields = line.split()
+    result = {"fen": line}
+    # EPD operations such as id "name"; are passed through
+    if "id" in fields:
+        result["id"] = " ".join(fields[fields.index("id") + 1:]).split(";")[0].strip('"')
+
+    board = Board()
+    try:
+        board.set_fen(line)
+    except (ValueError, KeyError, IndexError):
+        result["error"] = "invalid position"
+        return json.dumps(result)
+    result["fen"] = board.get_fen()
+
+    ai = ChessAI(
+        board.side_to_move, node_budget=settings["nodes"], max_depth=settings["depth"],
+        tt_memory_mb=settings["hash"]
+    )
+    best_move = ai.calculate_move(board, move_time=settings["movetime"])
+    stats = ai.stats
+    result.update({
+        "bestmove": move_name(best_move) if best_move else None,
+        "score": stats.score,
+        "depth": stats.depth,
+        "nodes": stats.nodes + stats.qnodes,
+        "time": round(stats.elapsed, 3),
+        "pv": " ".join(move_name(move) for move in ai.get_principal_variation(board, stats.depth)),
+    })
+    return json.dumps(result)
+
+
+def read_positions(input):
+    for line in input:
+        line = line.strip()
+        # Blank lines and comments are skipped
+        if line and not line.startswith("#"):
+            yield line
+
+
+def analyse_stream(input, output, settings, workers=1):
+    """
+    Analyse every position read from input, writing results to output in input order.
+    Returns the number of positions analysed.
+    """
+    count = 0
+    if workers <= 1:
+        init_worker(settings)
+        for line in read_positions(input):
+            output.write(analyse_line(line) + "\n")
+            output.flush()
+            count += 1
+        return count
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(settings,)) as executor:
+        pending = deque()
+        for line in read_positions(input):
+            pending.append(executor.submit(analyse_line, line))
+            # Write finished results in order before reading further ahead
+            while len(pending) >= workers * POSITIONS_PER_WORKER or (pending and pending[0].done()):
+                output.write(pending.popleft().result() + "\n")
+                output.flush()
+                count += 1
+        while pending:
+            output.write(pending.popleft().result() + "\n")
+            output.flush()
+            count += 1
+    return count
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Analyse FEN/EPD positions, one per line, writing JSON lines.")
+    parser.add_argument("input", nargs="?", default="-", help="file of positions, or - for stdin (default)")
+    parser.add_argument("--output", default="-", help="file to write results to, or - for stdout (default)")
+    parser.add_argument("--movetime", type=float, help="seconds per position")
+    parser.add_argument("--depth", type=int, help="depth per position")
+    parser.add_argument("--nodes", type=int, help="nodes per position")
+    parser.add_argument("--workers", type=int, default=1, help="processes to analyse with")
+    parser.add_argument("--hash", type=int, default=16, metavar="MB", help="transposition table size per search")
+    args = parser.parse_args()
+
+    settings = {
+        "movetime": args.movetime,
+        "depth": args.depth or 64,
+        "nodes": args.nodes,
+        "hash": args.hash,
+    }
+    if args.movetime is None and args.depth is None and args.nodes is None:
+        settings["movetime"] = 1.0
+    elif args.movetime is None:
+        # Only the depth or node limit applies
+        settings["movetime"] = float('inf')
+
+    input = sys.stdin if args.input == "-" else open(args.input)
+    output = sys.stdout if args.output == "-" else open(args.output, "w")
+    count = analyse_stream(input, output, settings, args.workers)
+    print(f"{count} positions analysed", file=sys.stderr)
@@ -0,0 +1,196 @@
+import argparse
+import json
+import sys
+import time
+from BitBoard import WHITE, BLACK
+from PieceSquareTables import MG_VALUES, EG_VALUES, PHASE_WEIGHTS, TOTAL_PHASE
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+'''
+Scores many positions at once with the same evaluation as ChessAI.evaluate_board.
+
+A position is encoded as the feature indices of its pieces, one per piece
+from (colour * 6 + piece type) * 64 + square, padded to 32 with an index
+that has no weight: 64 bytes per position instead of a 12x64 board of
+planes. Scoring a batch is the product of its planes and a weight matrix
+whose columns are the middlegame score, the endgame score and the game
+phase, blended afterwards as evaluate_board does. The product is taken by
+gathering the weight rows of each position's features and summing them,
+which gives the same result as multiplying out the mostly-zero planes at
+about twice the speed.
+
+NumPy is optional. Without it the same features are summed in plain Python,
+which gives the same scores, only more slowly.
+
+Run as a script it scores a file of FEN/EPD lines without searching, for
+labelling or checking datasets:
+
+    python3 src/BatchEvaluator.py positions.epd --batch-size 4096 > scores.jsonl
+'''
+
+PIECES_PER_SIDE = 6
+# Index of the padding feature, after the 12 planes of 64 squares
+PADDING = 2 * PIECES_PER_SIDE * 64
+MAX_PIECES = 32
+DEFAULT_BATCH_SIZE = 4096
+
+FEN_FEATURE_OFFSETS = {
+    letter: (color * PIECES_PER_SIDE + piece_type) * 64
+    for color, letters in ((WHITE, "PNBRQK"), (BLACK, "pnbrqk"))
+    for piece_type, letter in enumerate(letters)
+}
+
+
+def _feature_weights():
+    # (middlegame, endgame, phase) per feature, Black's scores negated so a sum is White's advantage
+    weights = []
+    for color in (WHITE, BLACK):
+        sign = 1 if color == WHITE else -1
+        for piece_type in range(PIECES_PER_SIDE):
+            for square in range(64):
+                weights.append((
+                    sign * MG_VALUES[color][piece_type][square],
+                    sign * EG_VALUES[color][piece_type][square],
+                    PHASE_WEIGHTS[piece_type]
+                ))
+    weights.append((0, 0, 0))
+    return weights
+
+
+FEATURE_WEIGHTS = _feature_weights()
+
+
+def get_features(board):
+    """
+    Feature indices of the pieces on a board.
+    """
+    features = []
+    for color in (WHITE, BLACK):
+        for piece_type, bits in enumerate(board.bitboard.pieces[color]):
+            offset = (color * PIECES_PER_SIDE + piece_type) * 64
+            while bits:
+                features.append(offset + (bits & -bits).bit_length() - 1)
+                bits &= bits - 1
+    return features
+
+
+def get_fen_features(fen):
+    """
+    Feature indices straight from the placement field of a FEN, without setting up a Board.
+    """
+    features = []
+    square = 0
+    for letter in fen.split(" ", 1)[0]:
+        if letter.isdigit():
+            square += int(letter)
+        elif letter != "/":
+            features.append(FEN_FEATURE_OFFSETS[letter] + square)
+            square += 1
+    if square != 64:
+        raise ValueError(f"bad placement in {fen}")
+    return features
+
+
+class BatchEvaluator:
+    def __init__(self, use_numpy=True):
+        self.use_numpy = use_numpy and numpy is not None
+        if self.use_numpy:
+            self.weights = numpy.array(FEATURE_WEIGHTS, dtype=numpy.int64)
+
+    def encode(self, feature_lists):
+        """
+        Pack feature lists into an array of MAX_PIECES indices per position (a list of lists without NumPy).
+        """
+        if not self.use_numpy:
+            return [list(features) for features in feature_lists]
+        encoded = numpy.full((len(feature_lists), MAX_PIECES), PADDING, dtype=numpy.int16)
+        for row, features in enumerate(feature_lists):
+            encoded[row, :len(features)] = features
+        return encoded
+
+    def evaluate(self, encoded):
+        """
+        Scores from White's point of view, in centipawns, for encoded positions.
+        """
+        if not self.use_numpy:
+            scores = []
+            for features in encoded:
+                mg = eg = phase = 0
+                for feature in features:
+                    mg_weight, eg_weight, phase_weight = FEATURE_WEIGHTS[feature]
+                    mg += mg_weight
+                    eg += eg_weight
+                    phase += phase_weight
+                phase = min(phase, TOTAL_PHASE)
+                scores.append((mg * phase + eg * (TOTAL_PHASE - phase)) // TOTAL_PHASE)
+            return scores
+
+        totals = self.weights[encoded].sum(axis=1)
+        mg, eg = totals[:, 0], totals[:, 1]
+        phase = numpy.minimum(totals[:, 2], TOTAL_PHASE)
+        return ((mg * phase + eg * (TOTAL_PHASE - phase)) // TOTAL_PHASE).tolist()
+
+    def evaluate_boards(self, boards):
+        return self.evaluate(self.encode([get_features(board) for board in boards]))
+
+    def evaluate_fens(self, fens):
+        return self.evaluate(self.encode([get_fen_features(fen) for fen in fens]))
+
+
+def score_stream(input, output, batch_size=DEFAULT_BATCH_SIZE, use_numpy=True):
+    """
+    Write {"fen", "eval"} JSON lines for every FEN/EPD line read from input,
+    batch_size positions at a time. Returns the number of positions scored.
+    """
+    evaluator = BatchEvaluator(use_numpy)
+    count = 0
+    batch = []
+    for line in input:
+        line = line.strip()
+        if line and not line.startswith("#"):
+            batch.append(line)
+        if len(batch) >= batch_size:
+            count += score_batch(evaluator, batch, output)
+            batch = []
+    if batch:
+        count += score_batch(evaluator, batch, output)
+    return count
+
+
+def score_batch(evaluator, lines, output):
+    features = []
+    valid = []
+    for line in lines:
+        try:
+            features.append(get_fen_features(line))
+            valid.append(line)
+        except (ValueError, KeyError):
+            output.write(json.dumps({"fen": line, "error": "invalid position"}) + "\n")
+    for line, score in zip(valid, evaluator.evaluate(evaluator.encode(features))):
+        output.write(json.dumps({"fen": line, "eval": score}) + "\n")
+    return len(valid)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Score FEN/EPD positions with the static evaluation, without searching.")
+    parser.add_argument("input", nargs="?", default="-", help="file of positions, or - for stdin (default)")
+    parser.add_argument("--output", default="-", help="file to write results to, or - for stdout (default)")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE, help="positions scored per matrix product")
+    parser.add_argument("--no-numpy", action="store_true", help="score in plain Python even if NumPy is installed")
+    args = parser.parse_args()
+
+    input = sys.stdin if args.input == "-" else open(args.input)
+    output = sys.stdout if args.output == "-" else open(args.output, "w")
+    start_time = time.perf_counter()
+    count = score_stream(input, output, args.batch_size, not args.no_numpy)
+    output.flush()
+    elapsed = time.perf_counter() - start_time
+    print(
+        f"{count} positions scored in {elapsed:.2f}s ({count / max(elapsed, 1e-9):.0f} positions/s"
+        f"{', NumPy' if numpy is not None and not args.no_numpy else ''})",
+        file=sys.stderr
+    )
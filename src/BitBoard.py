@@ -0,0 +1,216 @@
+# Constants
+GRID_SIZE = 8
+
+'''
+Squares are numbered y * 8 + x, so square 0 is the top-left tile (0, 0) where
+the black rooks start and square 63 is the bottom-right tile (7, 7).
+Each set of squares is stored as a Python int with bit n set for square n.
+'''
+
+# Color and piece type indices
+WHITE, BLACK = 0, 1
+COLOR_INDEX = {"White": WHITE, "Black": BLACK}
+COLOR_NAMES = ["White", "Black"]
+
+PAWN, KNIGHT, BISHOP, ROOK, QUEEN, KING = range(6)
+PIECE_NAMES = ["Pawn", "Knight", "Bishop", "Rook", "Queen", "King"]
+
+SQUARE_POSITIONS = [(square % GRID_SIZE, square // GRID_SIZE) for square in range(GRID_SIZE * GRID_SIZE)]
+SQUARE_BITS = [1 << square for square in range(GRID_SIZE * GRID_SIZE)]
+
+FILE_MASKS = [sum(1 << (y * GRID_SIZE + x) for y in range(GRID_SIZE)) for x in range(GRID_SIZE)]
+RANK_MASKS = [sum(1 << (y * GRID_SIZE + x) for x in range(GRID_SIZE)) for y in range(GRID_SIZE)]
+
+# Ray directions as (dx, dy). The first four are rook directions, the last four bishop directions
+NORTH, SOUTH, WEST, EAST, NORTH_WEST, SOUTH_EAST, SOUTH_WEST, NORTH_EAST = range(8)
+DIRECTIONS = [(0, -1), (0, 1), (-1, 0), (1, 0), (-1, -1), (1, 1), (-1, 1), (1, -1)]
+ROOK_DIRECTIONS = [NORTH, SOUTH, WEST, EAST]
+BISHOP_DIRECTIONS = [NORTH_WEST, SOUTH_EAST, SOUTH_WEST, NORTH_EAST]
+
+
+def square_index(position):
+    return position[1] * GRID_SIZE + position[0]
+
+
+def lowest_square(bits):
+    return (bits & -bits).bit_length() - 1
+
+
+def highest_square(bits):
+    return bits.bit_length() - 1
+
+
+def iter_squares(bits):
+    while bits:
+        low = bits & -bits
+        yield low.bit_length() - 1
+        bits ^= low
+
+
+def count_squares(bits):
+    return bin(bits).count("1")
+
+
+def _offset_mask(square, offsets):
+    x, y = SQUARE_POSITIONS[square]
+    mask = 0
+    for dx, dy in offsets:
+        if 0 <= x + dx < GRID_SIZE and 0 <= y + dy < GRID_SIZE:
+            mask |= 1 << ((y + dy) * GRID_SIZE + x + dx)
+    return mask
+
+
+def _ray_mask(square, direction):
+    x, y = SQUARE_POSITIONS[square]
+    dx, dy = direction
+    mask = 0
+    x, y = x + dx, y + dy
+    while 0 <= x < GRID_SIZE and 0 <= y < GRID_SIZE:
+        mask |= 1 << (y * GRID_SIZE + x)
+        x, y = x + dx, y + dy
+    return mask
+
+
+KNIGHT_OFFSETS = [(-2, -1), (-2, 1), (-1, -2), (-1, 2), (1, -2), (1, 2), (2, -1), (2, 1)]
+KING_OFFSETS = [(0, 1), (1, 1), (1, 0), (1, -1), (0, -1), (-1, -1), (-1, 0), (-1, 1)]
+
+KNIGHT_ATTACKS = [_offset_mask(square, KNIGHT_OFFSETS) for square in range(64)]
+KING_ATTACKS = [_offset_mask(square, KING_OFFSETS) for square in range(64)]
+# Squares a pawn of the given color attacks from a square (white pawns move towards y = 0)
+PAWN_ATTACKS = [
+    [_offset_mask(square, [(-1, -1), (1, -1)]) for square in range(64)],
+    [_offset_mask(square, [(-1, 1), (1, 1)]) for square in range(64)]
+]
+
+RAYS = [[_ray_mask(square, direction) for square in range(64)] for direction in DIRECTIONS]
+# Directions in which square numbers increase find their nearest blocker with the lowest bit
+RAY_INCREASES = [dy * GRID_SIZE + dx > 0 for dx, dy in DIRECTIONS]
+
+
+def _between_masks(square):
+    masks = [0] * 64
+    for direction in DIRECTIONS:
+        x, y = SQUARE_POSITIONS[square]
+        dx, dy = direction
+        passed = 0
+        x, y = x + dx, y + dy
+        while 0 <= x < GRID_SIZE and 0 <= y < GRID_SIZE:
+            target = y * GRID_SIZE + x
+            masks[target] = passed
+            passed |= 1 << target
+            x, y = x + dx, y + dy
+    return masks
+
+
+# Squares strictly between two squares on a shared line, 0 when they are not aligned
+BETWEEN = [_between_masks(square) for square in range(64)]
+
+# Every square a rook or bishop reaches from a square on an empty board
+ROOK_RAYS = [sum(RAYS[direction][square] for direction in ROOK_DIRECTIONS) for square in range(64)]
+BISHOP_RAYS = [sum(RAYS[direction][square] for direction in BISHOP_DIRECTIONS) for square in range(64)]
+
+
+def _line_masks(square):
+    masks = [0] * 64
+    for direction, opposite in ((NORTH, SOUTH), (WEST, EAST), (NORTH_WEST, SOUTH_EAST), (SOUTH_WEST, NORTH_EAST)):
+        line = RAYS[direction][square] | RAYS[opposite][square] | (1 << square)
+        for target in iter_squares(line ^ (1 << square)):
+            masks[target] = line
+    return masks
+
+
+# The whole board line through two aligned squares, edge to edge, 0 when they are not aligned
+LINE = [_line_masks(square) for square in range(64)]
+
+
+def ray_attacks(square, direction, occupied):
+    ray = RAYS[direction][square]
+    blockers = ray & occupied
+    if blockers:
+        if RAY_INCREASES[direction]:
+            blocker = (blockers & -blockers).bit_length() - 1
+        else:
+            blocker = blockers.bit_length() - 1
+        ray ^= RAYS[direction][blocker]
+    return ray
+
+
+def rook_attacks(square, occupied):
+    return (
+        ray_attacks(square, NORTH, occupied) | ray_attacks(square, SOUTH, occupied)
+        | ray_attacks(square, WEST, occupied) | ray_attacks(square, EAST, occupied)
+    )
+
+
+def bishop_attacks(square, occupied):
+    return (
+        ray_attacks(square, NORTH_WEST, occupied) | ray_attacks(square, SOUTH_EAST, occupied)
+        | ray_attacks(square, SOUTH_WEST, occupied) | ray_attacks(square, NORTH_EAST, occupied)
+    )
+
+
+class BitBoard:
+    '''
+    Occupancy sets for every piece type and color, kept in sync with Board.tiles.
+    '''
+
+    def __init__(self):
+        self.pieces = [[0] * 6, [0] * 6]
+        self.colors = [0, 0]
+        self.occupied = 0
+
+    def add_piece(self, square, color, piece_type):
+        bit = 1 << square
+        self.pieces[color][piece_type] |= bit
+        self.colors[color] |= bit
+        self.occupied |= bit
+
+    def remove_piece(self, square, color, piece_type):
+        mask = ~(1 << square)
+        self.pieces[color][piece_type] &= mask
+        self.colors[color] &= mask
+        self.occupied &= mask
+
+    def is_square_attacked(self, square, color, occupied=None):
+        """
+        Check if a square is attacked by any piece of the given color.
+        Sliders are blocked by the given occupancy, or the current one if omitted.
+        """
+        pieces = self.pieces[color]
+        if PAWN_ATTACKS[color ^ 1][square] & pieces[PAWN]:
+            return True
+        if KNIGHT_ATTACKS[square] & pieces[KNIGHT]:
+            return True
+        if KING_ATTACKS[square] & pieces[KING]:
+            return True
+        if occupied is None:
+            occupied = self.occupied
+        # Only walk the rays when a slider stands on one of them
+        diagonal = (pieces[BISHOP] | pieces[QUEEN]) & BISHOP_RAYS[square]
+        if diagonal and bishop_attacks(square, occupied) & diagonal:
+            return True
+        straight = (pieces[ROOK] | pieces[QUEEN]) & ROOK_RAYS[square]
+        if straight and rook_attacks(square, occupied) & straight:
+            return True
+        return False
+
+    def attackers_to(self, square, color, occupied=None):
+        """
+        Bitmask of the squares of every piece of the given color attacking a square.
+        Sliders are blocked by the given occupancy, or the current one if omitted.
+        """
+        pieces = self.pieces[color]
+        if occupied is None:
+            occupied = self.occupied
+        attackers = (
+            (PAWN_ATTACKS[color ^ 1][square] & pieces[PAWN])
+            | (KNIGHT_ATTACKS[square] & pieces[KNIGHT])
+            | (KING_ATTACKS[square] & pieces[KING])
+        )
+        diagonal = (pieces[BISHOP] | pieces[QUEEN]) & BISHOP_RAYS[square]
+        if diagonal:
+            attackers |= bishop_attacks(square, occupied) & diagonal
+        straight = (pieces[ROOK] | pieces[QUEEN]) & ROOK_RAYS[square]
+        if straight:
+            attackers |= rook_attacks(square, occupied) & straight
+        return attackers
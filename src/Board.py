@@ -1,23 +1,35 @@
-import pygame
-import os
-import copy
 import random
+import re
 from ChessPieces import Piece, King, Queen, Rook, Knight, Bishop, Pawn
-from BoardPainter import BoardPainter
-from MoveValidator import (
-    VerticalMoveValidator,
-    HorizontalMoveValidator,
-    DiagonalMoveValidator,
-    KnightMoveValidator,
-    PawnMoveValidator,
-    SingleMoveValidator
+from MoveGenerator import MoveGenerator
+from BitBoard import BitBoard, COLOR_INDEX, PAWN as PAWN_TYPE, KING, QUEEN, PIECE_NAMES, SQUARE_POSITIONS, square_index, iter_squares
+from Move import (
+    ALL_CASTLING_RIGHTS, CASTLING_RIGHTS_MASKS,
+    WHITE_KINGSIDE, WHITE_QUEENSIDE, BLACK_KINGSIDE, BLACK_QUEENSIDE,
+    DOUBLE_PUSH, EN_PASSANT, CASTLING,
+    move_positions, SQUARE_NAMES
 )
+from PieceSquareTables import MG_VALUES, EG_VALUES, PHASE_WEIGHTS
+from Zobrist import PIECE_KEYS, SIDE_KEY, CASTLING_KEYS, EN_PASSANT_KEYS
 
 # Constants
 WIDTH, HEIGHT = 600, 600
 GRID_SIZE = 8
 SQUARE_SIZE = WIDTH // GRID_SIZE
 
+# Plies the undo stack holds before it has to grow
+UNDO_STACK_SIZE = 512
+
+# Forsyth-Edwards Notation for the starting position
+START_FEN = "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1"
+FEN_PIECES = {"p": Pawn, "n": Knight, "b": Bishop, "r": Rook, "q": Queen, "k": King}
+# FEN letters indexed by piece type, lower case for black
+FEN_LETTERS = "pnbrqk"
+FEN_CASTLING_RIGHTS = {"K": WHITE_KINGSIDE, "Q": WHITE_QUEENSIDE, "k": BLACK_KINGSIDE, "q": BLACK_QUEENSIDE}
+FEN_CASTLING_PATTERN = re.compile(r"[KQkq]+|-")
+# A square can only be skipped by a double pawn push on the third or sixth rank
+FEN_EN_PASSANT_PATTERN = re.compile(r"[a-h][36]|-")
+
 # Colors
 LIGHT_TILE_COLOR = (227, 193, 111) # White brown
 DARK_TILE_COLOR = (184, 139, 74) # Brown
@@ -26,11 +38,52 @@ HIGHLIGHT_TILE_COLOR = (186, 202, 68) # Light green
 class Board:
     def __init__(self):
         self.tiles = {}
+        # Occupancy sets mirroring self.tiles, used for attack tests and move generation
+        self.bitboard = BitBoard()
+        self.move_generator = MoveGenerator()
+        # Game state that is not visible from the pieces alone
+        self.side_to_move = "White"
+        self.castling_rights = 0
+        self.en_passant_square = None
+        # Zobrist hash of the above plus piece placement, updated with every change
+        self.zobrist_key = 0
+        # Evaluation terms per color (material plus piece-square bonus), updated with every change
+        self.mg_scores = [0, 0]
+        self.eg_scores = [0, 0]
+        self.phase = 0
+        # Square of each color's king, or None without one, updated with every change
+        self.king_squares = [None, None]
+        # Plies since the last capture or pawn move, and the move number as counted in a game record
+        self.halfmove_clock = 0
+        self.fullmove_number = 1
+        # Legal moves of the last position asked for, shared by the game, the display and the AI's root.
+        # Keyed by Zobrist key and color, so any change to the position invalidates them
+        self.legal_moves_key = None
+        self.legal_moves = ()
+
+        # Undo stack for make_move/unmake_move: one slot per ply played, in parallel lists that
+        # are allocated up front and only grow if a game runs past them
+        self.ply = 0
+        self.undo_moved = [None] * UNDO_STACK_SIZE
+        self.undo_captured = [None] * UNDO_STACK_SIZE
+        self.undo_has_moved = [False] * UNDO_STACK_SIZE
+        self.undo_castling_rights = [0] * UNDO_STACK_SIZE
+        self.undo_en_passant = [None] * UNDO_STACK_SIZE
+        self.undo_halfmove_clock = [0] * UNDO_STACK_SIZE
+
         self.selected_piece = None
         self.last_valid_moves = []
         self.painter = None
         self.init_start_positions()
 
+    def __getstate__(self):
+        # Boards are pickled to send positions to search processes, which have no display
+        state = self.__dict__.copy()
+        state["painter"] = None
+        state["selected_piece"] = None
+        state["last_valid_moves"] = []
+        return state
+
     def set_selected_piece(self, piece):
         if piece is not None: 
             valid_moves = piece.calculate_valid_moves(self)   
@@ -47,18 +100,237 @@ class Board:
 
     def set_piece_at_position(self, piece, position):
         if piece is not None:
+            old_square = square_index(piece.position)
+            new_square = square_index(position)
+            self.set_castling_rights(
+                self.castling_rights & CASTLING_RIGHTS_MASKS[old_square] & CASTLING_RIGHTS_MASKS[new_square]
+            )
+            # The square a pawn skipped over can be captured on by the next move only
+            if isinstance(piece, Pawn) and abs(new_square - old_square) == 2 * GRID_SIZE:
+                self.set_en_passant_square((old_square + new_square) // 2)
+            else:
+                self.set_en_passant_square(None)
+
             piece.move(position)
-            # Disable En Passant if not done immediately
-            for enemy_pos in self.tiles:
-                enemy_piece = self.tiles.get(enemy_pos)
-                if (
-                    enemy_piece is not None
-                    and isinstance(enemy_piece, Pawn)
-                    and enemy_piece.color != piece.color
-                ):
-                    enemy_piece.en_passant_vulnerable = False
+        self.put_piece(position, piece)
+
+    def make_move(self, move):
+        """
+        Play an encoded move (see Move.py), including the rook's move when castling,
+        the pawn taken en passant and the new piece on promotion, and switch sides.
+        Everything needed to take it back is pushed on the undo stack.
+        """
+        from_square = move & 63
+        to_square = move >> 6 & 63
+        promotion = move >> 12 & 7
+        flag = move >> 15
+        from_position = SQUARE_POSITIONS[from_square]
+        to_position = SQUARE_POSITIONS[to_square]
+        piece = self.tiles[from_position]
+
+        if flag == EN_PASSANT:
+            # The captured pawn stands beside the moving pawn, not on the target tile
+            captured_position = SQUARE_POSITIONS[to_square + (GRID_SIZE if piece.color == "White" else -GRID_SIZE)]
+        else:
+            captured_position = to_position
+        captured_piece = self.tiles.get(captured_position)
+
+        ply = self.ply
+        if ply == len(self.undo_moved):
+            self.grow_undo_stack()
+        self.undo_moved[ply] = piece
+        self.undo_captured[ply] = captured_piece
+        self.undo_has_moved[ply] = piece.has_moved
+        self.undo_castling_rights[ply] = self.castling_rights
+        self.undo_en_passant[ply] = self.en_passant_square
+        self.undo_halfmove_clock[ply] = self.halfmove_clock
+        self.ply = ply + 1
+
+        if flag == EN_PASSANT:
+            self.put_piece(captured_position, None)
+        self.put_piece(from_position, None)
+        if promotion:
+            new_piece = self.create_piece_instance(PIECE_NAMES[promotion], piece.color, to_position)
+            new_piece.has_moved = True
+            self.put_piece(to_position, new_piece)
+        else:
+            self.put_piece(to_position, piece)
+            piece.position = to_position
+            piece.has_moved = True
+
+        if flag == CASTLING:
+            rook_from, rook_to = self.get_castling_rook_squares(to_square)
+            rook = self.tiles[SQUARE_POSITIONS[rook_from]]
+            self.put_piece(SQUARE_POSITIONS[rook_from], None)
+            self.put_piece(SQUARE_POSITIONS[rook_to], rook)
+            rook.position = SQUARE_POSITIONS[rook_to]
+            rook.has_moved = True
+
+        rights = self.castling_rights & CASTLING_RIGHTS_MASKS[from_square] & CASTLING_RIGHTS_MASKS[to_square]
+        if rights != self.castling_rights:
+            self.set_castling_rights(rights)
+        if flag == DOUBLE_PUSH:
+            self.set_en_passant_square((from_square + to_square) // 2)
+        elif self.en_passant_square is not None:
+            self.set_en_passant_square(None)
+
+        if captured_piece is not None or piece.type_index == PAWN_TYPE:
+            self.halfmove_clock = 0
+        else:
+            self.halfmove_clock += 1
+        if self.side_to_move == "Black":
+            self.fullmove_number += 1
+        self.switch_side()
+
+    def unmake_move(self, move):
+        """
+        Take back the last move played with make_move.
+        """
+        self.ply -= 1
+        ply = self.ply
+        self.switch_side()
+        if self.side_to_move == "Black":
+            self.fullmove_number -= 1
+
+        from_square = move & 63
+        to_square = move >> 6 & 63
+        flag = move >> 15
+        from_position = SQUARE_POSITIONS[from_square]
+        to_position = SQUARE_POSITIONS[to_square]
+        piece = self.undo_moved[ply]
+        captured_piece = self.undo_captured[ply]
+
+        if flag == CASTLING:
+            rook_from, rook_to = self.get_castling_rook_squares(to_square)
+            rook = self.tiles[SQUARE_POSITIONS[rook_to]]
+            self.put_piece(SQUARE_POSITIONS[rook_to], None)
+            self.put_piece(SQUARE_POSITIONS[rook_from], rook)
+            rook.position = SQUARE_POSITIONS[rook_from]
+            # Castling needs an unmoved rook, so it had not moved before either
+            rook.has_moved = False
+
+        if flag == EN_PASSANT:
+            self.put_piece(to_position, None)
+            self.put_piece(captured_piece.position, captured_piece)
+        else:
+            self.put_piece(to_position, captured_piece)
+        self.put_piece(from_position, piece)
+        piece.position = from_position
+        piece.has_moved = self.undo_has_moved[ply]
+
+        if self.castling_rights != self.undo_castling_rights[ply]:
+            self.set_castling_rights(self.undo_castling_rights[ply])
+        if self.en_passant_square != self.undo_en_passant[ply]:
+            self.set_en_passant_square(self.undo_en_passant[ply])
+        self.halfmove_clock = self.undo_halfmove_clock[ply]
+
+        # Drop references so captured pieces can be freed
+        self.undo_moved[ply] = None
+        self.undo_captured[ply] = None
+
+    def grow_undo_stack(self):
+        extra = len(self.undo_moved)
+        self.undo_moved.extend([None] * extra)
+        self.undo_captured.extend([None] * extra)
+        self.undo_has_moved.extend([False] * extra)
+        self.undo_castling_rights.extend([0] * extra)
+        self.undo_en_passant.extend([None] * extra)
+        self.undo_halfmove_clock.extend([0] * extra)
+
+    def get_castling_rook_squares(self, king_target_square):
+        # Kingside the rook jumps from the corner to the king's left, queenside to its right
+        if king_target_square % GRID_SIZE == 6:
+            return king_target_square + 1, king_target_square - 1
+        return king_target_square - 2, king_target_square + 1
+
+    def get_last_captured_piece(self):
+        if self.ply == 0:
+            return None
+        return self.undo_captured[self.ply - 1]
+
+    def get_legal_moves(self, color=None):
+        """
+        Every legal move (encoded, see Move.py) of a color, the side to move by default.
+        They are generated once per position and color and kept until the position changes.
+        """
+        if color is None:
+            color = self.side_to_move
+        key = (self.zobrist_key, color)
+        if key != self.legal_moves_key:
+            # A tuple, as every caller gets the same one
+            self.legal_moves = tuple(self.move_generator.generate_legal_moves(self, color))
+            self.legal_moves_key = key
+        return self.legal_moves
+
+    def find_move(self, old_position, new_position, promotion=QUEEN):
+        """
+        Find the encoded legal move between two tiles, or None.
+        promotion picks the piece when the move is a pawn promotion.
+        """
+        from_square = square_index(old_position)
+        for move in self.get_legal_moves():
+            if move & 63 == from_square and move_positions(move)[1] == new_position and move >> 12 & 7 in (0, promotion):
+                return move
+        return None
+
+    def put_piece(self, position, piece):
+        """
+        Place a piece (or None) on a tile without calling the piece's move function.
+        Every change to self.tiles must go through here so the bitboards stay in sync.
+        """
+        square = position[1] * GRID_SIZE + position[0]
+        old_piece = self.tiles.get(position)
+        if old_piece is not None:
+            color, piece_type = old_piece.color_index, old_piece.type_index
+            self.bitboard.remove_piece(square, color, piece_type)
+            self.zobrist_key ^= PIECE_KEYS[color][piece_type][square]
+            self.mg_scores[color] -= MG_VALUES[color][piece_type][square]
+            self.eg_scores[color] -= EG_VALUES[color][piece_type][square]
+            self.phase -= PHASE_WEIGHTS[piece_type]
+            # Another king may already have been put down elsewhere while pieces are shuffled
+            if piece_type == KING and self.king_squares[color] == square:
+                self.king_squares[color] = None
+        if piece is not None:
+            color, piece_type = piece.color_index, piece.type_index
+            self.bitboard.add_piece(square, color, piece_type)
+            self.zobrist_key ^= PIECE_KEYS[color][piece_type][square]
+            self.mg_scores[color] += MG_VALUES[color][piece_type][square]
+            self.eg_scores[color] += EG_VALUES[color][piece_type][square]
+            self.phase += PHASE_WEIGHTS[piece_type]
+            if piece_type == KING:
+                self.king_squares[color] = square
         self.tiles[position] = piece
 
+    def switch_side(self):
+        self.side_to_move = "Black" if self.side_to_move == "White" else "White"
+        self.zobrist_key ^= SIDE_KEY
+
+    def set_castling_rights(self, rights):
+        self.zobrist_key ^= CASTLING_KEYS[self.castling_rights] ^ CASTLING_KEYS[rights]
+        self.castling_rights = rights
+
+    def set_en_passant_square(self, square):
+        if self.en_passant_square is not None:
+            self.zobrist_key ^= EN_PASSANT_KEYS[self.en_passant_square % GRID_SIZE]
+        if square is not None:
+            self.zobrist_key ^= EN_PASSANT_KEYS[square % GRID_SIZE]
+        self.en_passant_square = square
+
+    def compute_zobrist_key(self):
+        """
+        Hash the position from scratch. Should always equal self.zobrist_key.
+        """
+        key = 0
+        for position, piece in self.tiles.items():
+            if piece is not None:
+                key ^= PIECE_KEYS[piece.color_index][piece.type_index][square_index(position)]
+        if self.side_to_move == "Black":
+            key ^= SIDE_KEY
+        key ^= CASTLING_KEYS[self.castling_rights]
+        if self.en_passant_square is not None:
+            key ^= EN_PASSANT_KEYS[self.en_passant_square % GRID_SIZE]
+        return key
+
     # Get all the valid moves for every piece of a color
     def get_color_valid_moves(self, color):
         ai_pieces = [piece for piece in board.tiles.values() if piece and piece.color == self.color]
@@ -76,44 +348,31 @@ class Board:
         """
         Check if a given position is under attack by any opponent pieces.
         """
-        validators = [
-            VerticalMoveValidator(),
-            HorizontalMoveValidator(),
-            DiagonalMoveValidator(),
-            KnightMoveValidator(),
-            PawnMoveValidator(),
-            SingleMoveValidator()
-        ]
-        for validator in validators:
-            # Calculate valid moves for color per validator
-            moves = validator.get_valid_moves(self, position, color)
-            # Check if any of the moves ends with an enemy piece that has the same validator
-            for move in moves:
-                piece = self.tiles.get(move)
-                if piece is not None:
-                    for piece_validator in piece.move_validators:
-                        if piece_validator.get_type() == validator.get_type():
-                            return True
-        return False
+        return self.bitboard.is_square_attacked(square_index(position), COLOR_INDEX[color] ^ 1)
+
+    def get_attackers(self, position, color):
+        """
+        Positions of the pieces of a color attacking a position.
+        """
+        attackers = self.bitboard.attackers_to(square_index(position), COLOR_INDEX[color])
+        return [SQUARE_POSITIONS[square] for square in iter_squares(attackers)]
 
     def is_king_exposed(self, color):
         """
         Check if the king of the specified color is exposed.
         """
-        # Get king position
-        king_position = self.get_king_position(color)
-
-        # Ensure king_position is a tuple (x, y)
-        if not isinstance(king_position, tuple):
+        color_index = COLOR_INDEX[color]
+        king_square = self.king_squares[color_index]
+        # Positions without a king, such as set up by hand, have nothing to expose
+        if king_square is None:
             return False
-        # Check if the king position is under attack
-        return self.is_position_under_attack(king_position, color)
+        return self.bitboard.is_square_attacked(king_square, color_index ^ 1)
 
     def get_king_position(self, color):
-        for pos, piece in self.tiles.items():
-            if piece is not None and isinstance(piece, King) and piece.color == color:
-                return pos
-        return
+        king_square = self.king_squares[COLOR_INDEX[color]]
+        if king_square is None:
+            return
+        return SQUARE_POSITIONS[king_square]
     
     def create_piece_instance(self, option, color, position):
         # Create an instance of the selected piece based on the option
@@ -137,18 +396,121 @@ class Board:
             black_pawn = Pawn(color="Black", position=(i, 1))
             white_pawn = Pawn(color="White", position=(i, 6))
 
-            self.tiles[(i, 1)] = black_pawn
-            self.tiles[(i, 6)] = white_pawn
+            self.put_piece((i, 1), black_pawn)
+            self.put_piece((i, 6), white_pawn)
 
         for i, piece_type in enumerate(piece_order):
             black_piece = piece_type(color="Black", position=(i, 0))
             white_piece = piece_type(color="White", position=(i, 7))
 
-            self.tiles[(i, 0)] = black_piece
-            self.tiles[(i, 7)] = white_piece
+            self.put_piece((i, 0), black_piece)
+            self.put_piece((i, 7), white_piece)
+
+        self.set_castling_rights(ALL_CASTLING_RIGHTS)
+
+    def set_fen(self, fen):
+        """
+        Set up the position described by a FEN string, replacing the current one.
+        The move counters are optional, so EPD lines (whose operations are ignored) work too.
+        """
+        fields = fen.split()
+        if len(fields) < 4:
+            raise ValueError(f"FEN needs at least 4 fields: {fen}")
+        placement, side, castling, en_passant = fields[:4]
+        # Checked before the board is touched, so a bad FEN leaves the position as it was
+        ranks = placement.split("/")
+        if len(ranks) != GRID_SIZE:
+            raise ValueError(f"FEN placement needs {GRID_SIZE} ranks: {fen}")
+        for rank in ranks:
+            files = 0
+            for char in rank:
+                if char in "12345678":
+                    files += int(char)
+                elif char.lower() in FEN_PIECES:
+                    files += 1
+                else:
+                    raise ValueError(f"bad FEN placement character {char!r}: {fen}")
+            if files != GRID_SIZE:
+                raise ValueError(f"FEN rank {rank} does not cover {GRID_SIZE} files: {fen}")
+        if side not in ("w", "b"):
+            raise ValueError(f"bad FEN side to move {side}: {fen}")
+        if not FEN_CASTLING_PATTERN.fullmatch(castling):
+            raise ValueError(f"bad FEN castling rights {castling}: {fen}")
+        if not FEN_EN_PASSANT_PATTERN.fullmatch(en_passant):
+            raise ValueError(f"bad FEN en passant square {en_passant}: {fen}")
+
+        for position in list(self.tiles):
+            self.put_piece(position, None)
+        self.tiles = {}
+        self.ply = 0
+
+        # FEN lists the black back rank first, like our y coordinate
+        for y, rank in enumerate(ranks):
+            x = 0
+            for char in rank:
+                if char.isdigit():
+                    x += int(char)
+                    continue
+                color = "White" if char.isupper() else "Black"
+                piece = FEN_PIECES[char.lower()](color, (x, y))
+                self.put_piece((x, y), piece)
+                x += 1
+
+        if self.side_to_move != ("White" if side == "w" else "Black"):
+            self.switch_side()
+
+        rights = 0
+        for char in castling:
+            rights |= FEN_CASTLING_RIGHTS.get(char, 0)
+        self.set_castling_rights(rights)
+
+        if en_passant == "-":
+            self.set_en_passant_square(None)
+        else:
+            self.set_en_passant_square(square_index((ord(en_passant[0]) - ord("a"), GRID_SIZE - int(en_passant[1]))))
+
+        self.halfmove_clock = int(fields[4]) if len(fields) > 4 and fields[4].isdigit() else 0
+        self.fullmove_number = int(fields[5]) if len(fields) > 5 and fields[5].isdigit() else 1
+
+        # has_moved only matters for pawns on their start rank and for castling, so infer it from those
+        for position, piece in self.tiles.items():
+            if isinstance(piece, Pawn):
+                piece.has_moved = position[1] != (6 if piece.color == "White" else 1)
+            elif isinstance(piece, (King, Rook)):
+                # Unmoved if a castling right is lost when this square is moved from or captured on
+                piece.has_moved = not rights & ~CASTLING_RIGHTS_MASKS[square_index(position)]
+
+    def get_fen(self):
+        """
+        The position as a FEN string, the inverse of set_fen.
+        """
+        ranks = []
+        for y in range(GRID_SIZE):
+            rank = ""
+            empty = 0
+            for x in range(GRID_SIZE):
+                piece = self.tiles.get((x, y))
+                if piece is None:
+                    empty += 1
+                    continue
+                if empty:
+                    rank += str(empty)
+                    empty = 0
+                letter = FEN_LETTERS[piece.type_index]
+                rank += letter.upper() if piece.color == "White" else letter
+            if empty:
+                rank += str(empty)
+            ranks.append(rank)
+
+        side = "w" if self.side_to_move == "White" else "b"
+        castling = "".join(char for char, right in FEN_CASTLING_RIGHTS.items() if self.castling_rights & right) or "-"
+        en_passant = SQUARE_NAMES[self.en_passant_square] if self.en_passant_square is not None else "-"
+        return f"{'/'.join(ranks)} {side} {castling} {en_passant} {self.halfmove_clock} {self.fullmove_number}"
 
-    def init_display(self, screen):    
-        self.painter = BoardPainter(screen)
+    def init_display(self, screen, show_frame_time=False):
+        # Imported here so the board (and the engine around it) works without pygame
+        from BoardPainter import BoardPainter
+        self.painter = BoardPainter(screen, show_frame_time)
 
 
 
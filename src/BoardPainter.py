@@ -1,5 +1,6 @@
 import pygame
 import os
+import zlib
 from ChessPieces import Piece, King, Queen, Rook, Knight, Bishop, Pawn
 
 
@@ -13,21 +14,52 @@ LIGHT_TILE_COLOR = (227, 193, 111) # White brown
 DARK_TILE_COLOR = (184, 139, 74) # Brown
 HIGHLIGHT_TILE_COLOR = (186, 202, 68) # Light green
 
+# Frames averaged over by the frame time counter
+FRAME_TIME_SAMPLES = 30
+
+# Piece images in the order they are laid out in the atlas
+PIECE_IMAGE_NAMES = [
+    color + "-" + piece
+    for color in ("white", "black")
+    for piece in ("pawn", "knight", "bishop", "rook", "queen", "king")
+]
+# All piece images scaled to the square size in one file, built from the PNGs on first launch
+# and kept in the user's cache directory, never next to the images
+ATLAS_DIRECTORY = os.path.join(os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"), "chess-game")
+
 class BoardPainter:
-    def __init__(self, screen):
-        print(os.getcwd() + "/resources/")
+    def __init__(self, screen, show_frame_time=False):
         self.screen = screen
         self.piece_images = self.load_piece_images(os.getcwd() + "/resources/") # Load all images into board
+        # The empty board, drawn once and copied from to clear squares
+        self.background = self.render_background()
+        # Screen areas drawn on since the last update_display
+        self.dirty_rects = []
+        # Optional average frame time, shown in the window title
+        self.show_frame_time = show_frame_time
+        self.frame_times = []
+
+    def render_background(self):
+        background = pygame.Surface((WIDTH, HEIGHT)).convert()
+        for x in range(GRID_SIZE):
+            for y in range(GRID_SIZE):
+                color = LIGHT_TILE_COLOR if (x + y) % 2 == 0 else DARK_TILE_COLOR
+                pygame.draw.rect(background, color, self.get_tile_rect((x, y)))
+        return background
 
-    def draw_tile(self, position, color):       
+    def get_tile_rect(self, position):
         x, y = position
-        pygame.draw.rect(self.screen, color, (x * SQUARE_SIZE, y * SQUARE_SIZE, SQUARE_SIZE, SQUARE_SIZE))
+        return pygame.Rect(x * SQUARE_SIZE, y * SQUARE_SIZE, SQUARE_SIZE, SQUARE_SIZE)
+
+    def draw_tile(self, position, color):       
+        rect = self.get_tile_rect(position)
+        pygame.draw.rect(self.screen, color, rect)
+        self.dirty_rects.append(rect)
 
     def draw_regular_tile(self, position):
-        x, y = position
-        is_even = (x + y) % 2 == 0
-        color = LIGHT_TILE_COLOR if is_even else DARK_TILE_COLOR
-        self.draw_tile(position, color)
+        rect = self.get_tile_rect(position)
+        self.screen.blit(self.background, rect, rect)
+        self.dirty_rects.append(rect)
 
     def draw_highlighted_tile(self, position):
         center_x = (position[0] * SQUARE_SIZE) + (SQUARE_SIZE // 2) + (WIDTH - GRID_SIZE * SQUARE_SIZE) // 2
@@ -49,15 +81,15 @@ class BoardPainter:
             self.draw_piece(board.tiles.get(move))
 
     def draw_board(self):
-        for x in range(GRID_SIZE):
-            for y in range(GRID_SIZE):
-                self.draw_regular_tile((x, y))
+        self.screen.blit(self.background, (0, 0))
+        self.dirty_rects.append(self.screen.get_rect())
 
     def draw_piece(self, piece):
         if piece is not None:
             png_name = piece.get_png_name()
-            x, y = piece.position
-            self.screen.blit(self.piece_images[png_name], (x * SQUARE_SIZE, y * SQUARE_SIZE))
+            rect = self.get_tile_rect(piece.position)
+            self.screen.blit(self.piece_images[png_name], rect)
+            self.dirty_rects.append(rect)
 
     def draw_all_pieces(self, board):
         for piece in board.tiles.values():
@@ -123,7 +155,7 @@ class BoardPainter:
 
             option_buttons.append((button_rect, promotion))
 
-        pygame.display.flip()
+        pygame.display.update([button_rect for button_rect, option in option_buttons])
 
         while True:
             for event in pygame.event.get():
@@ -142,16 +174,59 @@ class BoardPainter:
         self.draw_board()
         self.draw_all_pieces(board)
 
+    def update_display(self):
+        """
+        Push the squares drawn since the last call to the display. Returns True if there were any.
+        """
+        if not self.dirty_rects:
+            return False
+        # A full redraw covers every smaller area
+        if self.screen.get_rect() in self.dirty_rects:
+            pygame.display.update(self.screen.get_rect())
+        else:
+            pygame.display.update(self.dirty_rects)
+        self.dirty_rects = []
+        return True
+
+    def record_frame_time(self, seconds):
+        # Shown in the title bar, which is outside the board and costs nothing to redraw
+        if not self.show_frame_time:
+            return
+        self.frame_times.append(seconds)
+        if len(self.frame_times) >= FRAME_TIME_SAMPLES:
+            average = sum(self.frame_times) / len(self.frame_times)
+            pygame.display.set_caption(f"Chess Game - {average * 1000:.1f} ms/frame, {max(self.frame_times) * 1000:.1f} ms max")
+            self.frame_times = []
+
     def load_piece_images(self, directory):
-        images = {}
+        # One image load instead of loading and scaling every piece, once the atlas is built.
+        # Named after the image directory too, so that two copies of the game don't share one
+        atlas_path = os.path.join(ATLAS_DIRECTORY, f"atlas-{SQUARE_SIZE}-{zlib.crc32(os.path.abspath(directory).encode()):08x}.png")
+        sources = [os.path.join(directory, name + ".png") for name in PIECE_IMAGE_NAMES]
         try:
-            for filename in os.listdir(directory):
-                if filename.endswith(".png"):
-                    name = os.path.splitext(filename)[0]
-                    path = os.path.join(directory, filename)
-                    image = pygame.image.load(path).convert_alpha()
-                    scaled_image = pygame.transform.scale(image, (SQUARE_SIZE, SQUARE_SIZE))
-                    images[name] = scaled_image
+            if os.path.exists(atlas_path) and os.path.getmtime(atlas_path) >= max(map(os.path.getmtime, sources)):
+                atlas = pygame.image.load(atlas_path)
+            else:
+                atlas = self.build_atlas(sources, atlas_path)
         except FileNotFoundError:
             print(f"Error: Directory not found - {directory}")
-        return images
+            return {}
+        atlas = atlas.convert_alpha()
+        return {
+            name: atlas.subsurface((i * SQUARE_SIZE, 0, SQUARE_SIZE, SQUARE_SIZE))
+            for i, name in enumerate(PIECE_IMAGE_NAMES)
+        }
+
+    def build_atlas(self, sources, atlas_path):
+        atlas = pygame.Surface((len(sources) * SQUARE_SIZE, SQUARE_SIZE), pygame.SRCALPHA)
+        for i, path in enumerate(sources):
+            image = pygame.transform.scale(pygame.image.load(path), (SQUARE_SIZE, SQUARE_SIZE))
+            # Copied as they are, not blended onto the transparent atlas
+            atlas.blit(image, (i * SQUARE_SIZE, 0), special_flags=pygame.BLEND_RGBA_MAX)
+        try:
+            os.makedirs(os.path.dirname(atlas_path), exist_ok=True)
+            pygame.image.save(atlas, atlas_path)
+        except (pygame.error, OSError):
+            # Without a writable cache it is just built in memory every time
+            pass
+        return atlas
@@ -1,11 +1,83 @@
 from Board import Board
+from BitBoard import COLOR_INDEX, WHITE, PAWN, QUEEN, SQUARE_POSITIONS, RANK_MASKS
+from Move import move_promotion, EN_PASSANT
+from MoveOrderer import MoveOrderer
+from PieceSquareTables import MATERIAL_MG, TOTAL_PHASE
+from TranspositionTable import TranspositionTable, EXACT, LOWER_BOUND, UPPER_BOUND
+from SearchStats import SearchStats
+from Tablebase import WIN, LOSS
+import json
 import random
+import time
+
+# Scores are in centipawns
+CHECKMATE_SCORE = 100000
+# Scores further from zero than this are forced mates
+MATE_BOUND = CHECKMATE_SCORE - 1000
+
+# Quiescence search stops this many captures past the leaf and takes the static evaluation
+QUIESCENCE_MAX_DEPTH = 8
+# Safety margin for delta pruning
+DELTA_MARGIN = 200
+DELTA_QUEEN = MATERIAL_MG[QUEEN] + DELTA_MARGIN
+
+# How often (in nodes) the search checks its time and node budget
+CHECK_INTERVAL = 256
 
 class ChessAI:
-    def __init__(self, color):
+    def __init__(
+        self, color, time_budget=2.0, node_budget=None, max_depth=64,
+        tt_memory_mb=16, tt_replacement_policy="depth", trace_path=None, workers=1,
+        book_path=None, tablebase_path=None
+    ):
         self.color = color
+        # Average seconds to think per move, scaled by game phase in allocate_time
+        self.time_budget = time_budget
+        # Optional cap on nodes searched per move, for reproducible searches
+        self.node_budget = node_budget
+        self.max_depth = max_depth
+        # Kept for the whole game so each move reuses what earlier searches found
+        self.transposition_table = TranspositionTable(tt_memory_mb, tt_replacement_policy)
+        self.move_orderer = MoveOrderer()
 
-    def calculate_move(self, board):
+        # State of the current search
+        self.nodes = 0
+        # Nodes searched by quiescence, counted separately from the main search
+        self.qnodes = 0
+        self.deadline = None
+        self.search_stopped = False
+        self.completed_depth = 0
+        # Set from another thread by stop() to end the search as soon as possible, cleared by calculate_move
+        self.stop_requested = False
+        # Optional event that stops the search when set, for searches in other processes
+        self.stop_event = None
+        # Statistics of the last search, replaced by every calculate_move
+        self.stats = SearchStats()
+        # Optional file every iteration and search summary is appended to as a line of JSON
+        self.trace_path = trace_path
+        # Optional function called with each finished iteration (see SearchStats.add_iteration)
+        self.info_callback = None
+        # With more than one worker, root moves are searched in parallel by a pool of processes.
+        # One worker searches in this process only, which keeps results reproducible
+        self.parallel_search = None
+        # The optional parts are imported only when used, so a plain ChessAI starts quickly
+        if workers > 1:
+            from ParallelSearch import ParallelRootSearch
+            self.parallel_search = ParallelRootSearch(workers, color, tt_memory_mb, tt_replacement_policy, tablebase_path)
+        # Optional opening book, played from without searching while it has moves for the position
+        self.opening_book = None
+        if book_path:
+            from OpeningBook import OpeningBook
+            self.opening_book = OpeningBook(book_path)
+        # Picks among book moves; seed it for repeatable games
+        self.random = random.Random()
+        # Optional directory of endgame tables, probed at the root and inside the search
+        self.tablebase = None
+        if tablebase_path:
+            from Tablebase import Tablebase
+            self.tablebase = Tablebase(tablebase_path)
+
+    def calculate_move(self, board, ponder=False, move_time=None):
         # Implement the minimax algorithm with alpha-beta pruning to determine the best move
         # ...
         # Return the best move (in the format used by your code)
@@ -27,100 +99,389 @@ class ChessAI:
         return None
         '''
 
-        _ , best_move = self.minimax(board, 3, "Black")
-        #print(_)
-        #print(f"AI Move: {best_move}")
+        self.stats = SearchStats()
+        # A stop is meant for the search running when it was asked for, not this one
+        self.stop_requested = False
+        if self.opening_book is not None and not ponder:
+            book_move = self.opening_book.choose_move(board, self.random)
+            if book_move is not None:
+                self.stats.best_move = book_move
+                return book_move
+        if self.tablebase is not None and not ponder:
+            tablebase_move = self.choose_tablebase_move(board)
+            if tablebase_move is not None:
+                return tablebase_move
+
+        self.transposition_table.new_search()
+        self.move_orderer.new_search()
+        start_time = time.perf_counter()
+        # A ponder search runs on the opponent's time until it is stopped.
+        # move_time, in seconds, overrides the time allocated from time_budget
+        if ponder:
+            move_time = float('inf')
+        elif move_time is None:
+            move_time = self.allocate_time(board)
+        self.deadline = start_time + move_time
+        self.nodes = 0
+        self.qnodes = 0
+        self.search_stopped = False
+        self.completed_depth = 0
+        tt_probes = self.transposition_table.probes
+        tt_hits = self.transposition_table.hits
+        tablebase_hits = self.tablebase.hits if self.tablebase is not None else 0
+        trace_file = open(self.trace_path, "a") if self.trace_path else None
+
+        # Iterative deepening: search depth 1, 2, 3... and keep the move of the last depth that finished
+        best_move = None
+        for depth in range(1, self.max_depth + 1):
+            iteration_start = time.perf_counter()
+            nodes, qnodes = self.nodes, self.qnodes
+            score, move = self.search_root(board, depth)
+            if self.search_stopped:
+                break
+            best_move = move
+            self.completed_depth = depth
+            self.stats.depth = depth
+            self.stats.score = score
+            iteration = self.stats.add_iteration(
+                depth, score, move, self.nodes - nodes, self.qnodes - qnodes, time.perf_counter() - iteration_start
+            )
+            if trace_file is not None:
+                trace_file.write(json.dumps(dict(iteration, type="iteration")) + "\n")
+            if self.info_callback is not None:
+                self.info_callback(iteration)
+
+            if best_move is None or abs(score) > MATE_BOUND:
+                break
+            # The next depth takes several times as long, so don't start one that cannot finish
+            if time.perf_counter() - start_time > move_time / 2:
+                break
+
+        stats = self.stats
+        stats.best_move = best_move
+        stats.nodes = self.nodes
+        stats.qnodes = self.qnodes
+        stats.elapsed = time.perf_counter() - start_time
+        stats.tt_probes = self.transposition_table.probes - tt_probes
+        stats.tt_hits = self.transposition_table.hits - tt_hits
+        stats.cutoffs_by_index = list(self.move_orderer.cutoff_counts)
+        if self.tablebase is not None:
+            stats.tablebase_hits = self.tablebase.hits - tablebase_hits
+        if trace_file is not None:
+            trace_file.write(json.dumps(dict(stats.to_dict(), type="search")) + "\n")
+            trace_file.close()
 
         return best_move
 
+    def get_principal_variation(self, board, max_length):
+        """
+        The line the search expects, following the best moves stored in the transposition table.
+        """
+        line = []
+        while len(line) < max_length:
+            entry = self.transposition_table.probe(board.zobrist_key)
+            if entry is None or entry[3] not in board.move_generator.generate_legal_moves(board, board.side_to_move):
+                break
+            line.append(entry[3])
+            board.make_move(entry[3])
+        for move in reversed(line):
+            board.unmake_move(move)
+        return line
+
+    def choose_tablebase_move(self, board):
+        """
+        The move the endgame tables rate best: the fastest mate, else a draw, else the slowest
+        loss. None when the position or any position after it is not in the tables.
+        """
+        if self.tablebase.probe(board) is None:
+            return None
+        best_move = None
+        best_rank = None
+        best_result = None
+        for move in board.get_legal_moves():
+            board.make_move(move)
+            result = self.tablebase.probe(board)
+            board.unmake_move(move)
+            if result is None:
+                return None
+            # Results are for the opponent, who moves next
+            outcome, plies = result
+            rank = (-outcome, -plies if outcome == LOSS else plies)
+            if best_rank is None or rank > best_rank:
+                best_move, best_rank, best_result = move, rank, (-outcome, plies + 1)
+        if best_move is not None:
+            self.stats.best_move = best_move
+            self.stats.score = self.tablebase_score(best_result, 0, True)
+        return best_move
+
+    def tablebase_score(self, result, ply, maximizing):
+        # Table results are for the side to move, with mates counted in plies from the position itself
+        outcome, plies = result
+        if outcome == WIN:
+            score = CHECKMATE_SCORE - ply - plies
+        elif outcome == LOSS:
+            score = -(CHECKMATE_SCORE - ply - plies)
+        else:
+            score = 0
+        return score if maximizing else -score
+
+    def search_root(self, board, depth):
+        # Depth 1 is over too quickly to be worth handing out
+        if self.parallel_search is None or depth == 1:
+            return self.minimax(board, depth, self.color)
+        return self.parallel_search.search(self, board, depth)
+
+    def set_color(self, color):
+        """
+        Search for the other side from now on. Stored scores are from our point of view,
+        so the transposition table and move ordering are started afresh.
+        """
+        if color == self.color:
+            return
+        self.color = color
+        self.transposition_table.clear()
+        self.move_orderer = MoveOrderer()
+
+    def close(self):
+        # Stop the worker processes, if any, and release the book and tables
+        if self.parallel_search is not None:
+            self.parallel_search.shutdown()
+        if self.opening_book is not None:
+            self.opening_book.close()
+        if self.tablebase is not None:
+            self.tablebase.close()
+
+    def get_game_phase(self, board):
+        """
+        Returns 1.0 with all pieces on the board down to 0.0 with only kings and pawns.
+        """
+        return min(board.phase, TOTAL_PHASE) / TOTAL_PHASE
+
+    def allocate_time(self, board):
+        # Openings are predictable and endgames narrow, so the middlegame gets the most time
+        phase = self.get_game_phase(board)
+        if phase > 0.85:
+            return self.time_budget * 0.5
+        if phase > 0.35:
+            return self.time_budget * 1.25
+        return self.time_budget * 0.75
+
+    def stop(self):
+        self.stop_requested = True
+
+    def check_limits(self):
+        if self.stop_requested or (self.stop_event is not None and self.stop_event.is_set()):
+            return True
+        # Depth 1 always completes so there is a move to return
+        if self.completed_depth == 0:
+            return False
+        if self.node_budget is not None and self.nodes >= self.node_budget:
+            return True
+        return time.perf_counter() >= self.deadline
+
 
     def evaluate_board(self, board, color):
-        piece_values = {
-            'Pawn': 1,
-            'Knight': 3,
-            'Bishop': 3,
-            'Rook': 5,
-            'Queen': 9,
-            'King': 10
-        }
-
-        my_score = 0
-        opponent_score = 0
-
-        for piece in board.tiles.values():
-            if piece:
-                if piece.color == color:
-                    my_score += piece_values.get(piece.get_piece_type(), 0)
-                else:
-                    opponent_score += piece_values.get(piece.get_piece_type(), 0)
-        print(str(my_score) + "," + str(opponent_score))
-        return my_score - opponent_score
+        # Blend the middlegame and endgame totals Board keeps up to date by how much material is left
+        phase = board.phase if board.phase < TOTAL_PHASE else TOTAL_PHASE
+        mg_scores = board.mg_scores
+        eg_scores = board.eg_scores
+        score = (
+            (mg_scores[0] - mg_scores[1]) * phase + (eg_scores[0] - eg_scores[1]) * (TOTAL_PHASE - phase)
+        ) // TOTAL_PHASE
+        return score if color == "White" else -score
 
-    def minimax(self, board, depth, maximizing_player, alpha=float('-inf'), beta=float('inf')):
+    def minimax(self, board, depth, maximizing_player, alpha=float('-inf'), beta=float('inf'), ply=0):
+        # Scores are always from the AI's point of view: it maximises, its opponent minimises
         if depth == 0:
-            return self.evaluate_board(board, maximizing_player), None
-        #print("depth " + str(depth))
-        print("alpha " + str(alpha) + " and beta " + str(beta))
-        black_player_pieces = [piece for piece in board.tiles.values() if piece is not None and piece.color == "Black"]
-        white_player_pieces = [piece for piece in board.tiles.values() if piece is not None and piece.color == "White"]
+            return self.quiescence(board, maximizing_player, alpha, beta, ply), None
+        self.nodes += 1
+        if (self.nodes + self.qnodes) % CHECK_INTERVAL == 0 and self.check_limits():
+            self.search_stopped = True
+        if self.search_stopped:
+            return 0, None
+        maximizing = maximizing_player == self.color
+        alpha_original, beta_original = alpha, beta
+
+        # With few enough pieces left the tables know the exact result
+        if self.tablebase is not None and ply > 0:
+            result = self.tablebase.probe(board)
+            if result is not None:
+                return self.tablebase_score(result, ply, maximizing), None
 
+        # board.zobrist_key includes the side to move, which is switched with every move below
+        key = board.zobrist_key
+        hash_move = 0
+        entry = self.transposition_table.probe(key)
+        if entry is not None:
+            entry_depth, bound, score, hash_move = entry
+        if entry is not None and ply > 0:
+            if entry_depth >= depth:
+                score = self.score_from_table(score, ply)
+                if bound == EXACT:
+                    return score, None
+                if bound == LOWER_BOUND:
+                    alpha = max(alpha, score)
+                else:
+                    beta = min(beta, score)
+                if beta <= alpha:
+                    return score, None
+
+        if ply == 0:
+            # The root's moves come from the board's cache, shared with the game and every iteration
+            moves = board.get_legal_moves(maximizing_player)
+        else:
+            moves = board.move_generator.generate_legal_moves(board, maximizing_player)
+        if not moves:
+            # Checkmate or stalemate. Mates found sooner score further from zero
+            if not board.is_king_exposed(maximizing_player):
+                return 0, None
+            if maximizing:
+                return -(CHECKMATE_SCORE - ply), None
+            return CHECKMATE_SCORE - ply, None
+
+        color_index = COLOR_INDEX[maximizing_player]
+        moves = self.move_orderer.order_moves(board, moves, color_index, hash_move, ply)
+
+        opponent = "White" if maximizing_player == "Black" else "Black"
+        moves_searched = 0
+        best_eval = float('-inf') if maximizing else float('inf')
         best_move = None
-        if maximizing_player == "Black":
-            max_eval = float('-inf')
-            for piece in black_player_pieces:
-                valid_moves = piece.calculate_valid_moves(board)
-                for move in valid_moves:
-                    if depth:
-                        print("piece : " + str(piece) + " | depth: " + str(depth) + " | current eval: " + str(alpha) + " | move: " + str(move))
-                    original_position = piece.position
-
-                    captured_piece = board.tiles[move]
-                    board.tiles[original_position] = None
-                    piece.position = move
-                    board.tiles[move] = piece
-                    eval, _ = self.minimax(board, depth - 1, "White", alpha, beta)
-                    piece.position = original_position
-                    board.tiles[original_position] = piece
-                    board.tiles[move] = captured_piece
-
-                    if eval > max_eval:
-                        max_eval = eval
-                        best_move = (piece.position, move)
-                        #print("new best move!")
-                    #print("eval for " + str(piece) +  ": " + str(eval))
-                    alpha = max(alpha, max_eval)
-
-                    if beta <= alpha:
-                        print("PRUNING")
-                        break
-            return max_eval, best_move
+        for encoded_move in moves:
+            board.make_move(encoded_move)
+            eval, _ = self.minimax(board, depth - 1, opponent, alpha, beta, ply + 1)
+            board.unmake_move(encoded_move)
+
+            # Out of time or nodes: unwind without trusting or storing anything from this node
+            if self.search_stopped:
+                return 0, None
+            moves_searched += 1
+
+            if maximizing:
+                if eval > best_eval:
+                    best_eval = eval
+                    best_move = encoded_move
+                alpha = max(alpha, best_eval)
+            else:
+                if eval < best_eval:
+                    best_eval = eval
+                    best_move = encoded_move
+                beta = min(beta, best_eval)
+
+            if beta <= alpha:
+                self.move_orderer.record_cutoff(board, encoded_move, color_index, depth, ply, moves_searched - 1)
+                break
 
+        if best_eval <= alpha_original:
+            bound = UPPER_BOUND
+        elif best_eval >= beta_original:
+            bound = LOWER_BOUND
         else:
-            min_eval = float('inf')
-            for piece in white_player_pieces:
-                valid_moves = piece.calculate_valid_moves(board)
-                for move in valid_moves:
-                    if depth:
-                        print("piece : " + str(piece) + " | depth: " + str(depth) + " | current eval: " + str(alpha) + " | move: " + str(move))                    
-                    original_position = piece.position
-
-                    captured_piece = board.tiles[move]
-                    board.tiles[original_position] = None
-                    piece.position = move
-                    board.tiles[move] = piece
-                    eval, _ = self.minimax(board, depth - 1, "Black", alpha, beta)
-                    eval = -eval
-                    piece.position = original_position
-                    board.tiles[original_position] = piece
-                    board.tiles[move] = captured_piece
-
-                    if eval < min_eval:
-                        min_eval = eval
-                        best_move = (original_position, move)
-                    beta = min(beta, min_eval)
-
-                    if beta <= alpha:
-                        print("PRUNING")
-                        break
-            return min_eval, best_move
+            bound = EXACT
+        self.transposition_table.store(key, depth, bound, self.score_to_table(best_eval, ply), best_move or 0)
+        return best_eval, best_move
+
+    def quiescence(self, board, player, alpha, beta, ply, quiescence_depth=0):
+        """
+        Search only captures and promotions until the position is quiet, so that
+        leaves are not scored in the middle of an exchange. The side to move may
+        "stand pat" on the static evaluation instead of capturing. When in check,
+        every evasion is searched instead.
+        """
+        self.qnodes += 1
+        if (self.nodes + self.qnodes) % CHECK_INTERVAL == 0 and self.check_limits():
+            self.search_stopped = True
+        if self.search_stopped:
+            return 0
+
+        maximizing = player == self.color
+        stand_pat = self.evaluate_board(board, self.color)
+        # Bounds the extra nodes spent per leaf
+        if quiescence_depth >= QUIESCENCE_MAX_DEPTH:
+            return stand_pat
+
+        in_check = board.is_king_exposed(player)
+        color_index = COLOR_INDEX[player]
+        if in_check:
+            moves = board.move_generator.generate_legal_moves(board, player)
+            if not moves:
+                return -(CHECKMATE_SCORE - ply) if maximizing else CHECKMATE_SCORE - ply
+            best_eval = float('-inf') if maximizing else float('inf')
+        else:
+            if maximizing:
+                if stand_pat >= beta:
+                    return stand_pat
+                # Delta pruning: even winning a queen would not get back to alpha
+                if stand_pat + DELTA_QUEEN < alpha:
+                    return stand_pat
+                alpha = max(alpha, stand_pat)
+            else:
+                if stand_pat <= alpha:
+                    return stand_pat
+                if stand_pat - DELTA_QUEEN > beta:
+                    return stand_pat
+                beta = min(beta, stand_pat)
+            best_eval = stand_pat
+
+            bitboard = board.bitboard
+            enemy = bitboard.colors[color_index ^ 1]
+            promotion_rank = RANK_MASKS[0] if color_index == WHITE else RANK_MASKS[7]
+            to_mask = enemy | promotion_rank
+            if board.en_passant_square is not None:
+                to_mask |= 1 << board.en_passant_square
+            moves = [
+                move for move in board.move_generator.generate_legal_moves(board, player, to_mask=to_mask)
+                if enemy >> (move >> 6 & 63) & 1 or move >> 12 & 7 or move >> 15 == EN_PASSANT
+            ]
+
+        moves = self.move_orderer.order_moves(board, moves, color_index, 0, ply)
+        opponent = "White" if player == "Black" else "Black"
+        for encoded_move in moves:
+            promotion = move_promotion(encoded_move)
+            # Underpromotions rarely matter for settling captures, but in check every evasion is searched
+            if promotion not in (0, QUEEN) and not in_check:
+                continue
+            if not in_check:
+                # Delta pruning per move: skip captures that cannot bring the score back to the window
+                victim = board.tiles.get(SQUARE_POSITIONS[encoded_move >> 6 & 63])
+                if victim is not None:
+                    gain = MATERIAL_MG[victim.type_index]
+                else:
+                    gain = MATERIAL_MG[PAWN] if encoded_move >> 15 == EN_PASSANT else 0
+                if promotion:
+                    gain += MATERIAL_MG[QUEEN] - MATERIAL_MG[PAWN]
+                if maximizing and stand_pat + gain + DELTA_MARGIN <= alpha:
+                    continue
+                if not maximizing and stand_pat - gain - DELTA_MARGIN >= beta:
+                    continue
+
+            board.make_move(encoded_move)
+            eval = self.quiescence(board, opponent, alpha, beta, ply + 1, quiescence_depth + 1)
+            board.unmake_move(encoded_move)
+            if self.search_stopped:
+                return 0
+
+            if maximizing:
+                best_eval = max(best_eval, eval)
+                alpha = max(alpha, best_eval)
+            else:
+                best_eval = min(best_eval, eval)
+                beta = min(beta, best_eval)
+            if beta <= alpha:
+                break
+
+        return best_eval
+
+    # Mate scores count plies from the root; the table stores them counted from the position itself
+    def score_to_table(self, score, ply):
+        if score > MATE_BOUND:
+            return score + ply
+        if score < -MATE_BOUND:
+            return score - ply
+        return score
 
+    def score_from_table(self, score, ply):
+        if score > MATE_BOUND:
+            return score - ply
+        if score < -MATE_BOUND:
+            return score + ply
+        return score
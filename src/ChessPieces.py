@@ -1,21 +1,33 @@
 from MoveValidator import (
-    VerticalMoveValidator, 
-    HorizontalMoveValidator, 
-    DiagonalMoveValidator, 
-    KnightMoveValidator, 
-    SingleMoveValidator, 
-    PawnMoveValidator
+    VERTICAL_MOVE_VALIDATOR,
+    HORIZONTAL_MOVE_VALIDATOR,
+    DIAGONAL_MOVE_VALIDATOR,
+    KNIGHT_MOVE_VALIDATOR,
+    SINGLE_MOVE_VALIDATOR,
+    PAWN_MOVE_VALIDATOR
 )
+from BitBoard import COLOR_INDEX, SQUARE_POSITIONS, PAWN, KNIGHT, BISHOP, ROOK, QUEEN, KING, square_index
 GRID_SIZE = 8
 
 class Piece:
+    # Pieces keep no __dict__; subclasses add no fields and declare empty slots
+    __slots__ = ("color", "color_index", "position", "has_moved", "valid_moves")
+
+    # Index of the piece's occupancy set in board.bitboard, set by each subclass
+    type_index = None
+    # Shared validators for the piece's moves, set by each subclass
+    move_validators = ()
+
     def __init__(self, color, position):
         self.color = color
+        self.color_index = COLOR_INDEX[color]
         self.position = position
-        self.move_validators = []
-        self.valid_moves = []     
+        self.has_moved = False
+        # Filled in by set_valid_moves when the piece is selected
+        self.valid_moves = ()
 
     def move(self, position):
+        self.has_moved = True
         self.position = position
 
     def get_png_name(self):
@@ -32,6 +44,23 @@ class Piece:
             if move == position: return True
 
     def calculate_valid_moves(self, board):
+        square = square_index(self.position)
+        valid_moves = []
+        for move in board.get_legal_moves(self.color):
+            if move & 63 != square:
+                continue
+            # The four promotion choices share a target tile
+            target = SQUARE_POSITIONS[move >> 6 & 63]
+            if target not in valid_moves:
+                valid_moves.append(target)
+        return valid_moves
+
+    '''
+    Reference generator that plays every pseudo-legal move and tests whether the
+    king is left exposed. Much slower than calculate_valid_moves; it is kept to
+    cross-check MoveGenerator (see MoveGenerator.py).
+    '''
+    def calculate_tested_moves(self, board):
 
         valid_moves = []
         for validator in self.move_validators:
@@ -48,8 +77,8 @@ class Piece:
                 This helps us perform calculations on temporary board states
                 '''
 
-                board.tiles[original_position] = None
-                board.tiles[move] = self
+                board.put_piece(original_position, None)
+                board.put_piece(move, self)
 
                 # Check if the king is exposed
                 if not board.is_king_exposed(self.color):
@@ -57,8 +86,8 @@ class Piece:
 
                 # Undo the temporary move
 
-                board.tiles[move] = temp_piece
-                board.tiles[original_position] = self
+                board.put_piece(move, temp_piece)
+                board.put_piece(original_position, self)
 
             valid_moves.extend(filtered_moves)
 
@@ -72,24 +101,13 @@ class Piece:
         return self.valid_moves
 
 class Pawn(Piece):
-    def __init__(self, color, position):
-        super().__init__(color, position)
-        self.move_validators.extend([
-            PawnMoveValidator()
-        ])
-        self.has_moved = False
-        self.en_passant_vulnerable = False
-    
-    def move(self, position):
-        # Check if the pawn moved two squares, making it vulnerable to en passant
-        self.en_passant_vulnerable = abs(position[1] - self.position[1]) == 2
-
-        self.has_moved = True
-        super().move(position)
+    type_index = PAWN
+    __slots__ = ()
+    move_validators = (PAWN_MOVE_VALIDATOR,)
     
-    def calculate_valid_moves(self, board):
+    def calculate_tested_moves(self, board):
 
-        valid_moves = super().calculate_valid_moves(board)
+        valid_moves = super().calculate_tested_moves(board)
 
         y_direction = -1 if self.color == "White" else 1
 
@@ -104,68 +122,54 @@ class Pawn(Piece):
                     check_piece is not None 
                     and isinstance(check_piece, Pawn) 
                     and check_piece.color != self.color 
-                    and check_piece.en_passant_vulnerable
+                    # The enemy pawn has just moved two squares, past the tile we would capture on
+                    and board.en_passant_square == square_index((pos[0], pos[1] + y_direction))
                 ):
                     new_move = (pos[0], pos[1] + y_direction)
-                    valid_moves.append(new_move)
+                    # Both pawns leave the rank, which can uncover an attack on the king
+                    original_position = self.position
+                    board.put_piece(pos, None)
+                    board.put_piece(original_position, None)
+                    board.put_piece(new_move, self)
+                    if not board.is_king_exposed(self.color):
+                        valid_moves.append(new_move)
+                    board.put_piece(new_move, None)
+                    board.put_piece(original_position, self)
+                    board.put_piece(pos, check_piece)
         
         return valid_moves
 
 
 class Knight(Piece):
-    def __init__(self, color, position):
-        super().__init__(color, position)
-        self.move_validators.extend([
-            KnightMoveValidator()
-        ])
+    type_index = KNIGHT
+    __slots__ = ()
+    move_validators = (KNIGHT_MOVE_VALIDATOR,)
 
 
 class Bishop(Piece):
-    def __init__(self, color, position):
-        super().__init__(color, position)
-        self.move_validators.extend([
-            DiagonalMoveValidator()
-        ])
+    type_index = BISHOP
+    __slots__ = ()
+    move_validators = (DIAGONAL_MOVE_VALIDATOR,)
 
 
 class Rook(Piece):
-    def __init__(self, color, position):
-        super().__init__(color, position)
-        self.move_validators.extend([
-            VerticalMoveValidator(),
-            HorizontalMoveValidator()        
-        ])
-        self.has_moved = False
-
-    def move(self, position):
-        self.has_moved = True
-        self.position = position
+    type_index = ROOK
+    __slots__ = ()
+    move_validators = (VERTICAL_MOVE_VALIDATOR, HORIZONTAL_MOVE_VALIDATOR)
 
 
 class Queen(Piece):
-    def __init__(self, color, position):
-        super().__init__(color, position)
-        self.move_validators.extend([
-            VerticalMoveValidator(),
-            HorizontalMoveValidator(),
-            DiagonalMoveValidator()
-        ])
+    type_index = QUEEN
+    __slots__ = ()
+    move_validators = (VERTICAL_MOVE_VALIDATOR, HORIZONTAL_MOVE_VALIDATOR, DIAGONAL_MOVE_VALIDATOR)
 
 class King(Piece):
-    def __init__(self, color, position):
-        super().__init__(color, position)
-        self.move_validators.extend([
-            SingleMoveValidator()
-        ])
-        self.has_moved = False
-        
-    def move(self, position):
-        #print("Moving " + str(self))
-        self.has_moved = True
-        self.position = position
+    type_index = KING
+    __slots__ = ()
+    move_validators = (SINGLE_MOVE_VALIDATOR,)
 
-    def calculate_valid_moves(self, board):
-        valid_moves = super().calculate_valid_moves(board)
+    def calculate_tested_moves(self, board):
+        valid_moves = super().calculate_tested_moves(board)
 
         # Check kingside castling
         if (
@@ -202,7 +206,10 @@ class King(Piece):
 
         for i in range(self.position[0] - 1, 0, -1):
             piece = board.tiles.get((i, self.position[1]))
-            if piece is not None or board.is_position_under_attack((i, self.position[1]), self.color):
+            if piece is not None:
+                return False
+            # Only the squares the king crosses need to be safe, not the one beside the rook
+            if i >= self.position[0] - 2 and board.is_position_under_attack((i, self.position[1]), self.color):
                 return False
         rook = board.tiles.get((0, self.position[1]))
         return isinstance(rook, Rook) and not rook.has_moved
\ No newline at end of file
@@ -1,5 +1,6 @@
 import pygame
 import sys
+import time
 from GameHandler import GameHandler
 from Board import Board
 from Player import Player
@@ -14,15 +15,15 @@ LIGHT_TILE_COLOR = (227, 193, 111) # White brown
 DARK_TILE_COLOR = (184, 139, 74) # Brown
 HIGHLIGHT_TILE_COLOR = (186, 202, 68) # Light green
 
-# Initialize all Pygame modules (draw, display, color, etc.)
-pygame.init()
-
 class Game:
-    def __init__(self):
+    def __init__(self, show_frame_time=False):
+        # Only the display is used (drawing, images and events need nothing else), and it is
+        # started here rather than on import so that importing this module stays cheap
+        pygame.display.init()
         self.screen = pygame.display.set_mode((WIDTH, HEIGHT))
         pygame.display.set_caption("Chess Game")
         self.board = Board()
-        self.handler = GameHandler(self.screen, self.board)
+        self.handler = GameHandler(self.screen, self.board, show_frame_time=show_frame_time)
 
     def main(self): 
 
@@ -32,22 +33,31 @@ class Game:
         clock = pygame.time.Clock()
         FRAME_RATE = 15
 
-        pygame.display.flip()
+        painter = self.board.painter
+        painter.update_display()
         # Main game loop
         while True:
+            frame_start = time.perf_counter()
             for event in pygame.event.get():
                 if event.type == pygame.QUIT:
+                    self.handler.close()
                     pygame.quit()
                     sys.exit()
                 elif event.type == pygame.MOUSEBUTTONDOWN: 
                     self.handler.handle_mouse_click(event)
-                    pygame.display.flip()
-            
+
+            # Play the AI's move once its search has finished
+            self.handler.update()
+            # Only the squares drawn on this frame are sent to the display
+            painter.update_display()
+            painter.record_frame_time(time.perf_counter() - frame_start)
+
             clock.tick(FRAME_RATE)
 
             
 
 
 if __name__ == "__main__":
-    game = Game()
+    # --frame-time shows how long each frame takes in the window title
+    game = Game(show_frame_time="--frame-time" in sys.argv)
     game.main()
\ No newline at end of file
@@ -1,14 +1,22 @@
 import pygame
+import os
 from ChessPieces import Piece, King, Queen, Rook, Knight, Bishop, Pawn
 from StateChecker import StateChecker
 from Board import Board
 from Player import Player
 from ChessAI import ChessAI
+from BackgroundSearch import BackgroundSearch
+from BitBoard import PIECE_NAMES, QUEEN, SQUARE_POSITIONS
+from Move import move_positions, move_flag, move_promotion, CASTLING, EN_PASSANT
 
 # Constants
 WIDTH, HEIGHT = 600, 600
 GRID_SIZE = 8
 SQUARE_SIZE = WIDTH // GRID_SIZE
+# Opening book the AI plays from when one has been built (see OpeningBook.py)
+BOOK_PATH = os.getcwd() + "/resources/book.bin"
+# Endgame tables the AI plays from when they have been built (see TablebaseGenerator.py)
+TABLEBASE_PATH = os.getcwd() + "/resources/tablebases"
 
 # Colors
 LIGHT_TILE_COLOR = (227, 193, 111) # White brown
@@ -16,12 +24,19 @@ DARK_TILE_COLOR = (184, 139, 74) # Brown
 HIGHLIGHT_TILE_COLOR = (186, 202, 68) # Light green
 
 class GameHandler():
-    def __init__(self, screen, board):
+    def __init__(self, screen, board, ponder=False, show_frame_time=False):
         self.screen = screen
         self.board = board
-        self.board.init_display(self.screen)
+        self.board.init_display(self.screen, show_frame_time)
         self.state_checker = StateChecker()
-        self.ai = ChessAI("Black")
+        self.ai = ChessAI(
+            "Black", book_path=BOOK_PATH if os.path.exists(BOOK_PATH) else None,
+            tablebase_path=TABLEBASE_PATH if os.path.isdir(TABLEBASE_PATH) else None
+        )
+        # The AI thinks on a background thread, see update()
+        self.background_search = BackgroundSearch(self.ai)
+        # Let the AI keep searching on the human's time
+        self.ponder = ponder
         self.white_player = Player(player_type="White")
         self.black_player = Player(player_type="Black")
         self.player_turn = "White"
@@ -37,6 +52,9 @@ class GameHandler():
         # Clicked outside the chessboard, do nothing
         if not (0 <= pos_x < GRID_SIZE and 0 <= pos_y < GRID_SIZE):
             return
+        # The AI is still thinking about its move
+        if self.background_search.is_thinking():
+            return
 
         #print(f"Clicked on square ({pos_x}, {pos_y})")
         if self.player_turn == "White":
@@ -83,24 +101,8 @@ class GameHandler():
         # If we want to capture
         if (old_piece.color != new_piece.color) and (new_position in old_piece.get_valid_moves()):
 
-            # Moving selected piece to new position after capture
-            self.board.set_piece_at_position(old_piece, new_position)
             self.board.set_selected_piece(None)
-            self.board.set_piece_at_position(None, old_position)
-
-            if old_piece.color == "White":
-                self.white_player.capture_piece(new_piece)
-            else:
-                self.black_player.capture_piece(new_piece)
-
-            # Update graphics
-            self.board.painter.draw_capture(self.board, old_piece, old_position)
-
-            self.handle_promotion(old_piece)
-
-            # Change player turn
-            self.switch_turn()
-            self.state_checker.check_if_lost(self.board, self.player_turn)
+            self.play_move(self.find_player_move(old_piece, new_position))
             self.handle_ai_move()
 
         elif (old_piece.color == new_piece.color):
@@ -123,95 +125,68 @@ class GameHandler():
             return
         if position in sp.get_valid_moves():
 
-            old_position = sp.position
-            # Remove the piece's old position in pieces_on_board
-            self.board.set_piece_at_position(None, old_position)
             # Clear the currently selected piece
             self.board.set_selected_piece(None)
-            # Update the position in pieces_on_board
-            self.board.set_piece_at_position(sp, position) 
-
-            self.board.painter.draw_move_to_empty_tile(self.board, sp, old_position)
-
-            self.handle_castling(sp, old_position)
-            self.handle_en_passant(sp, old_position)
-            self.handle_promotion(sp)
-
-            self.switch_turn()
-            self.state_checker.check_if_lost(self.board, self.player_turn)
+            self.play_move(self.find_player_move(sp, position))
             self.handle_ai_move()
 
-    def handle_castling(self, piece, old_position):
-
-        if (isinstance(piece, King)) and (old_position[0] - piece.position[0] == 2):
-
-            rook = self.board.tiles.get((0, piece.position[1]))
-            self.board.set_piece_at_position(None, (0, piece.position[1]))
-            self.board.set_piece_at_position(rook, (piece.position[0] + 1, piece.position[1]))
-            self.board.painter.draw_move_to_empty_tile(self.board, rook, (0, piece.position[1]))
-
-        # If King is castling right
-        elif (isinstance(piece, King)) and (piece.position[0] - old_position[0] == 2):
-
-            rook = self.board.tiles.get((7, piece.position[1]))
-            self.board.set_piece_at_position(None, (7, piece.position[1]))
-            self.board.set_piece_at_position(rook, (piece.position[0] - 1, piece.position[1]))
-            self.board.painter.draw_move_to_empty_tile(self.board, rook, (7, piece.position[1]))
-
-    def handle_en_passant(self, piece, old_position): 
-
-        if (
-            isinstance(piece, Pawn)
-            and abs(old_position[0] - piece.position[0]) == 1  # Diagonal move
-            and abs(old_position[1] - piece.position[1]) == 1  # Diagonal move
-        ):
-            # Determine the position of the passed pawn
-            passed_pawn_position = (piece.position[0], old_position[1])
-
-            # Remove the passed pawn from the board
-            passed_pawn = self.board.tiles.pop(passed_pawn_position, None)
-
-            # Update the graphics
-            if passed_pawn:
-                self.board.painter.draw_regular_tile(passed_pawn_position)
-                if piece.color == "White":
-                    self.white_player.capture_piece(passed_pawn)
-                else:
-                    self.black_player.capture_piece(passed_pawn)
-
-    def handle_promotion(self, piece):
-
-        if not isinstance(piece, Pawn):
-            return
-        if (piece.color == "White" and piece.position[1] == 0) or (piece.color == "Black" and piece.position[1]) == 7:
-        
+    # Encoded move for a piece moved by the player, asking which piece to promote to if needed
+    def find_player_move(self, piece, new_position):
+        promotion = QUEEN
+        if isinstance(piece, Pawn) and new_position[1] in (0, GRID_SIZE - 1):
             promoted_p_type = self.board.painter.draw_promotion_menu(piece.color)
-            promoted_p = self.board.create_piece_instance(promoted_p_type, piece.color, piece.position)
-            self.board.set_piece_at_position(None, piece.position)
-            self.board.set_piece_at_position(promoted_p, piece.position)
-
-            self.board.painter.refresh(self.board)
-
-    def handle_ai_move(self):
-        ai_move = self.ai.calculate_move(self.board)
-        if ai_move:
-            old_position, new_position = ai_move
-
-            old_piece = self.board.tiles[old_position]
-            new_piece = self.board.tiles[new_position]
-
-            self.board.set_piece_at_position(None, old_position)
-            self.board.set_piece_at_position(old_piece, new_position)
-
-            if not new_piece:
-                self.board.painter.draw_move_to_empty_tile(self.board, old_piece, old_position)
+            promotion = PIECE_NAMES.index(promoted_p_type)
+        return self.board.find_move(piece.position, new_position, promotion)
+
+    # Play a move for either side, castling, en passant and promotion included, and draw it
+    def play_move(self, move):
+        old_position, new_position = move_positions(move)
+        self.board.make_move(move)
+        piece = self.board.tiles[new_position]
+
+        captured_piece = self.board.get_last_captured_piece()
+        if captured_piece is None:
+            self.board.painter.draw_move_to_empty_tile(self.board, piece, old_position)
+        else:
+            if piece.color == "White":
+                self.white_player.capture_piece(captured_piece)
             else:
-                self.board.painter.draw_capture(self.board, old_piece, old_position)
-                self.black_player.capture_piece(new_piece)
+                self.black_player.capture_piece(captured_piece)
+            self.board.painter.draw_capture(self.board, piece, old_position)
+
+        if move_flag(move) == CASTLING:
+            rook_from, rook_to = self.board.get_castling_rook_squares(move >> 6 & 63)
+            rook = self.board.tiles[SQUARE_POSITIONS[rook_to]]
+            self.board.painter.draw_move_to_empty_tile(self.board, rook, SQUARE_POSITIONS[rook_from])
+        elif move_flag(move) == EN_PASSANT:
+            # The pawn taken en passant is not on the tile the capturing pawn moved to
+            self.board.painter.draw_regular_tile(captured_piece.position)
+        elif move_promotion(move):
+            self.board.painter.refresh(self.board)
 
-            self.switch_turn()
-            self.state_checker.check_if_lost(self.board, self.player_turn)
+        self.switch_turn()
+        self.state_checker.check_if_lost(self.board, self.player_turn)
 
+    # Start the AI's search; update() plays the move once it is found
+    def handle_ai_move(self):
+        self.background_search.start(self.board)
+
+    # Called every frame. Returns True if the board was redrawn
+    def update(self):
+        ai_move = self.background_search.poll()
+        if not ai_move:
+            return False
+        self.play_move(ai_move)
+        if self.ponder:
+            self.background_search.start_pondering(self.board)
+        return True
+
+    # Stop any search in progress, e.g. before quitting or starting a new game
+    def close(self):
+        self.background_search.cancel()
+        self.ai.close()
+
+    # The board switches its side to move in make_move
     def switch_turn(self):
         if self.player_turn == "White":
             self.player_turn = "Black"
@@ -0,0 +1,93 @@
+import argparse
+import tracemalloc
+from Board import Board, START_FEN
+from ChessAI import ChessAI
+
+'''
+Measures with tracemalloc how much memory pieces, boards and searches take:
+
+    python3 src/MemoryBenchmark.py
+    python3 src/MemoryBenchmark.py --fen "..." --nodes 20000
+
+Pieces and boards are measured by the memory still held once they are built.
+A node's work (making a move, generating the replies and unmaking it) frees
+what it allocates, so it is measured by the peak it reaches above where it
+started, averaged over every legal move of the position. Searches are
+measured by their peak above the memory held before they started.
+'''
+
+# Positions with promotions in reach, which create pieces during the search
+DEFAULT_FENS = [
+    START_FEN,
+    "r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1",
+    "n1n5/PPPk4/8/8/8/8/4Kppp/5N1N b - - 0 1",
+]
+
+
+def measure_boards(count):
+    """
+    Bytes held per board (with its 32 pieces) and per piece.
+    """
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    boards = [Board() for _ in range(count)]
+    board_bytes = (tracemalloc.get_traced_memory()[0] - before) / count
+
+    before = tracemalloc.get_traced_memory()[0]
+    pieces = [
+        type(piece)(piece.color, piece.position)
+        for board in boards for piece in board.tiles.values() if piece is not None
+    ]
+    piece_bytes = (tracemalloc.get_traced_memory()[0] - before) / len(pieces)
+    tracemalloc.stop()
+    return board_bytes, piece_bytes
+
+
+def measure_node(fen):
+    """
+    Average peak bytes allocated by making a move, generating the replies and unmaking it.
+    """
+    board = Board()
+    board.set_fen(fen)
+    moves = board.move_generator.generate_legal_moves(board, board.side_to_move)
+    tracemalloc.start()
+    total = 0
+    for move in moves:
+        start = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        board.make_move(move)
+        board.move_generator.generate_legal_moves(board, board.side_to_move)
+        board.unmake_move(move)
+        total += tracemalloc.get_traced_memory()[1] - start
+    tracemalloc.stop()
+    return total / len(moves)
+
+
+def measure_search(fen, nodes):
+    """
+    (nodes searched, peak bytes above the start) for a search of fen.
+    """
+    board = Board()
+    board.set_fen(fen)
+    ai = ChessAI(board.side_to_move, node_budget=nodes, tt_memory_mb=1)
+    tracemalloc.start()
+    start = tracemalloc.get_traced_memory()[0]
+    tracemalloc.reset_peak()
+    ai.calculate_move(board, move_time=float('inf'))
+    peak = tracemalloc.get_traced_memory()[1] - start
+    tracemalloc.stop()
+    return ai.stats.nodes + ai.stats.qnodes, peak
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure the memory used by pieces, boards and searches.")
+    parser.add_argument("--fen", action="append", help="position to search (repeatable; default: a built-in set)")
+    parser.add_argument("--nodes", type=int, default=20000, help="nodes per search")
+    args = parser.parse_args()
+
+    board_bytes, piece_bytes = measure_boards(200)
+    print(f"board {board_bytes:.0f} bytes, piece {piece_bytes:.0f} bytes")
+    for fen in args.fen or DEFAULT_FENS:
+        node_bytes = measure_node(fen)
+        searched, peak = measure_search(fen, args.nodes)
+        print(f"{fen}\n  {node_bytes:.0f} bytes per node, search of {searched} nodes peaks at {peak / 1024:.0f} KiB")
@@ -0,0 +1,63 @@
+from BitBoard import SQUARE_POSITIONS
+
+'''
+Moves are packed into a single int:
+    bits 0-5    square the piece moves from
+    bits 6-11   square the piece moves to
+    bits 12-14  piece type a pawn promotes to (0 when the move is not a promotion)
+    bits 15-16  special move flag
+'''
+
+NORMAL, DOUBLE_PUSH, EN_PASSANT, CASTLING = range(4)
+
+
+def encode_move(from_square, to_square, promotion=0, flag=NORMAL):
+    return from_square | to_square << 6 | promotion << 12 | flag << 15
+
+
+def move_from_square(move):
+    return move & 63
+
+
+def move_to_square(move):
+    return move >> 6 & 63
+
+
+def move_promotion(move):
+    return move >> 12 & 7
+
+
+def move_flag(move):
+    return move >> 15
+
+
+def move_positions(move):
+    return SQUARE_POSITIONS[move & 63], SQUARE_POSITIONS[move >> 6 & 63]
+
+
+# Algebraic square names, "a8" for square 0 through "h1" for square 63
+SQUARE_NAMES = ["abcdefgh"[x] + str(8 - y) for x, y in SQUARE_POSITIONS]
+# Promotion letters indexed by piece type
+PROMOTION_LETTERS = ["", "n", "b", "r", "q"]
+
+
+def move_name(move):
+    """
+    Coordinate notation as used by UCI, e.g. "e2e4" or "e7e8q".
+    """
+    return SQUARE_NAMES[move & 63] + SQUARE_NAMES[move >> 6 & 63] + PROMOTION_LETTERS[move >> 12 & 7]
+
+
+# Castling rights, one bit each
+WHITE_KINGSIDE, WHITE_QUEENSIDE, BLACK_KINGSIDE, BLACK_QUEENSIDE = 1, 2, 4, 8
+ALL_CASTLING_RIGHTS = 15
+
+# Rights that survive a piece moving from or to each square:
+# moving a king or rook, or capturing a rook, loses the matching rights
+CASTLING_RIGHTS_MASKS = [ALL_CASTLING_RIGHTS] * 64
+CASTLING_RIGHTS_MASKS[0] &= ~BLACK_QUEENSIDE
+CASTLING_RIGHTS_MASKS[4] &= ~(BLACK_KINGSIDE | BLACK_QUEENSIDE)
+CASTLING_RIGHTS_MASKS[7] &= ~BLACK_KINGSIDE
+CASTLING_RIGHTS_MASKS[56] &= ~WHITE_QUEENSIDE
+CASTLING_RIGHTS_MASKS[60] &= ~(WHITE_KINGSIDE | WHITE_QUEENSIDE)
+CASTLING_RIGHTS_MASKS[63] &= ~WHITE_KINGSIDE
@@ -0,0 +1,300 @@
+from BitBoard import (
+    WHITE,
+    COLOR_INDEX,
+    PAWN, KNIGHT, BISHOP, ROOK, QUEEN, KING,
+    RANK_MASKS,
+    KNIGHT_ATTACKS,
+    KING_ATTACKS,
+    PAWN_ATTACKS,
+    ROOK_RAYS,
+    BISHOP_RAYS,
+    BETWEEN,
+    LINE,
+    rook_attacks,
+    bishop_attacks,
+    iter_squares
+)
+from Move import (
+    encode_move,
+    DOUBLE_PUSH, EN_PASSANT, CASTLING,
+    WHITE_KINGSIDE, WHITE_QUEENSIDE, BLACK_KINGSIDE, BLACK_QUEENSIDE
+)
+
+GRID_SIZE = 8
+ALL_SQUARES = (1 << 64) - 1
+PROMOTION_TYPES = [QUEEN, ROOK, BISHOP, KNIGHT]
+
+# Squares between king and rook that must be empty to castle, per color
+KINGSIDE_PATHS = [(1 << 61) | (1 << 62), (1 << 5) | (1 << 6)]
+QUEENSIDE_PATHS = [(1 << 57) | (1 << 58) | (1 << 59), (1 << 1) | (1 << 2) | (1 << 3)]
+
+'''
+Checkers and pinned pieces are worked out once for the position, which gives
+every piece a mask of squares it may legally move to:
+    - in double check only the king can move
+    - in single check other pieces must capture the checker or block its line
+    - a pinned piece can only move along the line between its king and the pinner
+With those masks applied, every emitted move is legal without having to be played.
+'''
+
+class MoveGenerator:
+
+    def generate_legal_moves(self, board, color, from_mask=ALL_SQUARES, to_mask=ALL_SQUARES):
+        """
+        Generate every legal move for a color as encoded moves (see Move.py).
+        from_mask limits generation to pieces standing on the given squares,
+        to_mask to moves landing on the given squares (castling needs all squares).
+        """
+        bitboard = board.bitboard
+        us = COLOR_INDEX[color]
+        them = us ^ 1
+        own_pieces = bitboard.pieces[us]
+        own = bitboard.colors[us]
+        enemy = bitboard.colors[them]
+        occupied = bitboard.occupied
+
+        moves = []
+        kings = own_pieces[KING]
+        if kings:
+            king_square = (kings & -kings).bit_length() - 1
+            checkers = self.get_checkers(bitboard, king_square, us)
+            pin_lines = self.get_pin_lines(bitboard, king_square, us)
+
+            if kings & from_mask:
+                # The king is taken off the board so it cannot hide behind itself from a slider
+                without_king = occupied ^ kings
+                for target in iter_squares(KING_ATTACKS[king_square] & ~own & to_mask):
+                    if not bitboard.is_square_attacked(target, them, without_king):
+                        moves.append(encode_move(king_square, target))
+                if not checkers and to_mask == ALL_SQUARES:
+                    self.add_castling_moves(board, moves, king_square, us)
+
+            if checkers & (checkers - 1):
+                return moves
+            if checkers:
+                checker = (checkers & -checkers).bit_length() - 1
+                target_mask = BETWEEN[king_square][checker] | checkers
+            else:
+                target_mask = ALL_SQUARES
+        else:
+            # Without a king on the board nothing can be pinned or in check
+            king_square = None
+            checkers = 0
+            pin_lines = {}
+            target_mask = ALL_SQUARES
+
+        # Squares that resolve a check, before narrowing to the requested targets
+        check_mask = target_mask
+        target_mask &= to_mask
+        movable = ~own & target_mask
+
+        for square in iter_squares(own_pieces[KNIGHT] & from_mask):
+            # A pinned knight can never stay on its pin line
+            if square in pin_lines:
+                continue
+            for target in iter_squares(KNIGHT_ATTACKS[square] & movable):
+                moves.append(encode_move(square, target))
+
+        for square in iter_squares((own_pieces[BISHOP] | own_pieces[QUEEN]) & from_mask):
+            targets = bishop_attacks(square, occupied) & movable & pin_lines.get(square, ALL_SQUARES)
+            for target in iter_squares(targets):
+                moves.append(encode_move(square, target))
+
+        for square in iter_squares((own_pieces[ROOK] | own_pieces[QUEEN]) & from_mask):
+            targets = rook_attacks(square, occupied) & movable & pin_lines.get(square, ALL_SQUARES)
+            for target in iter_squares(targets):
+                moves.append(encode_move(square, target))
+
+        pawns = own_pieces[PAWN] & from_mask
+        if pawns:
+            self.add_pawn_moves(moves, pawns, us, occupied, enemy, target_mask, pin_lines)
+            self.add_en_passant_moves(
+                board, moves, pawns, us, king_square, check_mask, to_mask
+            )
+
+        return moves
+
+    def get_checkers(self, bitboard, king_square, us):
+        return bitboard.attackers_to(king_square, us ^ 1)
+
+    def get_pin_lines(self, bitboard, king_square, us):
+        """
+        Map each pinned piece's square to the squares it may still move to:
+        the line between its king and the pinning slider, including the slider.
+        """
+        enemy_pieces = bitboard.pieces[us ^ 1]
+        own = bitboard.colors[us]
+        occupied = bitboard.occupied
+        pin_lines = {}
+
+        snipers = (
+            (ROOK_RAYS[king_square] & (enemy_pieces[ROOK] | enemy_pieces[QUEEN]))
+            | (BISHOP_RAYS[king_square] & (enemy_pieces[BISHOP] | enemy_pieces[QUEEN]))
+        )
+        for sniper in iter_squares(snipers):
+            between = BETWEEN[king_square][sniper]
+            blockers = between & occupied
+            # Exactly one blocker, and it is ours
+            if blockers and not blockers & (blockers - 1) and blockers & own:
+                pinned = (blockers & -blockers).bit_length() - 1
+                pin_lines[pinned] = between | (1 << sniper)
+        return pin_lines
+
+    def add_pawn_moves(self, moves, pawns, us, occupied, enemy, target_mask, pin_lines):
+        step = -GRID_SIZE if us == WHITE else GRID_SIZE
+        start_rank = RANK_MASKS[6] if us == WHITE else RANK_MASKS[1]
+        promotion_rank = RANK_MASKS[0] if us == WHITE else RANK_MASKS[7]
+
+        for square in iter_squares(pawns):
+            targets = 0
+            single = square + step
+            if 0 <= single < 64 and not occupied >> single & 1:
+                targets = 1 << single
+                double = single + step
+                if (1 << square) & start_rank and not occupied >> double & 1:
+                    targets |= 1 << double
+            targets |= PAWN_ATTACKS[us][square] & enemy
+            targets &= target_mask & pin_lines.get(square, ALL_SQUARES)
+
+            for target in iter_squares(targets):
+                if (1 << target) & promotion_rank:
+                    for promotion in PROMOTION_TYPES:
+                        moves.append(encode_move(square, target, promotion))
+                elif target - square == 2 * step:
+                    moves.append(encode_move(square, target, 0, DOUBLE_PUSH))
+                else:
+                    moves.append(encode_move(square, target))
+
+    def add_en_passant_moves(self, board, moves, pawns, us, king_square, check_mask, to_mask):
+        them = us ^ 1
+        target = board.en_passant_square
+        if target is None:
+            return
+        bitboard = board.bitboard
+        step = -GRID_SIZE if us == WHITE else GRID_SIZE
+        captured = target - step
+        # The square is only ours to use if the pawn that skipped it is an enemy pawn
+        if not 0 <= captured < 64 or not bitboard.pieces[them][PAWN] >> captured & 1:
+            return
+        # Capturing the pawn that gives check is an evasion even though its square is not the target
+        if not ((1 << target) | (1 << captured)) & check_mask or not (1 << target) & to_mask:
+            return
+
+        # Pins are covered too: the capturing pawn leaving its line is caught by the same test
+        enemy_pieces = bitboard.pieces[them]
+        sliders = enemy_pieces[BISHOP] | enemy_pieces[ROOK] | enemy_pieces[QUEEN]
+        for square in iter_squares(PAWN_ATTACKS[them][target] & pawns):
+            # Only a slider on a line through the king and a square being emptied can be uncovered
+            if king_square is not None and sliders & (LINE[king_square][square] | LINE[king_square][captured]):
+                # Both pawns leave the rank at once, so test the king against sliders on the new occupancy
+                occupied = bitboard.occupied ^ (1 << square) ^ (1 << captured) | (1 << target)
+                if rook_attacks(king_square, occupied) & (enemy_pieces[ROOK] | enemy_pieces[QUEEN]):
+                    continue
+                if bishop_attacks(king_square, occupied) & (enemy_pieces[BISHOP] | enemy_pieces[QUEEN]):
+                    continue
+            moves.append(encode_move(square, target, 0, EN_PASSANT))
+
+    def add_castling_moves(self, board, moves, king_square, us):
+        rights = board.castling_rights
+        if us == WHITE:
+            kingside, queenside, start_square = rights & WHITE_KINGSIDE, rights & WHITE_QUEENSIDE, 60
+        else:
+            kingside, queenside, start_square = rights & BLACK_KINGSIDE, rights & BLACK_QUEENSIDE, 4
+        if king_square != start_square:
+            return
+        bitboard = board.bitboard
+        them = us ^ 1
+        rooks = bitboard.pieces[us][ROOK]
+        occupied = bitboard.occupied
+
+        # Kingside: the squares up to the rook must be empty and the two the king crosses safe
+        if (
+            kingside
+            and rooks >> (king_square + 3) & 1
+            and not occupied & KINGSIDE_PATHS[us]
+            and not bitboard.is_square_attacked(king_square + 1, them)
+            and not bitboard.is_square_attacked(king_square + 2, them)
+        ):
+            moves.append(encode_move(king_square, king_square + 2, 0, CASTLING))
+
+        # Queenside
+        if (
+            queenside
+            and rooks >> (king_square - 4) & 1
+            and not occupied & QUEENSIDE_PATHS[us]
+            and not bitboard.is_square_attacked(king_square - 1, them)
+            and not bitboard.is_square_attacked(king_square - 2, them)
+        ):
+            moves.append(encode_move(king_square, king_square - 2, 0, CASTLING))
+
+def play_reference_move(board, old_position, new_position):
+    # Plays a move the way GameHandler does, promoting pawns to queens
+    piece = board.tiles[old_position]
+    # A pawn moving diagonally onto an empty tile is capturing en passant
+    en_passant = (
+        piece.get_piece_type() == "Pawn"
+        and old_position[0] != new_position[0]
+        and board.tiles.get(new_position) is None
+    )
+    board.set_piece_at_position(None, old_position)
+    board.set_piece_at_position(piece, new_position)
+
+    if piece.get_piece_type() == "King" and abs(new_position[0] - old_position[0]) == 2:
+        rook_x, rook_target_x = (7, new_position[0] - 1) if new_position[0] > old_position[0] else (0, new_position[0] + 1)
+        rook = board.tiles.get((rook_x, new_position[1]))
+        board.set_piece_at_position(None, (rook_x, new_position[1]))
+        board.set_piece_at_position(rook, (rook_target_x, new_position[1]))
+
+    if en_passant:
+        board.put_piece((new_position[0], old_position[1]), None)
+
+    if piece.get_piece_type() == "Pawn" and new_position[1] in (0, GRID_SIZE - 1):
+        board.put_piece(new_position, board.create_piece_instance("Queen", piece.color, new_position))
+
+
+def verify_against_reference(games=200, max_plies=150, seed=0):
+    """
+    Play random games and compare calculate_valid_moves with the make-and-test
+    reference for every piece in every position reached, and check that
+    Board.make_move followed by unmake_move restores each position.
+    Returns the number of positions checked and a list of mismatches.
+    """
+    import random
+    from Board import Board
+
+    rng = random.Random(seed)
+    positions = 0
+    mismatches = []
+    for game in range(games):
+        board = Board()
+        color = "White"
+        for ply in range(max_plies):
+            candidates = []
+            for position, piece in list(board.tiles.items()):
+                if piece is None or piece.color != color:
+                    continue
+                generated = sorted(piece.calculate_valid_moves(board))
+                reference = sorted(piece.calculate_tested_moves(board))
+                if generated != reference:
+                    mismatches.append((game, ply, str(piece), generated, reference))
+                candidates.extend((position, move) for move in generated)
+            state = (dict(board.tiles), board.zobrist_key, board.castling_rights, board.en_passant_square)
+            for move in board.move_generator.generate_legal_moves(board, color):
+                board.make_move(move)
+                board.unmake_move(move)
+                if (dict(board.tiles), board.zobrist_key, board.castling_rights, board.en_passant_square) != state:
+                    mismatches.append((game, ply, "unmake_move", move))
+            positions += 1
+            if not candidates:
+                break
+            old_position, new_position = rng.choice(sorted(candidates))
+            play_reference_move(board, old_position, new_position)
+            color = "Black" if color == "White" else "White"
+    return positions, mismatches
+
+
+if __name__ == "__main__":
+    positions, mismatches = verify_against_reference()
+    for mismatch in mismatches[:20]:
+        print(mismatch)
+    print(f"{positions} positions checked, {len(mismatches)} mismatches")
@@ -0,0 +1,105 @@
+from BitBoard import PAWN, QUEEN, KING
+from Move import EN_PASSANT
+
+# Values used to rank captures (Pawn, Knight, Bishop, Rook, Queen, King)
+ORDERING_VALUES = [1, 3, 3, 5, 9, 10]
+
+# Ranking bands, from first to last: hash move, captures and promotions, killers, quiet moves
+HASH_MOVE_SCORE = 1 << 30
+CAPTURE_SCORE = 1 << 28
+KILLER_SCORE = 1 << 27
+
+MAX_PLY = 128
+# Cutoff counts by move index, with every index past the last slot counted in it
+CUTOFF_SLOTS = 16
+
+'''
+Orders moves so alpha-beta finds its cutoffs early:
+    1. the best move stored for the position in the transposition table
+    2. captures, most valuable victim first, then least valuable attacker
+    3. up to two killer moves per ply: quiet moves that caused a cutoff at
+       the same ply in a sibling position
+    4. other quiet moves, by how often they caused cutoffs so far (history)
+'''
+
+class MoveOrderer:
+    def __init__(self):
+        self.killers = [[0, 0] for ply in range(MAX_PLY)]
+        # history[color][from * 64 + to]
+        self.history = [[0] * 4096, [0] * 4096]
+        # cutoff_counts[i] is how many cutoffs came from the i-th move searched
+        self.cutoff_counts = [0] * CUTOFF_SLOTS
+
+    def new_search(self):
+        self.killers = [[0, 0] for ply in range(MAX_PLY)]
+        # Older history still helps but should not outweigh what this search learns
+        for table in self.history:
+            for i in range(4096):
+                table[i] >>= 1
+        self.cutoff_counts = [0] * CUTOFF_SLOTS
+
+    def is_quiet(self, board, move, color_index):
+        if move >> 12 & 7 or move >> 15 == EN_PASSANT:
+            return False
+        return not board.bitboard.colors[color_index ^ 1] >> (move >> 6 & 63) & 1
+
+    def order_moves(self, board, moves, color_index, hash_move, ply):
+        pieces = board.bitboard.pieces
+        enemy_pieces = pieces[color_index ^ 1]
+        own_pieces = pieces[color_index]
+        enemy = board.bitboard.colors[color_index ^ 1]
+        killers = self.killers[ply] if ply < MAX_PLY else (0, 0)
+        history = self.history[color_index]
+
+        scored = []
+        for move in moves:
+            if move == hash_move:
+                score = HASH_MOVE_SCORE
+            else:
+                to_square = move >> 6 & 63
+                promotion = move >> 12 & 7
+                if enemy >> to_square & 1 or promotion or move >> 15 == EN_PASSANT:
+                    victim = PAWN
+                    for piece_type in range(QUEEN, PAWN, -1):
+                        if enemy_pieces[piece_type] >> to_square & 1:
+                            victim = piece_type
+                            break
+                    attacker = PAWN
+                    from_square = move & 63
+                    for piece_type in range(KING, PAWN, -1):
+                        if own_pieces[piece_type] >> from_square & 1:
+                            attacker = piece_type
+                            break
+                    score = CAPTURE_SCORE + ORDERING_VALUES[victim] * 16 - ORDERING_VALUES[attacker]
+                    if promotion:
+                        score += ORDERING_VALUES[promotion] * 16
+                        if not enemy >> to_square & 1:
+                            # A quiet promotion has no victim
+                            score -= ORDERING_VALUES[PAWN] * 16
+                elif move == killers[0]:
+                    score = KILLER_SCORE + 1
+                elif move == killers[1]:
+                    score = KILLER_SCORE
+                else:
+                    score = history[move & 4095]
+            scored.append((score, move))
+
+        scored.sort(reverse=True)
+        return [move for score, move in scored]
+
+    def record_cutoff(self, board, move, color_index, depth, ply, move_index):
+        self.cutoff_counts[min(move_index, CUTOFF_SLOTS - 1)] += 1
+        if not self.is_quiet(board, move, color_index):
+            return
+        if ply < MAX_PLY:
+            killers = self.killers[ply]
+            if killers[0] != move:
+                killers[1] = killers[0]
+                killers[0] = move
+        self.history[color_index][move & 4095] += depth * depth
+
+    def get_first_move_cutoff_rate(self):
+        total = sum(self.cutoff_counts)
+        if total == 0:
+            return 0.0
+        return self.cutoff_counts[0] / total
@@ -1,9 +1,27 @@
+from BitBoard import (
+    COLOR_INDEX,
+    SQUARE_POSITIONS,
+    KNIGHT_ATTACKS,
+    KING_ATTACKS,
+    PAWN_ATTACKS,
+    NORTH, SOUTH, WEST, EAST,
+    NORTH_WEST, SOUTH_EAST, SOUTH_WEST, NORTH_EAST,
+    square_index,
+    ray_attacks,
+    iter_squares
+)
 
 # Constants
 WIDTH, HEIGHT = 600, 600
 GRID_SIZE = 8
 SQUARE_SIZE = WIDTH // GRID_SIZE
 
+'''
+Validators read the occupancy sets in board.bitboard: the reachable squares
+are built with shifts and masks and only converted back to (x, y) positions
+at the end.
+'''
+
 class MoveValidator:
 
     def get_valid_moves(self, current_position, target_position):
@@ -12,184 +30,79 @@ class MoveValidator:
     def get_type(self):
         return self.__class__.__name__
 
+    def to_positions(self, targets):
+        return [SQUARE_POSITIONS[square] for square in iter_squares(targets)]
+
 class VerticalMoveValidator(MoveValidator):
 
     def get_valid_moves(self, board, position, color):
-        valid_moves = []
-        # Loop from y-1 to 0
-        for i in range(position[1] - 1, -1, -1):
-            check_piece = board.tiles.get((position[0], i))
-            # If there is no piece there 
-            if check_piece is None:
-                valid_position = (position[0], i)
-                valid_moves.append(valid_position)
-            else:
-                # Opposite colors
-                if check_piece.color is not color:
-                    valid_moves.append(check_piece.position)
-                    break
-                else:
-                    break           
-
-        # Loop from y+1 to 7
-        for i in range(position[1] + 1, GRID_SIZE):
-            check_piece = board.tiles.get((position[0], i))
-            if check_piece is None:
-                valid_position = (position[0], i)
-                valid_moves.append(valid_position)
-            else:
-                # Opposite colors
-                if check_piece.color is not color:
-                    valid_moves.append(check_piece.position)
-                    break
-                else:
-                    break 
-
-        return valid_moves
+        bitboard = board.bitboard
+        square = square_index(position)
+        occupied = bitboard.occupied
+        # Both directions stop at the first piece, which is kept only if it is an enemy
+        targets = ray_attacks(square, NORTH, occupied) | ray_attacks(square, SOUTH, occupied)
+        return self.to_positions(targets & ~bitboard.colors[COLOR_INDEX[color]])
 
 
 class HorizontalMoveValidator(MoveValidator):
 
     def get_valid_moves(self, board, position, color):
-        valid_moves = []
-        # Loop from x-1 to 0
-        for i in range(position[0] - 1, -1, -1):
-            check_piece = board.tiles.get((i, position[1]))
-            # If there is no piece there 
-            if check_piece is None:
-                valid_position = (i, position[1])
-                valid_moves.append(valid_position)
-            else:
-                # Opposite colors 
-                if check_piece.color is not color:
-                    valid_moves.append(check_piece.position)
-                    break
-                else:
-                    break           
-
-        # Loop from y+1 to 7
-        for i in range(position[0] + 1, GRID_SIZE):
-            check_piece = board.tiles.get((i, position[1]))
-            if check_piece is None:
-                valid_position = (i, position[1])
-                valid_moves.append(valid_position)
-            else:
-                # Opposite colors
-                if check_piece.color != color:
-                    valid_moves.append(check_piece.position)
-                break
-
-        return valid_moves
+        bitboard = board.bitboard
+        square = square_index(position)
+        occupied = bitboard.occupied
+        targets = ray_attacks(square, WEST, occupied) | ray_attacks(square, EAST, occupied)
+        return self.to_positions(targets & ~bitboard.colors[COLOR_INDEX[color]])
 
 
 class DiagonalMoveValidator(MoveValidator):
 
     def get_valid_moves(self, board, position, color):
-        valid_moves = []
-
-        # Loop from x-1, y-1 to 0, 0 (top-left diagonal)
-        for i, j in zip(range(position[0] - 1, -1, -1), range(position[1] - 1, -1, -1)):
-            check_piece = board.tiles.get((i, j))
-            if check_piece is None:
-                valid_moves.append((i, j))
-            else:
-                if check_piece.color != color:
-                    valid_moves.append(check_piece.position)
-                break
-
-        # Loop from x+1, y+1 to 7, 7 (bottom-right diagonal)
-        for i, j in zip(range(position[0] + 1, GRID_SIZE), range(position[1] + 1, GRID_SIZE)):
-            check_piece = board.tiles.get((i, j))
-            if check_piece is None:
-                valid_moves.append((i, j))
-            else:
-                if check_piece.color != color:
-                    valid_moves.append(check_piece.position)
-                break
-
-        # Loop from x-1, y+1 to 0, 7 (top-right diagonal)
-        for i, j in zip(range(position[0] - 1, -1, -1), range(position[1] + 1, GRID_SIZE)):
-            check_piece = board.tiles.get((i, j))
-            if check_piece is None:
-                valid_moves.append((i, j))
-            else:
-                if check_piece.color != color:
-                    valid_moves.append(check_piece.position)
-                break
-
-        # Loop from x+1, y-1 to 7, 0 (bottom-left diagonal)
-        for i, j in zip(range(position[0] + 1, GRID_SIZE), range(position[1] - 1, -1, -1)):
-            check_piece = board.tiles.get((i, j))
-            if check_piece is None:
-                valid_moves.append((i, j))
-            else:
-                if check_piece.color != color:
-                    valid_moves.append(check_piece.position)
-                break
-
-        return valid_moves
+        bitboard = board.bitboard
+        square = square_index(position)
+        occupied = bitboard.occupied
+        targets = (
+            ray_attacks(square, NORTH_WEST, occupied) | ray_attacks(square, SOUTH_EAST, occupied)
+            | ray_attacks(square, SOUTH_WEST, occupied) | ray_attacks(square, NORTH_EAST, occupied)
+        )
+        return self.to_positions(targets & ~bitboard.colors[COLOR_INDEX[color]])
 
 class KnightMoveValidator(MoveValidator):
 
     def get_valid_moves(self, board, position, color):
-        valid_moves = []
-
-        # Possible knight moves relative to its position
-        knight_moves = [
-            (-2, -1), (-2, 1),
-            (-1, -2), (-1, 2),
-            (1, -2), (1, 2),
-            (2, -1), (2, 1)
-        ]
-
-        for move in knight_moves:
-            new_position = (position[0] + move[0], position[1] + move[1])
-
-            if 0 <= new_position[0] < GRID_SIZE and 0 <= new_position[1] < GRID_SIZE:
-                check_piece = board.tiles.get(new_position)
-
-                if check_piece is None or check_piece.color != color:
-                    valid_moves.append(new_position)
-
-        return valid_moves
+        targets = KNIGHT_ATTACKS[square_index(position)]
+        return self.to_positions(targets & ~board.bitboard.colors[COLOR_INDEX[color]])
 
 
 class PawnMoveValidator(MoveValidator):
 
     def get_valid_moves(self, board, position, color):
-        valid_moves = []
+        bitboard = board.bitboard
+        color_index = COLOR_INDEX[color]
+        square = square_index(position)
         # Define the direction of pawn movement based on its color
-        y_direction = -1 if color == "White" else 1
+        step = -GRID_SIZE if color == "White" else GRID_SIZE
 
-        pawn = board.tiles[position]
+        pawn = board.tiles.get(position)
 
+        valid_moves = []
         # Single step forward
-        new_position = (position[0], position[1] + y_direction)
-        if 0 <= new_position[0] < GRID_SIZE and 0 <= new_position[1] < GRID_SIZE:
-            check_piece = board.tiles.get(new_position)
-            if check_piece is None:
-                valid_moves.append(new_position)
-
-                # If the pawn hasn't moved yet, allow for the double step forward
-                if pawn is not None and pawn.get_piece_type() == "Pawn" and not pawn.has_moved:
-
-                    if (
-                        (pawn.color == "White" and position[1] == 6) 
-                        or (pawn.color == "Black" and position[1] == 1)
-                    ):
-                        new_position = (position[0], position[1] + 2 * y_direction)
-                        check_piece = board.tiles.get(new_position)
-                        if check_piece is None:
-                            valid_moves.append(new_position)
+        single = square + step
+        if 0 <= single < GRID_SIZE * GRID_SIZE and not bitboard.occupied >> single & 1:
+            valid_moves.append(SQUARE_POSITIONS[single])
+
+            # If the pawn hasn't moved yet, allow for the double step forward
+            if pawn is not None and pawn.get_piece_type() == "Pawn" and not pawn.has_moved:
+                if (
+                    (color == "White" and position[1] == 6)
+                    or (color == "Black" and position[1] == 1)
+                ):
+                    double = single + step
+                    if not bitboard.occupied >> double & 1:
+                        valid_moves.append(SQUARE_POSITIONS[double])
 
         # Diagonal captures
-        capture_offsets = [(1, y_direction), (-1, y_direction)]
-        for offset in capture_offsets:
-            new_position = (position[0] + offset[0], position[1] + offset[1])
-            if 0 <= new_position[0] < GRID_SIZE and 0 <= new_position[1] < GRID_SIZE:
-                check_piece = board.tiles.get(new_position)
-                if check_piece is not None and check_piece.color != color:
-                    valid_moves.append(new_position)
+        captures = PAWN_ATTACKS[color_index][square] & bitboard.colors[color_index ^ 1]
+        valid_moves.extend(self.to_positions(captures))
 
         return valid_moves
 
@@ -199,22 +112,13 @@ class PawnMoveValidator(MoveValidator):
 class SingleMoveValidator(MoveValidator):
    
     def get_valid_moves(self, board, position, color):
-        valid_moves = []
-
-        # Possible king moves relative to its position
-        single_moves = [
-            (0, 1), (1, 1), (1, 0),
-            (1, -1), (0, -1), (-1, -1),
-            (-1, 0), (-1, 1)
-        ]
-
-        for move in single_moves:
-            new_position = (position[0] + move[0], position[1] + move[1])
-
-            if 0 <= new_position[0] < GRID_SIZE and 0 <= new_position[1] < GRID_SIZE:
-                check_piece = board.tiles.get(new_position)
-
-                if check_piece is None or check_piece.color != color:
-                    valid_moves.append(new_position)
-
-        return valid_moves
+        targets = KING_ATTACKS[square_index(position)]
+        return self.to_positions(targets & ~board.bitboard.colors[COLOR_INDEX[color]])
+
+# Validators hold no state, so every piece shares these instances
+VERTICAL_MOVE_VALIDATOR = VerticalMoveValidator()
+HORIZONTAL_MOVE_VALIDATOR = HorizontalMoveValidator()
+DIAGONAL_MOVE_VALIDATOR = DiagonalMoveValidator()
+KNIGHT_MOVE_VALIDATOR = KnightMoveValidator()
+SINGLE_MOVE_VALIDATOR = SingleMoveValidator()
+PAWN_MOVE_VALIDATOR = PawnMoveValidator()
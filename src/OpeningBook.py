@@ -0,0 +1,157 @@
+import argparse
+import mmap
+import os
+import random
+import struct
+import sys
+from Board import Board, START_FEN
+from Move import move_name
+
+'''
+Opening book in a Polyglot-style binary file: fixed 16 byte records of
+position key, move, weight and a spare field, sorted by key. The file is
+memory-mapped and searched with a binary search, so opening a book and
+looking up a position take the same time and memory whatever its size.
+
+Keys are this engine's Zobrist keys (see Zobrist.py) and moves are the low 15
+bits of our move encoding (see Move.py), so books must be built with this
+module; Polyglot books from elsewhere will not match.
+
+    python3 src/OpeningBook.py build games.pgn -o book.bin --plies 20
+    python3 src/OpeningBook.py probe book.bin --fen "..."
+'''
+
+# Key, move, weight, spare; big-endian like Polyglot
+RECORD = struct.Struct(">QHHI")
+KEY = struct.Struct(">Q")
+# Moves are stored without their flag bits, which are recovered from the legal moves
+STORED_MOVE_MASK = 0x7FFF
+MAX_WEIGHT = 0xFFFF
+
+
+class OpeningBook:
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, "rb")
+        self.size = os.path.getsize(path) // RECORD.size
+        # An empty file cannot be mapped, and has nothing to find anyway
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ) if self.size else None
+
+    def close(self):
+        if self.data is not None:
+            self.data.close()
+        self.file.close()
+
+    def get_entries(self, key):
+        """
+        Return the (stored move, weight) pairs for a position key.
+        """
+        if self.data is None:
+            return []
+        # Binary search for the first record with this key
+        low, high = 0, self.size
+        while low < high:
+            middle = (low + high) // 2
+            if KEY.unpack_from(self.data, middle * RECORD.size)[0] < key:
+                low = middle + 1
+            else:
+                high = middle
+
+        entries = []
+        while low < self.size:
+            entry_key, move, weight, spare = RECORD.unpack_from(self.data, low * RECORD.size)
+            if entry_key != key:
+                break
+            entries.append((move, weight))
+            low += 1
+        return entries
+
+    def get_moves(self, board):
+        """
+        Return the legal (move, weight) pairs the book has for the board's position.
+        """
+        entries = self.get_entries(board.zobrist_key)
+        if not entries:
+            return []
+        legal_moves = {
+            move & STORED_MOVE_MASK: move
+            for move in board.get_legal_moves()
+        }
+        # A key collision could suggest a move that is not legal here
+        return [(legal_moves[move], weight) for move, weight in entries if move in legal_moves and weight > 0]
+
+    def choose_move(self, board, rng=random):
+        """
+        Pick a book move at random in proportion to the weights, or None when out of book.
+        """
+        moves = self.get_moves(board)
+        if not moves:
+            return None
+        return rng.choices([move for move, weight in moves], [weight for move, weight in moves])[0]
+
+
+def build_book(pgn_paths, output_path, max_plies=20, min_games=2):
+    """
+    Write a book of the positions in the first max_plies plies of every game in
+    the PGN files. Moves get 2 points per win and 1 per draw for the side that
+    played them, and moves played in fewer than min_games games are left out.
+    Returns the number of records written.
+    """
+    from PgnReader import read_games, replay_game, PgnError
+
+    # (key, stored move) -> [weight, games]
+    counts = {}
+    for path in pgn_paths:
+        with open(path, encoding="utf-8", errors="replace") as lines:
+            for headers, movetext in read_games(lines):
+                result = headers.get("Result", "*")
+                points = {"1-0": (2, 0), "0-1": (0, 2)}.get(result, (1, 1))
+                try:
+                    for board, move in replay_game(headers, movetext):
+                        if board.ply >= max_plies:
+                            break
+                        count = counts.setdefault((board.zobrist_key, move & STORED_MOVE_MASK), [0, 0])
+                        count[0] += points[0 if board.side_to_move == "White" else 1]
+                        count[1] += 1
+                except PgnError:
+                    # The moves before the bad one are still worth having
+                    continue
+
+    records = sorted(
+        (key, move, min(weight, MAX_WEIGHT))
+        for (key, move), (weight, games) in counts.items()
+        if games >= min_games
+    )
+    with open(output_path, "wb") as book:
+        for key, move, weight in records:
+            book.write(RECORD.pack(key, move, weight, 0))
+    return len(records)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build or look up an opening book.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    build = commands.add_parser("build", help="build a book from PGN files")
+    build.add_argument("paths", nargs="+", help="PGN files")
+    build.add_argument("-o", "--output", default="book.bin")
+    build.add_argument("--plies", type=int, default=20, help="how deep into each game to go")
+    build.add_argument("--min-games", type=int, default=2, help="games a move must be played in to be kept")
+    probe = commands.add_parser("probe", help="list the book moves for a position")
+    probe.add_argument("book")
+    probe.add_argument("--fen", default=START_FEN)
+    args = parser.parse_args()
+
+    if args.command == "build":
+        records = build_book(args.paths, args.output, args.plies, args.min_games)
+        print(f"{records} moves written to {args.output}")
+    else:
+        board = Board()
+        board.set_fen(args.fen)
+        book = OpeningBook(args.book)
+        moves = book.get_moves(board)
+        total = sum(weight for move, weight in moves)
+        for move, weight in sorted(moves, key=lambda entry: -entry[1]):
+            print(f"{move_name(move)} {weight} ({weight / total:.0%})")
+        if not moves:
+            print("out of book", file=sys.stderr)
+        book.close()
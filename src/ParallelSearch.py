@@ -0,0 +1,204 @@
+import multiprocessing
+import os
+import pickle
+import time
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from BitBoard import COLOR_INDEX
+from TranspositionTable import EXACT
+
+'''
+Root splitting for ChessAI over a pool of worker processes.
+
+The first root move (the hash move, when there is one) is searched in this
+process to get a score to beat. The other root moves are then handed out one
+at a time to the workers, each searched with the best score so far as its
+lower bound, so that most of them fail low quickly. Each worker keeps its own
+ChessAI, and with it its own transposition table and move ordering history,
+for as long as the pool lives. Workers are started fresh rather than forked,
+so a script that searches with workers needs an if __name__ == "__main__" guard.
+'''
+
+# The ChessAI of a worker process, created by init_worker
+worker_ai = None
+# Age of the transposition table in the search the worker last helped with
+worker_search_age = None
+
+
+def init_worker(color, tt_memory_mb, tt_replacement_policy, stop_event, tablebase_path):
+    global worker_ai
+    from ChessAI import ChessAI
+    worker_ai = ChessAI(
+        color, tt_memory_mb=tt_memory_mb, tt_replacement_policy=tt_replacement_policy, tablebase_path=tablebase_path
+    )
+    worker_ai.stop_event = stop_event
+
+
+def search_root_move(board_state, color, move, depth, alpha, time_left, node_budget, search_age):
+    """
+    Search one root move in a worker. Returns (score, stopped, nodes, qnodes).
+    The score is only exact when it is above alpha. search_age tells the worker
+    when a new search has started, as its own table ages with each one.
+    """
+    global worker_search_age
+    ai = worker_ai
+    ai.set_color(color)
+    if search_age != worker_search_age:
+        ai.transposition_table.new_search()
+        ai.move_orderer.new_search()
+        worker_search_age = search_age
+    board = pickle.loads(board_state)
+    ai.nodes = 0
+    ai.qnodes = 0
+    ai.search_stopped = False
+    ai.deadline = time.perf_counter() + time_left
+    ai.node_budget = node_budget
+    # The root has a move already, so the worker may stop whenever its budget runs out
+    ai.completed_depth = depth - 1
+
+    opponent = "White" if ai.color == "Black" else "Black"
+    board.make_move(move)
+    score, _ = ai.minimax(board, depth - 1, opponent, alpha, float('inf'), 1)
+    return score, ai.search_stopped, ai.nodes, ai.qnodes
+
+
+class ParallelRootSearch:
+    def __init__(self, workers, color, tt_memory_mb, tt_replacement_policy, tablebase_path=None):
+        self.workers = workers
+        self.color = color
+        self.tt_memory_mb = tt_memory_mb
+        self.tt_replacement_policy = tt_replacement_policy
+        # Each worker maps the endgame tables for itself
+        self.tablebase_path = tablebase_path
+        # Started by the first search so that creating a ChessAI stays cheap
+        self.executor = None
+        # Workers are spawned rather than forked: the pool starts from a search thread, and a
+        # fork could copy a lock another thread holds, such as the UCI loop's on stdin
+        self.context = multiprocessing.get_context("spawn")
+        # Set to stop every worker's search, e.g. when a search in this process is stopped
+        self.stop_event = self.context.Event()
+
+    def start(self):
+        if self.executor is None:
+            self.executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=self.context,
+                initializer=init_worker,
+                initargs=(self.color, self.tt_memory_mb, self.tt_replacement_policy, self.stop_event, self.tablebase_path)
+            )
+            # Processes start on demand, so give each one something to do to have them all ready
+            wait([self.executor.submit(os.getpid) for worker in range(self.workers)])
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown(cancel_futures=True)
+            self.executor = None
+
+    def search(self, ai, board, depth):
+        """
+        Search the root to the given depth for ai. Returns (score, move) like ChessAI.minimax.
+        """
+        moves = board.get_legal_moves(ai.color)
+        if len(moves) < 2:
+            # Nothing to split: no moves at all (minimax scores the mate or stalemate) or a forced one
+            return ai.minimax(board, depth, ai.color)
+        self.start()
+
+        key = board.zobrist_key
+        entry = ai.transposition_table.probe(key)
+        hash_move = entry[3] if entry is not None else 0
+        moves = ai.move_orderer.order_moves(board, moves, COLOR_INDEX[ai.color], hash_move, 0)
+
+        opponent = "White" if ai.color == "Black" else "Black"
+        board.make_move(moves[0])
+        best_score, _ = ai.minimax(board, depth - 1, opponent, float('-inf'), float('inf'), 1)
+        board.unmake_move(moves[0])
+        if ai.search_stopped:
+            return 0, None
+        best_move = moves[0]
+        best_index = 0
+
+        board_state = pickle.dumps(board)
+        self.stop_event.clear()
+        next_index = 1
+        # Future -> (root move index, node budget it was given)
+        pending = {}
+        while next_index < len(moves) or pending:
+            # Keep every worker busy, each new move starting from the best score found so far
+            while next_index < len(moves) and len(pending) < self.workers:
+                if ai.node_budget is not None:
+                    # Share what no running move has been given among the idle workers,
+                    # so the moves in flight cannot overrun the budget between them
+                    reserved = sum(budget for index, budget in pending.values())
+                    node_budget = max((ai.node_budget - ai.nodes - reserved) // (self.workers - len(pending)), 1)
+                else:
+                    node_budget = None
+                future = self.executor.submit(
+                    search_root_move, board_state, ai.color, moves[next_index], depth,
+                    best_score, ai.deadline - time.perf_counter(), node_budget, ai.transposition_table.age
+                )
+                pending[future] = (next_index, node_budget)
+                next_index += 1
+
+            # Wake up now and then to notice a stop request while workers are busy
+            done, _ = wait(pending, timeout=0.05, return_when=FIRST_COMPLETED)
+            if ai.stop_requested:
+                ai.search_stopped = True
+            for future in done:
+                index, _ = pending.pop(future)
+                score, stopped, nodes, qnodes = future.result()
+                ai.nodes += nodes
+                ai.qnodes += qnodes
+                if stopped:
+                    ai.search_stopped = True
+                # Ties go to the move ordered first, as in the serial search
+                elif score > best_score or (score == best_score and index < best_index):
+                    best_score, best_move, best_index = score, moves[index], index
+
+            if ai.search_stopped:
+                # Let running workers finish quickly so none is still busy when the next search starts
+                self.stop_event.set()
+                for future in pending:
+                    future.cancel()
+                wait(pending)
+                return 0, None
+
+        ai.transposition_table.store(key, depth, EXACT, ai.score_to_table(best_score, 0), best_move)
+        return best_score, best_move
+
+
+def run_benchmark(depth=4, worker_counts=(1, 2, 4, 8)):
+    """
+    Time fixed-depth searches of a few middlegame positions with each worker count.
+    """
+    from Board import Board
+    from ChessAI import ChessAI
+
+    positions = [
+        "r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 b - - 0 10",
+        "r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R b KQkq - 0 1",
+        "r1bq1rk1/pp2bppp/2n1pn2/3p4/2PP4/2N1PN2/PP3PPP/R2QKB1R b KQ - 0 8",
+    ]
+    print(f"{os.cpu_count()} cpus, depth {depth}")
+    base_time = None
+    for workers in worker_counts:
+        total_time = 0.0
+        total_nodes = 0
+        for fen in positions:
+            board = Board()
+            board.set_fen(fen)
+            ai = ChessAI("Black", time_budget=3600, max_depth=depth, workers=workers)
+            if ai.parallel_search is not None:
+                # Start the pool up front so process start-up is not timed
+                ai.parallel_search.start()
+            start_time = time.perf_counter()
+            ai.calculate_move(board)
+            total_time += time.perf_counter() - start_time
+            total_nodes += ai.nodes + ai.qnodes
+            ai.close()
+        if base_time is None:
+            base_time = total_time
+        print(f"{workers} workers: {total_time:.2f}s, {total_nodes} nodes, speedup {base_time / total_time:.2f}x")
+
+
+if __name__ == "__main__":
+    run_benchmark()
@@ -0,0 +1,168 @@
+import argparse
+import time
+from Board import Board, START_FEN
+from Move import move_name
+
+'''
+Perft counts the leaf nodes of the legal move tree to a fixed depth. The
+counts for the positions below are known, so any difference points to a
+move generation (or make/unmake) bug, and the time taken is a benchmark
+for both.
+
+    python3 src/Perft.py                      run the reference positions
+    python3 src/Perft.py --depth 4 --divide   count per root move
+    python3 src/Perft.py --fen "..." --hash 1000000
+'''
+
+# Name, FEN and the known node counts for depth 1, 2, 3...
+REFERENCE_POSITIONS = [
+    (
+        "start",
+        START_FEN,
+        [20, 400, 8902, 197281, 4865609]
+    ),
+    (
+        # Castling in every direction, pins, en passant and promotions
+        "kiwipete",
+        "r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1",
+        [48, 2039, 97862, 4085603]
+    ),
+    (
+        # Rook endgame with discovered checks and en passant pinned along the rank
+        "rank-pins",
+        "8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1",
+        [14, 191, 2812, 43238, 674624]
+    ),
+    (
+        # Underpromotions and castling while in or through check
+        "promotions",
+        "r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1",
+        [6, 264, 9467, 422333]
+    ),
+    (
+        "promotion-captures",
+        "rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8",
+        [44, 1486, 62379, 2103487]
+    ),
+    (
+        "middlegame",
+        "r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10",
+        [46, 2079, 89890, 3894594]
+    ),
+]
+
+# Deepest depth the reference run goes to by default, to keep it under a minute or so
+DEFAULT_SUITE_DEPTH = 3
+
+
+class Perft:
+    def __init__(self, board, hash_entries=0):
+        self.board = board
+        # Optional table of subtree counts by position and depth. Transpositions
+        # are common in perft, so this saves a lot of time at larger depths
+        self.hash_entries = hash_entries
+        self.table = {} if hash_entries else None
+        self.hash_hits = 0
+
+    def count(self, depth):
+        """
+        Number of leaf nodes depth plies below the current position.
+        """
+        if depth == 0:
+            return 1
+        board = self.board
+        moves = board.move_generator.generate_legal_moves(board, board.side_to_move)
+        # Every legal move at the last ply is a leaf, so there is no need to play them
+        if depth == 1:
+            return len(moves)
+
+        table = self.table
+        if table is not None:
+            # The low bits hold the depth so one position can be stored for several depths
+            table_key = board.zobrist_key << 6 | depth
+            nodes = table.get(table_key)
+            if nodes is not None:
+                self.hash_hits += 1
+                return nodes
+
+        nodes = 0
+        for move in moves:
+            board.make_move(move)
+            nodes += self.count(depth - 1)
+            board.unmake_move(move)
+
+        if table is not None and len(table) < self.hash_entries:
+            table[table_key] = nodes
+        return nodes
+
+    def divide(self, depth):
+        """
+        Leaf counts below each root move, as (move, nodes) pairs.
+        Comparing these with another engine narrows a wrong total down to a move.
+        """
+        board = self.board
+        results = []
+        for move in board.move_generator.generate_legal_moves(board, board.side_to_move):
+            board.make_move(move)
+            results.append((move, self.count(depth - 1)))
+            board.unmake_move(move)
+        return results
+
+
+def run_perft(fen, depth, divide=False, hash_entries=0):
+    """
+    Count (and print) the nodes to the given depth from fen.
+    Returns the node count and the time taken.
+    """
+    board = Board()
+    board.set_fen(fen)
+    perft = Perft(board, hash_entries)
+
+    start_time = time.perf_counter()
+    if divide:
+        results = perft.divide(depth)
+        for move, nodes in sorted(results, key=lambda result: move_name(result[0])):
+            print(f"{move_name(move)}: {nodes}")
+        nodes = sum(nodes for move, nodes in results)
+    else:
+        nodes = perft.count(depth)
+    elapsed = time.perf_counter() - start_time
+
+    print(f"depth {depth}: {nodes} nodes in {elapsed:.2f}s ({nodes / max(elapsed, 1e-9):.0f} nodes/s)", end="")
+    print(f", {perft.hash_hits} hash hits" if hash_entries else "")
+    return nodes, elapsed
+
+
+def run_reference_positions(max_depth=DEFAULT_SUITE_DEPTH, hash_entries=0):
+    """
+    Check every reference position against its known counts up to max_depth.
+    Returns the number of wrong counts.
+    """
+    failures = 0
+    total_nodes = 0
+    total_time = 0.0
+    for name, fen, expected_counts in REFERENCE_POSITIONS:
+        print(f"{name}: {fen}")
+        for depth, expected in enumerate(expected_counts[:max_depth], 1):
+            nodes, elapsed = run_perft(fen, depth, hash_entries=hash_entries)
+            total_nodes += nodes
+            total_time += elapsed
+            if nodes != expected:
+                failures += 1
+                print(f"    expected {expected}, off by {nodes - expected}")
+    print(f"{failures} wrong counts, {total_nodes} nodes in {total_time:.2f}s ({total_nodes / max(total_time, 1e-9):.0f} nodes/s)")
+    return failures
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Count move tree leaf nodes to check and benchmark move generation.")
+    parser.add_argument("--fen", help="position to count from; without it the reference positions are checked")
+    parser.add_argument("--depth", type=int, help="depth to count to")
+    parser.add_argument("--divide", action="store_true", help="print the count below each root move")
+    parser.add_argument("--hash", type=int, default=0, metavar="ENTRIES", help="reuse subtree counts, keeping up to ENTRIES of them")
+    args = parser.parse_args()
+
+    if args.fen is None and not args.divide:
+        failures = run_reference_positions(args.depth or DEFAULT_SUITE_DEPTH, args.hash)
+        raise SystemExit(1 if failures else 0)
+    run_perft(args.fen or START_FEN, args.depth or DEFAULT_SUITE_DEPTH, args.divide, args.hash)
@@ -0,0 +1,335 @@
+import argparse
+import os
+import re
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from Board import Board
+from BitBoard import COLOR_INDEX, SQUARE_POSITIONS, PAWN, KING
+from Move import CASTLING, EN_PASSANT, SQUARE_NAMES
+
+'''
+Streaming reader for PGN game archives, with a SAN move parser built on the
+legal move generator. Games are read a line at a time, so files of any size
+can be replayed in constant memory:
+
+    for headers, movetext in read_games(open("games.pgn")):
+        for board, move in replay_game(headers, movetext):
+            ...
+
+Run as a script it replays every game in the files given, optionally split
+into byte ranges across processes, and reports games and moves per second:
+
+    python3 src/PgnReader.py games.pgn --workers 4
+    python3 src/PgnReader.py games.pgn --validate    also cross-check ChessPieces
+'''
+
+HEADER_PATTERN = re.compile(r'\[(\w+)\s+"(.*)"\]')
+# Comments, variation brackets, NAGs and everything else separated by white space
+TOKEN_PATTERN = re.compile(r"\{[^}]*\}|;[^\n]*|\(|\)|\$\d+|[^\s(){};]+")
+MOVE_NUMBER_PATTERN = re.compile(r"^\d+\.+")
+SAN_PATTERN = re.compile(r"^([NBRQK])?([a-h])?([1-8])?x?([a-h][1-8])(?:=?([NBRQ]))?$")
+RESULTS = {"1-0", "0-1", "1/2-1/2", "*"}
+SAN_PIECES = {"N": 1, "B": 2, "R": 3, "Q": 4, "K": 5}
+# SAN letters indexed by piece type
+SAN_LETTERS = ["", "N", "B", "R", "Q", "K"]
+
+# Error messages kept per run; further errors are only counted
+MAX_ERROR_MESSAGES = 100
+
+# Byte ranges each file is split into per worker
+SHARDS_PER_WORKER = 4
+
+# Bytes read at a time when looking backwards for the start of a line
+LINE_SCAN_SIZE = 4096
+
+
+class PgnError(ValueError):
+    pass
+
+
+def read_games(lines):
+    """
+    Yield (headers, movetext) for every game in an iterable of PGN lines.
+    """
+    headers = {}
+    movetext = []
+    for line in lines:
+        line = line.strip()
+        if line.startswith("["):
+            # Tag pairs after movetext belong to the next game
+            if movetext:
+                yield headers, "\n".join(movetext)
+                headers, movetext = {}, []
+            match = HEADER_PATTERN.match(line)
+            if match:
+                headers[match.group(1)] = match.group(2)
+        elif line and not line.startswith("%"):
+            movetext.append(line)
+    if headers or movetext:
+        yield headers, "\n".join(movetext)
+
+
+def read_moves(movetext):
+    """
+    Yield the SAN moves of the main line, without move numbers, comments, variations or NAGs.
+    """
+    variation_depth = 0
+    for token in TOKEN_PATTERN.findall(movetext):
+        if token == "(":
+            variation_depth += 1
+        elif token == ")":
+            variation_depth -= 1
+        elif variation_depth or token[0] in "{;$":
+            continue
+        else:
+            token = MOVE_NUMBER_PATTERN.sub("", token)
+            if token in RESULTS:
+                return
+            if token:
+                yield token
+
+
+def parse_san(board, san):
+    """
+    The encoded legal move a SAN string such as "Nbxd7+", "e8=Q" or "O-O" stands for.
+    Raises PgnError when no legal move or more than one matches.
+    """
+    san = san.rstrip("+#!?")
+    color = board.side_to_move
+    own_pieces = board.bitboard.pieces[COLOR_INDEX[color]]
+
+    if san in ("O-O", "0-0", "O-O-O", "0-0-0"):
+        # Kingside castling ends on the g file, queenside on the c file
+        target_file = 6 if len(san) == 3 else 2
+        for move in board.move_generator.generate_legal_moves(board, color, own_pieces[KING]):
+            if move >> 15 == CASTLING and (move >> 6 & 63) % 8 == target_file:
+                return move
+        raise PgnError(f"illegal castling {san} in {board.get_fen()}")
+
+    match = SAN_PATTERN.match(san)
+    if match is None:
+        raise PgnError(f"unreadable move {san}")
+    piece_letter, from_file, from_rank, target, promotion_letter = match.groups()
+    piece_type = SAN_PIECES[piece_letter] if piece_letter else PAWN
+    to_square = SQUARE_NAMES.index(target)
+    promotion = SAN_PIECES[promotion_letter] if promotion_letter else 0
+
+    # Only the moves of that piece type to the target square need generating
+    found = None
+    for move in board.move_generator.generate_legal_moves(board, color, own_pieces[piece_type], 1 << to_square):
+        if move >> 12 & 7 != promotion:
+            continue
+        name = SQUARE_NAMES[move & 63]
+        if (from_file and name[0] != from_file) or (from_rank and name[1] != from_rank):
+            continue
+        if found is not None:
+            raise PgnError(f"ambiguous move {san} in {board.get_fen()}")
+        found = move
+    if found is None:
+        raise PgnError(f"illegal move {san} in {board.get_fen()}")
+    return found
+
+
+def move_to_san(board, move):
+    """
+    SAN for a legal move in the board's position, e.g. "Nbxd7+" or "e8=Q#".
+    """
+    from_square = move & 63
+    to_square = move >> 6 & 63
+    if move >> 15 == CASTLING:
+        san = "O-O" if to_square % 8 == 6 else "O-O-O"
+    else:
+        piece_type = board.tiles[SQUARE_POSITIONS[from_square]].type_index
+        capture = board.tiles.get(SQUARE_POSITIONS[to_square]) is not None or move >> 15 == EN_PASSANT
+        from_name = SQUARE_NAMES[from_square]
+        if piece_type == PAWN:
+            san = from_name[0] + "x" if capture else ""
+        else:
+            san = SAN_LETTERS[piece_type]
+            # Name the file, rank or both when another piece of the same type can reach the square
+            same_type = board.bitboard.pieces[COLOR_INDEX[board.side_to_move]][piece_type] & ~(1 << from_square)
+            others = [
+                other & 63
+                for other in board.move_generator.generate_legal_moves(board, board.side_to_move, same_type, 1 << to_square)
+            ]
+            if others:
+                if all(SQUARE_NAMES[other][0] != from_name[0] for other in others):
+                    san += from_name[0]
+                elif all(SQUARE_NAMES[other][1] != from_name[1] for other in others):
+                    san += from_name[1]
+                else:
+                    san += from_name
+            if capture:
+                san += "x"
+        san += SQUARE_NAMES[to_square]
+        if move >> 12 & 7:
+            san += "=" + SAN_LETTERS[move >> 12 & 7]
+
+    board.make_move(move)
+    if board.is_king_exposed(board.side_to_move):
+        san += "#" if not board.move_generator.generate_legal_moves(board, board.side_to_move) else "+"
+    board.unmake_move(move)
+    return san
+
+
+def replay_game(headers, movetext, board=None):
+    """
+    Play through a game, yielding (board, move) before each move is made.
+    Games with a FEN tag start from that position.
+    """
+    if board is None:
+        board = Board()
+    if "FEN" in headers:
+        try:
+            board.set_fen(headers["FEN"])
+        except (ValueError, KeyError, IndexError):
+            raise PgnError(f"bad FEN tag {headers['FEN']}")
+    for san in read_moves(movetext):
+        move = parse_san(board, san)
+        yield board, move
+        board.make_move(move)
+
+
+def validate_position(board):
+    # Compare the move generator with the make-and-test reference in ChessPieces
+    for piece in list(board.tiles.values()):
+        if piece is not None and piece.color == board.side_to_move:
+            if sorted(piece.calculate_valid_moves(board)) != sorted(piece.calculate_tested_moves(board)):
+                return False
+    return True
+
+
+def replay_lines(lines, validate=False):
+    """
+    Replay every game read from lines. Returns (games, moves, errors, messages),
+    errors being the number of games that could not be replayed and messages
+    the reasons for the first MAX_ERROR_MESSAGES of them.
+    """
+    games = 0
+    moves = 0
+    errors = 0
+    messages = []
+    for headers, movetext in read_games(lines):
+        games += 1
+        try:
+            for board, move in replay_game(headers, movetext):
+                if validate and not validate_position(board):
+                    raise PgnError(f"move generators disagree in {board.get_fen()}")
+                moves += 1
+        except PgnError as error:
+            errors += 1
+            if len(messages) < MAX_ERROR_MESSAGES:
+                messages.append(f"game {games} ({headers.get('White', '?')} - {headers.get('Black', '?')}): {error}")
+    return games, moves, errors, messages
+
+
+def get_line_start(file, offset):
+    """
+    Offset of the start of the line holding the byte at offset.
+    """
+    end = offset
+    while end > 0:
+        begin = max(end - LINE_SCAN_SIZE, 0)
+        file.seek(begin)
+        newline = file.read(end - begin).rfind(b"\n")
+        if newline >= 0:
+            return begin + newline + 1
+        end = begin
+    return 0
+
+
+def read_shard(path, start, end):
+    """
+    Yield the lines of the games that start within bytes [start, end) of a PGN file.
+    A game starts at a tag line that does not follow another tag line, as in read_games.
+    """
+    with open(path, "rb") as file:
+        # The first line beginning at or after start; stepping back one byte keeps a line beginning at start
+        first = 0
+        if start > 0:
+            file.seek(start - 1)
+            file.readline()
+            first = file.tell()
+        # The last non-blank line before it, which says whether a tag line there opens a game
+        previous = b""
+        line_start = first
+        while line_start > 0 and not previous:
+            line_start = get_line_start(file, line_start - 1)
+            file.seek(line_start)
+            previous = file.readline().strip()
+
+        file.seek(first)
+        started = False
+        while True:
+            position = file.tell()
+            line = file.readline()
+            if not line:
+                break
+            stripped = line.strip()
+            if stripped.startswith(b"[") and not previous.startswith(b"["):
+                if position >= end:
+                    break
+                started = True
+            if stripped:
+                previous = stripped
+            if started:
+                yield line.decode("utf-8", "replace")
+
+
+def replay_shard(path, start, end, validate):
+    return replay_lines(read_shard(path, start, end), validate)
+
+
+def replay_files(paths, workers=1, validate=False):
+    """
+    Replay every game in the given PGN files (- for stdin). With several workers
+    each file is split into byte ranges replayed in parallel; stdin cannot be
+    split, so it is replayed in this process while the workers run.
+    Returns (games, moves, errors, messages) like replay_lines.
+    """
+    if workers <= 1:
+        results = []
+        for path in paths:
+            if path == "-":
+                results.append(replay_lines(sys.stdin, validate))
+            else:
+                with open(path, encoding="utf-8", errors="replace") as lines:
+                    results.append(replay_lines(lines, validate))
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = []
+            for path in paths:
+                if path == "-":
+                    continue
+                # A few ranges per worker, so one slow range does not leave the others idle
+                size = os.path.getsize(path)
+                shard_size = size // (workers * SHARDS_PER_WORKER) + 1
+                for start in range(0, size, shard_size):
+                    futures.append(executor.submit(replay_shard, path, start, start + shard_size, validate))
+            results = [replay_lines(sys.stdin, validate)] if "-" in paths else []
+            results += [future.result() for future in futures]
+
+    games = sum(result[0] for result in results)
+    moves = sum(result[1] for result in results)
+    errors = sum(result[2] for result in results)
+    messages = [message for result in results for message in result[3]][:MAX_ERROR_MESSAGES]
+    return games, moves, errors, messages
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay PGN files through the rules engine and measure throughput.")
+    parser.add_argument("paths", nargs="+", help="PGN files, or - for stdin")
+    parser.add_argument("--workers", type=int, default=1, help="processes to split each file across")
+    parser.add_argument("--validate", action="store_true", help="cross-check the move generator in every position (slow)")
+    args = parser.parse_args()
+
+    start_time = time.perf_counter()
+    games, moves, errors, messages = replay_files(args.paths, args.workers, args.validate)
+    elapsed = time.perf_counter() - start_time
+    for message in messages[:20]:
+        print(message)
+    print(
+        f"{games} games, {moves} moves, {errors} errors in {elapsed:.2f}s "
+        f"({games / max(elapsed, 1e-9):.1f} games/s, {moves / max(elapsed, 1e-9):.0f} moves/s)"
+    )
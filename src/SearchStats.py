@@ -0,0 +1,95 @@
+from Move import move_name
+
+'''
+What one call to ChessAI.calculate_move did. Everything here is filled in
+once per iteration from counters the search keeps anyway, so collecting it
+costs nothing per node.
+'''
+
+class SearchStats:
+    def __init__(self):
+        self.depth = 0
+        self.score = None
+        self.best_move = None
+        self.nodes = 0
+        self.qnodes = 0
+        self.elapsed = 0.0
+        self.tt_probes = 0
+        self.tt_hits = 0
+        # Positions settled by the endgame tables instead of searched
+        self.tablebase_hits = 0
+        # cutoffs_by_index[i] is how many beta cutoffs came from the i-th move searched
+        self.cutoffs_by_index = []
+        # One dict per completed iterative deepening iteration, see add_iteration
+        self.iterations = []
+
+    def add_iteration(self, depth, score, move, nodes, qnodes, elapsed):
+        """
+        Record a finished iteration. nodes and qnodes count that iteration only,
+        elapsed is its own time in seconds.
+        """
+        iteration = {
+            "depth": depth,
+            "score": score,
+            "move": move_name(move) if move else None,
+            "nodes": nodes,
+            "qnodes": qnodes,
+            "time": elapsed,
+            "nps": int((nodes + qnodes) / elapsed) if elapsed > 0 else 0,
+        }
+        self.iterations.append(iteration)
+        return iteration
+
+    def get_nps(self):
+        if self.elapsed <= 0:
+            return 0
+        return int((self.nodes + self.qnodes) / self.elapsed)
+
+    def get_tt_hit_rate(self):
+        if self.tt_probes == 0:
+            return 0.0
+        return self.tt_hits / self.tt_probes
+
+    def get_first_move_cutoff_rate(self):
+        total = sum(self.cutoffs_by_index)
+        if total == 0:
+            return 0.0
+        return self.cutoffs_by_index[0] / total
+
+    def get_effective_branching_factor(self):
+        """
+        How many times more nodes the last iteration needed than the one before.
+        """
+        if len(self.iterations) < 2:
+            return 0.0
+        last, previous = self.iterations[-1], self.iterations[-2]
+        previous_nodes = previous["nodes"] + previous["qnodes"]
+        if previous_nodes == 0:
+            return 0.0
+        return (last["nodes"] + last["qnodes"]) / previous_nodes
+
+    def to_dict(self):
+        return {
+            "depth": self.depth,
+            "score": self.score,
+            "move": move_name(self.best_move) if self.best_move else None,
+            "nodes": self.nodes,
+            "qnodes": self.qnodes,
+            "time": self.elapsed,
+            "nps": self.get_nps(),
+            "tt_hit_rate": self.get_tt_hit_rate(),
+            "tablebase_hits": self.tablebase_hits,
+            "first_move_cutoff_rate": self.get_first_move_cutoff_rate(),
+            "cutoffs_by_index": self.cutoffs_by_index,
+            "effective_branching_factor": self.get_effective_branching_factor(),
+            "iterations": self.iterations,
+        }
+
+    def __str__(self):
+        return (
+            f"depth {self.depth} score {self.score} move {move_name(self.best_move) if self.best_move else None} "
+            f"nodes {self.nodes} qnodes {self.qnodes} {self.get_nps()} nodes/s "
+            f"tt hits {self.get_tt_hit_rate():.0%} first move cutoffs {self.get_first_move_cutoff_rate():.0%} "
+            f"ebf {self.get_effective_branching_factor():.1f}"
+        )
+
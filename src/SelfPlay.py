@@ -0,0 +1,367 @@
+import argparse
+import importlib
+import math
+import time
+import types
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from Board import Board, START_FEN
+from BitBoard import WHITE, BLACK, PAWN, KNIGHT, BISHOP, ROOK, QUEEN, count_squares
+from ChessAI import ChessAI
+from Move import move_name
+from PgnReader import move_to_san
+
+'''
+Headless matches between two ChessAI configurations, to tell whether a
+change makes the engine stronger and not just slower:
+
+    python3 src/SelfPlay.py --engine-a "name=new,depth=3" --engine-b "name=old,depth=2" --games 40 --workers 4
+    python3 src/SelfPlay.py --engine-a "time=0.2" --engine-b "time=0.1" --sprt 0 50 --games 1000
+
+An engine is a comma separated list of settings: name, time (seconds per
+move), depth, nodes, hash (MB), tablebases (directory) and eval, a
+module:function to use in place of ChessAI.evaluate_board, called as
+function(ai, board, color). Scores are integer centipawns, so what it returns
+is rounded to the nearest one. With depth or nodes and no time, moves are
+only limited by those.
+
+Every opening is played twice, once with each engine as White. Games run in
+parallel in a pool of processes, each with fresh engines. The result is
+reported as an Elo difference with a 95% error margin; with --sprt the match
+stops as soon as the sequential probability ratio test accepts either
+hypothesis.
+'''
+
+# Openings as moves from the start position, so that both engines get the same variety
+OPENINGS = [
+    "",
+    "e2e4 e7e5 g1f3 b8c6",
+    "e2e4 c7c5 g1f3 d7d6",
+    "e2e4 e7e6 d2d4 d7d5",
+    "e2e4 c7c6 d2d4 d7d5",
+    "d2d4 d7d5 c2c4 e7e6",
+    "d2d4 g8f6 c2c4 g7g6",
+    "c2c4 e7e5 b1c3 g8f6",
+]
+
+# Games still going after this many plies are adjudicated as draws
+DEFAULT_MAX_PLIES = 300
+
+ENGINE_SETTINGS = {"name": str, "time": float, "depth": int, "nodes": int, "hash": int, "tablebases": str, "eval": str}
+
+RESULT_POINTS = {"1-0": 1.0, "0-1": 0.0, "1/2-1/2": 0.5}
+
+
+def parse_engine(text, default_name):
+    """
+    Settings dict for a string such as "name=new,depth=3,time=0.5".
+    """
+    engine = {"name": default_name}
+    for item in text.split(","):
+        if not item.strip():
+            continue
+        key, _, value = item.partition("=")
+        key = key.strip()
+        if key not in ENGINE_SETTINGS:
+            raise ValueError(f"unknown engine setting {key}")
+        engine[key] = ENGINE_SETTINGS[key](value.strip())
+    if "time" not in engine and "depth" not in engine and "nodes" not in engine:
+        engine["time"] = 0.1
+    return engine
+
+
+def create_engine(engine, color):
+    ai = ChessAI(
+        color, node_budget=engine.get("nodes"), max_depth=engine.get("depth", 64),
+        tt_memory_mb=engine.get("hash", 16), tablebase_path=engine.get("tablebases")
+    )
+    if "eval" in engine:
+        module_name, function_name = engine["eval"].split(":")
+        evaluate = getattr(importlib.import_module(module_name), function_name)
+
+        # Scores are integer centipawns (the transposition table stores them as ints)
+        def evaluate_board(ai, board, color):
+            return int(round(evaluate(ai, board, color)))
+
+        ai.evaluate_board = types.MethodType(evaluate_board, ai)
+    return ai
+
+
+def get_opening_fen(opening):
+    """
+    FEN for an opening given as UCI moves from the start position, or as a FEN itself.
+    """
+    if "/" in opening:
+        return opening
+    board = Board()
+    board.set_fen(START_FEN)
+    for name in opening.split():
+        legal_moves = board.move_generator.generate_legal_moves(board, board.side_to_move)
+        board.make_move(next(move for move in legal_moves if move_name(move) == name))
+    return board.get_fen()
+
+
+def has_insufficient_material(board):
+    # Neither side can mate: bare kings, or one knight or bishop between them
+    pieces = board.bitboard.pieces
+    for color in (WHITE, BLACK):
+        if pieces[color][PAWN] or pieces[color][ROOK] or pieces[color][QUEEN]:
+            return False
+    minors = sum(count_squares(pieces[color][KNIGHT] | pieces[color][BISHOP]) for color in (WHITE, BLACK))
+    return minors <= 1
+
+
+def get_game_result(board, repetitions, max_plies):
+    """
+    (result, reason) once the game is over, or (None, None) while it goes on.
+    """
+    if not board.get_legal_moves():
+        if board.is_king_exposed(board.side_to_move):
+            return ("0-1" if board.side_to_move == "White" else "1-0"), "checkmate"
+        return "1/2-1/2", "stalemate"
+    if board.halfmove_clock >= 100:
+        return "1/2-1/2", "fifty-move rule"
+    if repetitions.get(board.zobrist_key, 0) >= 3:
+        return "1/2-1/2", "threefold repetition"
+    if has_insufficient_material(board):
+        return "1/2-1/2", "insufficient material"
+    if board.ply >= max_plies:
+        return "1/2-1/2", "move limit"
+    return None, None
+
+
+def play_game(fen, white, black, max_plies=DEFAULT_MAX_PLIES):
+    """
+    Play one game from fen between two engine settings dicts. Returns a dict of
+    the result, the reason it ended, the SAN moves and each side's nodes and thinking time.
+    """
+    board = Board()
+    board.set_fen(fen)
+    engines = {"White": create_engine(white, "White"), "Black": create_engine(black, "Black")}
+    settings = {"White": white, "Black": black}
+    usage = {color: {"nodes": 0, "time": 0.0, "moves": 0} for color in engines}
+    repetitions = {board.zobrist_key: 1}
+    moves = []
+
+    while True:
+        result, reason = get_game_result(board, repetitions, max_plies)
+        if result is not None:
+            break
+        color = board.side_to_move
+        ai = engines[color]
+        start_time = time.perf_counter()
+        move = ai.calculate_move(board, move_time=settings[color].get("time", float('inf')))
+        usage[color]["time"] += time.perf_counter() - start_time
+        usage[color]["nodes"] += ai.stats.nodes + ai.stats.qnodes
+        usage[color]["moves"] += 1
+        moves.append(move_to_san(board, move))
+        board.make_move(move)
+        repetitions[board.zobrist_key] = repetitions.get(board.zobrist_key, 0) + 1
+
+    for ai in engines.values():
+        ai.close()
+    return {"fen": fen, "result": result, "reason": reason, "moves": moves, "usage": usage}
+
+
+def score_to_elo(score):
+    return -400 * math.log10(1 / score - 1)
+
+
+def elo_to_score(elo):
+    return 1 / (1 + 10 ** (-elo / 400))
+
+
+def clamp_score(score):
+    # Keep away from 0 and 1, where the Elo difference is infinite
+    return min(max(score, 1e-3), 1 - 1e-3)
+
+
+def get_score_variance(wins, draws, losses):
+    """
+    Mean score per game and its variance. Half a game of each result is added for the
+    variance only, so that a one-sided record does not look certain.
+    """
+    games = wins + draws + losses
+    score = (wins + draws / 2) / games
+    wins, draws, losses = wins + 0.5, draws + 0.5, losses + 0.5
+    mean = (wins + draws / 2) / (games + 1.5)
+    variance = (wins * (1 - mean) ** 2 + draws * (0.5 - mean) ** 2 + losses * mean ** 2) / (games + 1.5)
+    return score, variance
+
+
+def get_elo(wins, draws, losses):
+    """
+    Elo difference and its 95% error margin for a win/draw/loss record.
+    """
+    games = wins + draws + losses
+    if games == 0:
+        return 0.0, float('inf')
+    score, variance = get_score_variance(wins, draws, losses)
+    margin = 1.96 * math.sqrt(variance / games)
+    elo = score_to_elo(clamp_score(score))
+    return elo, (score_to_elo(clamp_score(score + margin)) - score_to_elo(clamp_score(score - margin))) / 2
+
+
+def get_sprt_llr(wins, draws, losses, elo0, elo1):
+    """
+    Log likelihood ratio of elo1 against elo0, in the normal approximation to the game results.
+    """
+    games = wins + draws + losses
+    if games == 0:
+        return 0.0
+    score, variance = get_score_variance(wins, draws, losses)
+    score0, score1 = elo_to_score(elo0), elo_to_score(elo1)
+    return games * (score1 - score0) * (2 * score - score0 - score1) / (2 * variance)
+
+
+def get_sprt_bounds(alpha, beta):
+    return math.log(beta / (1 - alpha)), math.log((1 - beta) / alpha)
+
+
+def write_pgn(file, game, white, black, round_number):
+    file.write(f'[Event "Self-play"]\n[Round "{round_number}"]\n')
+    file.write(f'[White "{white["name"]}"]\n[Black "{black["name"]}"]\n[Result "{game["result"]}"]\n')
+    file.write(f'[Termination "{game["reason"]}"]\n')
+    if game["fen"] != START_FEN:
+        file.write(f'[SetUp "1"]\n[FEN "{game["fen"]}"]\n')
+    fields = game["fen"].split()
+    move_number = int(fields[5])
+    black_to_move = fields[1] == "b"
+    text = []
+    for san in game["moves"]:
+        if not black_to_move:
+            text.append(f"{move_number}.")
+        elif not text:
+            text.append(f"{move_number}...")
+        text.append(san)
+        if black_to_move:
+            move_number += 1
+        black_to_move = not black_to_move
+    text.append(game["result"])
+    file.write("\n" + " ".join(text) + "\n\n")
+
+
+def run_match(engine_a, engine_b, games, openings, workers=1, max_plies=DEFAULT_MAX_PLIES, sprt=None, pgn_path=None, progress=print):
+    """
+    Play up to games games between engine_a and engine_b, each opening twice with
+    colours swapped. sprt, when given, is (elo0, elo1, alpha, beta) and stops the
+    match once either hypothesis is accepted. Returns a summary dict from engine_a's point of view.
+    """
+    fens = [get_opening_fen(opening) for opening in openings]
+    schedule = []
+    for game in range(games):
+        # Each pair of games shares an opening, engine_a is White in the first
+        fen = fens[game // 2 % len(fens)]
+        schedule.append((fen, engine_a, engine_b) if game % 2 == 0 else (fen, engine_b, engine_a))
+
+    if engine_a["name"] == engine_b["name"]:
+        raise ValueError("the engines need different names")
+    wins = draws = losses = 0
+    reasons = {}
+    usage = {engine["name"]: {"nodes": 0, "time": 0.0, "moves": 0} for engine in (engine_a, engine_b)}
+    bounds = get_sprt_bounds(sprt[2], sprt[3]) if sprt else None
+    llr = 0.0
+    sprt_result = None
+    pgn_file = open(pgn_path, "w") if pgn_path else None
+    played = 0
+
+    executor = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+    if executor is None:
+        results = ((index, play_game(fen, white, black, max_plies)) for index, (fen, white, black) in enumerate(schedule))
+    else:
+        futures = {
+            executor.submit(play_game, fen, white, black, max_plies): index
+            for index, (fen, white, black) in enumerate(schedule)
+        }
+        results = ((futures[future], future.result()) for future in as_completed(futures))
+
+    for index, game in results:
+        fen, white, black = schedule[index]
+        played += 1
+        points = RESULT_POINTS[game["result"]]
+        if white is engine_b:
+            points = 1 - points
+        if points == 1:
+            wins += 1
+        elif points == 0:
+            losses += 1
+        else:
+            draws += 1
+        reasons[game["reason"]] = reasons.get(game["reason"], 0) + 1
+        for color, engine in (("White", white), ("Black", black)):
+            for key in ("nodes", "time", "moves"):
+                usage[engine["name"]][key] += game["usage"][color][key]
+        if pgn_file is not None:
+            write_pgn(pgn_file, game, white, black, index + 1)
+
+        game_nps = {
+            engine["name"]: int(game["usage"][color]["nodes"] / max(game["usage"][color]["time"], 1e-9))
+            for color, engine in (("White", white), ("Black", black))
+        }
+        progress(
+            f"game {index + 1}: {white['name']} - {black['name']} {game['result']} ({game['reason']}, "
+            f"{len(game['moves'])} plies) nps {game_nps[white['name']]}/{game_nps[black['name']]}; "
+            f"{engine_a['name']} +{wins} ={draws} -{losses}"
+        )
+
+        if sprt:
+            llr = get_sprt_llr(wins, draws, losses, sprt[0], sprt[1])
+            if llr <= bounds[0] or llr >= bounds[1]:
+                sprt_result = "H1 accepted" if llr >= bounds[1] else "H0 accepted"
+                break
+
+    if executor is not None:
+        executor.shutdown(cancel_futures=True)
+    if pgn_file is not None:
+        pgn_file.close()
+
+    elo, margin = get_elo(wins, draws, losses)
+    summary = {
+        "games": played, "wins": wins, "draws": draws, "losses": losses,
+        "elo": elo, "elo_margin": margin, "reasons": reasons,
+        "engines": {
+            name: {
+                "nps": int(totals["nodes"] / max(totals["time"], 1e-9)),
+                "time_per_move": totals["time"] / max(totals["moves"], 1),
+            }
+            for name, totals in usage.items()
+        },
+    }
+    if sprt:
+        summary.update({"llr": llr, "llr_bounds": bounds, "sprt": sprt_result or "inconclusive"})
+    return summary
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Play a match between two engine configurations.")
+    parser.add_argument("--engine-a", default="", help='settings of the engine under test, e.g. "name=new,depth=3"')
+    parser.add_argument("--engine-b", default="", help="settings of the engine to compare against")
+    parser.add_argument("--games", type=int, default=16, help="most games to play")
+    parser.add_argument("--openings", help="file of openings, one FEN or line of UCI moves each (default: built in)")
+    parser.add_argument("--workers", type=int, default=1, help="games played at once")
+    parser.add_argument("--max-plies", type=int, default=DEFAULT_MAX_PLIES, help="plies after which a game is drawn")
+    parser.add_argument("--sprt", nargs=2, type=float, metavar=("ELO0", "ELO1"), help="stop early by SPRT of ELO1 against ELO0")
+    parser.add_argument("--alpha", type=float, default=0.05)
+    parser.add_argument("--beta", type=float, default=0.05)
+    parser.add_argument("--pgn", help="file to write the games to")
+    args = parser.parse_args()
+
+    engine_a = parse_engine(args.engine_a, "A")
+    engine_b = parse_engine(args.engine_b, "B")
+    openings = OPENINGS
+    if args.openings:
+        with open(args.openings) as lines:
+            openings = [line.strip() for line in lines if line.strip() and not line.startswith("#")]
+    sprt = (args.sprt[0], args.sprt[1], args.alpha, args.beta) if args.sprt else None
+
+    start_time = time.perf_counter()
+    summary = run_match(engine_a, engine_b, args.games, openings, args.workers, args.max_plies, sprt, args.pgn)
+    print(
+        f"{engine_a['name']} vs {engine_b['name']}: +{summary['wins']} ={summary['draws']} -{summary['losses']} "
+        f"in {summary['games']} games, Elo {summary['elo']:+.0f} +/- {summary['elo_margin']:.0f} "
+        f"({time.perf_counter() - start_time:.0f}s)"
+    )
+    print("endings: " + ", ".join(f"{reason} {count}" for reason, count in sorted(summary["reasons"].items())))
+    for name, engine in summary["engines"].items():
+        print(f"{name}: {engine['nps']} nodes/s, {engine['time_per_move']:.3f}s per move")
+    if sprt:
+        print(f"SPRT [{sprt[0]:.0f}, {sprt[1]:.0f}]: LLR {summary['llr']:.2f} {summary['llr_bounds'][0]:.2f}..{summary['llr_bounds'][1]:.2f}, {summary['sprt']}")
@@ -8,28 +8,15 @@ class StateChecker:
         # Check if the king is in check
         if board.is_king_exposed(color):
             print("CHECK!")
-            # Iterate through all pieces of the current player
-            pieces = [piece for piece in board.tiles.values() if piece and piece.color == color]
-            all_moves = []
-            for piece in pieces:
-                all_moves.extend(piece.calculate_valid_moves(board))
-                if len(all_moves) != 0:
-                    return False
-            return True
+            # Checkmate if the current player has no legal move out of it
+            return not board.get_legal_moves(color)
         return False
 
     def is_stalemate(self, board, color):
         # Check if the king is not in check
         if not board.is_king_exposed(color):
-            # Iterate over all pieces of the specified color
-            pieces = [piece for piece in board.tiles.values() if piece and piece.color == color]
-            for piece in pieces:
-                # Check if the piece has any valid moves
-                if piece.calculate_valid_moves(board):
-                    # If any piece has valid moves, it's not stalemate
-                    return False
-            # All pieces have no valid moves, it's stalemate
-            return True
+            # Stalemate if the current player has no legal moves at all
+            return not board.get_legal_moves(color)
         # King is in check, not stalemate
         return False
 
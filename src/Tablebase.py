@@ -0,0 +1,264 @@
+import mmap
+import os
+from BitBoard import PAWN, KNIGHT, BISHOP, ROOK, QUEEN, KING, WHITE, BLACK, COLOR_INDEX, count_squares
+
+'''
+Endgame tablebases: distance to mate for every position of a few small
+material configurations, built offline by TablebaseGenerator.py and
+memory-mapped here, so probing one costs a single byte read.
+
+A table is named after its material, stronger side first, e.g. KQvK or
+KBNvK, and always has the stronger side as White; positions with the colours
+the other way round are probed flipped top to bottom. Each table holds one
+byte per index, first for every position with White to move and then with
+Black to move:
+
+    0           draw (also used for illegal and duplicate indices)
+    1 to 127    the side to move mates in that many plies
+    128 + n     the side to move is mated in n plies
+
+Positions are reduced by symmetry before indexing. Without pawns the board
+can be mirrored and rotated, so White's king is mapped into the a1-d1-d4
+triangle (10 squares); with pawns only mirroring across the d/e files is
+allowed, so White's king is kept on the a-d files (32 squares). The other
+pieces take 64 squares each. Castling rights and en passant (which only
+matters with pawns on both sides) are not represented; such positions are
+not probed. The fifty-move rule is ignored.
+'''
+
+TABLE_EXTENSION = ".tb"
+# Most pieces, kings included, that the tables handle
+MAX_PIECES = 4
+
+# Probe results, from the side to move's point of view
+WIN = 1
+DRAW = 0
+LOSS = -1
+
+# Byte values at and above this are losses
+LOSS_OFFSET = 128
+
+# Letters in the order pieces are listed in a table name
+MATERIAL_LETTERS = "KQRBNP"
+LETTER_TYPES = {"P": PAWN, "N": KNIGHT, "B": BISHOP, "R": ROOK, "Q": QUEEN, "K": KING}
+
+
+def _transform_square(square, transform):
+    # Bit 0 mirrors the files, bit 1 the ranks, bit 2 swaps files and ranks after those
+    x, y = square % 8, square // 8
+    if transform & 1:
+        x = 7 - x
+    if transform & 2:
+        y = 7 - y
+    if transform & 4:
+        x, y = y, x
+    return y * 8 + x
+
+
+TRANSFORMS = [[_transform_square(square, transform) for square in range(64)] for transform in range(8)]
+
+# White king squares kept by the symmetry reduction, in index order
+TRIANGLE_SQUARES = [y * 8 + x for y in range(4) for x in range(4) if x <= y]
+PAWN_KING_SQUARES = [y * 8 + x for y in range(8) for x in range(4)]
+
+
+def _triangle_transforms(square):
+    # The transforms taking a king square into the triangle; two when it ends up on the diagonal
+    transform = (1 if square % 8 > 3 else 0) | (2 if square // 8 > 3 else 0)
+    mapped = TRANSFORMS[transform][square]
+    if mapped % 8 > mapped // 8:
+        return [transform | 4]
+    if mapped % 8 == mapped // 8:
+        return [transform, transform | 4]
+    return [transform]
+
+
+TRIANGLE_TRANSFORMS = [_triangle_transforms(square) for square in range(64)]
+PAWN_TRANSFORMS = [[1 if square % 8 > 3 else 0] for square in range(64)]
+
+# Material no position of which can end in mate, so every position is a draw without a table
+DRAWN_MATERIAL = {"KvK", "KBvK", "KNvK"}
+
+
+def material_name(white_types, black_types):
+    """
+    Table name for the piece types of each side, stronger side first, e.g. "KRvK".
+    Returns (name, flipped), flipped being True when Black is the stronger side.
+    """
+    white = "".join(sorted((MATERIAL_LETTERS[5 - piece_type] for piece_type in white_types), key=MATERIAL_LETTERS.index))
+    black = "".join(sorted((MATERIAL_LETTERS[5 - piece_type] for piece_type in black_types), key=MATERIAL_LETTERS.index))
+    white_key = [MATERIAL_LETTERS.index(letter) for letter in white]
+    black_key = [MATERIAL_LETTERS.index(letter) for letter in black]
+    # More pieces is stronger, then better pieces
+    if (len(black), [-i for i in black_key]) > (len(white), [-i for i in white_key]):
+        return f"{black}v{white}", True
+    return f"{white}v{black}", False
+
+
+class TableLayout:
+    """
+    How the positions of one material configuration are numbered.
+    """
+    def __init__(self, name):
+        self.name = name
+        white, black = name.split("v")
+        if white[0] != "K" or black[0] != "K" or any(letter not in LETTER_TYPES for letter in white + black):
+            raise ValueError(f"bad material {name}")
+        # (color, piece type) of every piece in index order: the kings, then White's pieces, then Black's
+        self.pieces = [(WHITE, KING), (BLACK, KING)]
+        self.pieces += [(WHITE, LETTER_TYPES[letter]) for letter in white[1:]]
+        self.pieces += [(BLACK, LETTER_TYPES[letter]) for letter in black[1:]]
+        self.has_pawns = "P" in name
+        # Ranges of identical pieces, whose squares are sorted so that either order gives the same index
+        self.groups = []
+        start = 0
+        for i in range(1, len(self.pieces) + 1):
+            if i == len(self.pieces) or self.pieces[i] != self.pieces[start]:
+                if i - start > 1:
+                    self.groups.append((start, i))
+                start = i
+        if self.has_pawns:
+            self.king_squares = PAWN_KING_SQUARES
+            self.king_transforms = PAWN_TRANSFORMS
+        else:
+            self.king_squares = TRIANGLE_SQUARES
+            self.king_transforms = TRIANGLE_TRANSFORMS
+        self.king_slots = {square: slot for slot, square in enumerate(self.king_squares)}
+        # Positions per side to move
+        self.size = len(self.king_squares) * 64 ** (len(self.pieces) - 1)
+
+    def get_index(self, squares, side):
+        """
+        Index of the position with the pieces on squares (in self.pieces order) and side (WHITE or BLACK) to move.
+        """
+        best = None
+        for transform in self.king_transforms[squares[0]]:
+            mapping = TRANSFORMS[transform]
+            mapped = [mapping[square] for square in squares]
+            for start, end in self.groups:
+                mapped[start:end] = sorted(mapped[start:end])
+            index = self.king_slots[mapped[0]]
+            for square in mapped[1:]:
+                index = index * 64 + square
+            if best is None or index < best:
+                best = index
+        return best + side * self.size
+
+    def get_squares(self, index):
+        """
+        The squares and side to move of an index; the inverse of get_index for canonical indices.
+        """
+        side, index = divmod(index, self.size)
+        squares = []
+        for piece in range(len(self.pieces) - 1):
+            index, square = divmod(index, 64)
+            squares.append(square)
+        squares.append(self.king_squares[index])
+        squares.reverse()
+        return squares, side
+
+
+LAYOUTS = {}
+
+
+def get_layout(name):
+    if name not in LAYOUTS:
+        LAYOUTS[name] = TableLayout(name)
+    return LAYOUTS[name]
+
+
+def decode_value(value):
+    """
+    (WIN, DRAW or LOSS, plies to mate) for a table byte.
+    """
+    if value == 0:
+        return DRAW, 0
+    if value < LOSS_OFFSET:
+        return WIN, value
+    return LOSS, value - LOSS_OFFSET
+
+
+class Tablebase:
+    def __init__(self, directory):
+        self.directory = directory
+        self.files = {}
+        # Table name -> memory-mapped table
+        self.tables = {}
+        for file_name in sorted(os.listdir(directory)):
+            if file_name.endswith(TABLE_EXTENSION):
+                self.open_table(file_name[:-len(TABLE_EXTENSION)])
+        self.max_pieces = max((len(get_layout(name).pieces) for name in self.tables), default=0)
+        self.probes = 0
+        self.hits = 0
+
+    def open_table(self, name):
+        layout = get_layout(name)
+        path = os.path.join(self.directory, name + TABLE_EXTENSION)
+        if os.path.getsize(path) != 2 * layout.size:
+            raise ValueError(f"{path} is not a complete {name} table")
+        file = open(path, "rb")
+        self.files[name] = file
+        self.tables[name] = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def close(self):
+        for table in self.tables.values():
+            table.close()
+        for file in self.files.values():
+            file.close()
+        self.tables = {}
+        self.files = {}
+
+    def probe_pieces(self, pieces, side):
+        """
+        Look up a position given as (color, piece type, square) triples with side to move.
+        Returns a table byte, or None when there is no table for the material.
+        """
+        name, flipped = material_name(
+            [piece_type for color, piece_type, square in pieces if color == WHITE],
+            [piece_type for color, piece_type, square in pieces if color == BLACK]
+        )
+        if name in DRAWN_MATERIAL:
+            return 0
+        table = self.tables.get(name)
+        if table is None:
+            return None
+        layout = get_layout(name)
+        if flipped:
+            # Swap the colours and mirror the ranks, so the stronger side is White moving the same way
+            pieces = [(color ^ 1, piece_type, square ^ 56) for color, piece_type, square in pieces]
+            side ^= 1
+        # Hand out the squares in the layout's piece order
+        remaining = list(pieces)
+        squares = []
+        for color, piece_type in layout.pieces:
+            for i, piece in enumerate(remaining):
+                if piece[0] == color and piece[1] == piece_type:
+                    squares.append(piece[2])
+                    del remaining[i]
+                    break
+        return table[layout.get_index(squares, side)]
+
+    def probe(self, board):
+        """
+        (WIN, DRAW or LOSS, plies to mate) for the side to move, or None when the
+        position is not in the tables.
+        """
+        bitboard = board.bitboard
+        if count_squares(bitboard.occupied) > self.max_pieces or board.castling_rights:
+            return None
+        pieces = []
+        for color in (WHITE, BLACK):
+            for piece_type, bits in enumerate(bitboard.pieces[color]):
+                while bits:
+                    square = (bits & -bits).bit_length() - 1
+                    pieces.append((color, piece_type, square))
+                    bits &= bits - 1
+        # En passant is not in the tables; it can only matter with pawns on both sides
+        if board.en_passant_square is not None and bitboard.pieces[WHITE][PAWN] and bitboard.pieces[BLACK][PAWN]:
+            return None
+        self.probes += 1
+        value = self.probe_pieces(pieces, COLOR_INDEX[board.side_to_move])
+        if value is None:
+            return None
+        self.hits += 1
+        return decode_value(value)
@@ -0,0 +1,430 @@
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from BitBoard import (
+    PAWN, KNIGHT, BISHOP, ROOK, QUEEN, KING, WHITE, BLACK,
+    KNIGHT_ATTACKS, KING_ATTACKS, PAWN_ATTACKS, rook_attacks, bishop_attacks
+)
+from Tablebase import Tablebase, get_layout, material_name, DRAWN_MATERIAL, TABLE_EXTENSION, LOSS_OFFSET
+
+'''
+Builds the endgame tables read by Tablebase.py by retrograde analysis:
+
+1. Every index is decoded and its legal moves generated once. Checkmates are
+   lost in 0 plies. Captures and promotions leave the table, and are scored
+   from the smaller tables, which are built first.
+2. Working outwards one ply at a time, every position with a move to a
+   position lost in n plies is won in n + 1, and a position whose moves all
+   lead to positions won for the opponent is lost in one ply more than the
+   longest of them. Predecessors are found by un-making moves, and a count
+   of the moves not yet known to lose is kept per position.
+3. Whatever is left unresolved is a draw.
+
+Tables are built in one process, or with --workers N the scan and the
+search for predecessors are split across a pool of processes:
+
+    python3 src/TablebaseGenerator.py                       the default set
+    python3 src/TablebaseGenerator.py KBNvK --workers 4     one table and what it needs
+
+Three-piece tables take seconds; four-piece tables hold about five million
+indices and take a few minutes each in one process.
+'''
+
+DEFAULT_TABLES = ["KQvK", "KRvK", "KPvK"]
+DEFAULT_DIRECTORY = os.getcwd() + "/resources/tablebases"
+
+# Index ranges each worker's share of a scan is split into
+CHUNKS_PER_WORKER = 8
+# Positions between progress lines while scanning
+PROGRESS_INTERVAL = 100000
+
+# Flags of a position's moves out of the table
+WIN_EXIT = 1
+DRAW_EXIT = 2
+
+# Kinds of resolved positions
+WON = 1
+LOST = 2
+
+PROMOTION_TYPES = [QUEEN, ROOK, BISHOP, KNIGHT]
+
+# The generator of a worker process, created by init_worker
+worker_generator = None
+
+
+def init_worker(name, directory):
+    global worker_generator
+    worker_generator = TablebaseGenerator(name, directory)
+
+
+def scan_range(start, end):
+    return worker_generator.scan(start, end)
+
+
+def find_predecessors(indices):
+    return worker_generator.find_predecessors(indices)
+
+
+class TablebaseGenerator:
+    def __init__(self, name, directory):
+        self.name = name
+        self.directory = directory
+        self.layout = get_layout(name)
+        self.pieces = self.layout.pieces
+        # Indices into self.pieces of each side's pieces; each side's king is its first
+        self.side_pieces = [[i for i, piece in enumerate(self.pieces) if piece[0] == color] for color in (WHITE, BLACK)]
+        # The smaller tables captures and promotions lead to
+        self.tablebase = Tablebase(directory)
+
+    def is_attacked(self, target, color, squares, occupied, captured=-1):
+        # Whether a piece of color, other than the captured one, attacks the target square
+        for i in self.side_pieces[color]:
+            if i == captured:
+                continue
+            piece_type = self.pieces[i][1]
+            square = squares[i]
+            if piece_type == PAWN:
+                attacks = PAWN_ATTACKS[color][square]
+            elif piece_type == KNIGHT:
+                attacks = KNIGHT_ATTACKS[square]
+            elif piece_type == BISHOP:
+                attacks = bishop_attacks(square, occupied)
+            elif piece_type == ROOK:
+                attacks = rook_attacks(square, occupied)
+            elif piece_type == QUEEN:
+                attacks = rook_attacks(square, occupied) | bishop_attacks(square, occupied)
+            else:
+                attacks = KING_ATTACKS[square]
+            if attacks >> target & 1:
+                return True
+        return False
+
+    def get_targets(self, piece_type, color, square, occupied):
+        # Squares a piece other than a pawn attacks
+        if piece_type == KNIGHT:
+            return KNIGHT_ATTACKS[square]
+        if piece_type == BISHOP:
+            return bishop_attacks(square, occupied)
+        if piece_type == ROOK:
+            return rook_attacks(square, occupied)
+        if piece_type == QUEEN:
+            return rook_attacks(square, occupied) | bishop_attacks(square, occupied)
+        return KING_ATTACKS[square]
+
+    def is_valid(self, squares, side, index):
+        # Pieces on distinct squares, no pawns on the back ranks, the side that just moved not in check,
+        # and the index the one the position's symmetric twins share
+        occupied = 0
+        for i, square in enumerate(squares):
+            if occupied >> square & 1:
+                return False
+            occupied |= 1 << square
+            if self.pieces[i][1] == PAWN and square // 8 in (0, 7):
+                return False
+        if self.is_attacked(squares[side ^ 1], side, squares, occupied):
+            return False
+        return self.layout.get_index(squares, side) == index
+
+    def generate_moves(self, squares, side):
+        """
+        The legal moves of side as (new squares, index of the captured piece or -1, promotion type or 0).
+        """
+        occupied = 0
+        own = 0
+        for i, square in enumerate(squares):
+            occupied |= 1 << square
+            if self.pieces[i][0] == side:
+                own |= 1 << square
+        enemy = occupied & ~own
+
+        moves = []
+        for i in self.side_pieces[side]:
+            piece_type = self.pieces[i][1]
+            square = squares[i]
+            if piece_type == PAWN:
+                # White pawns move towards rank 0 of the array, Black's towards rank 7
+                step = -8 if side == WHITE else 8
+                targets = PAWN_ATTACKS[side][square] & enemy
+                if not occupied >> (square + step) & 1:
+                    targets |= 1 << (square + step)
+                    start_rank = 6 if side == WHITE else 1
+                    if square // 8 == start_rank and not occupied >> (square + 2 * step) & 1:
+                        targets |= 1 << (square + 2 * step)
+            else:
+                targets = self.get_targets(piece_type, side, square, occupied) & ~own
+
+            while targets:
+                target = (targets & -targets).bit_length() - 1
+                targets &= targets - 1
+                captured = -1
+                if enemy >> target & 1:
+                    captured = next(j for j in self.side_pieces[side ^ 1] if squares[j] == target)
+                new_squares = list(squares)
+                new_squares[i] = target
+                new_occupied = (occupied & ~(1 << square)) | (1 << target)
+                if self.is_attacked(new_squares[side], side ^ 1, new_squares, new_occupied, captured):
+                    continue
+                if piece_type == PAWN and target // 8 in (0, 7):
+                    for promotion in PROMOTION_TYPES:
+                        moves.append((new_squares, captured, promotion))
+                else:
+                    moves.append((new_squares, captured, 0))
+        return moves
+
+    def probe_exit(self, squares, side, captured, promotion):
+        # Table byte, for the opponent to move, of the position after a capture or promotion
+        pieces = []
+        for i, (color, piece_type) in enumerate(self.pieces):
+            if i == captured:
+                continue
+            if promotion and color == side and piece_type == PAWN and squares[i] // 8 in (0, 7):
+                piece_type = promotion
+            pieces.append((color, piece_type, squares[i]))
+        value = self.tablebase.probe_pieces(pieces, side ^ 1)
+        if value is None:
+            raise ValueError(f"{self.name} needs a table for {pieces}")
+        return value
+
+    def scan(self, start, end):
+        """
+        Decode and generate the moves of every index in [start, end). Returns
+        (remaining, flags, loss_exits, resolved, entries): per index, the number
+        of distinct positions in the table its moves lead to, its exit flags,
+        the longest win the opponent has after an exit, and whether it is
+        already settled; and the (index, plies, kind) of the positions known to
+        be won or lost so far.
+        """
+        count = end - start
+        remaining = bytearray(count)
+        flags = bytearray(count)
+        loss_exits = bytearray(count)
+        resolved = bytearray(count)
+        entries = []
+        for index in range(start, end):
+            squares, side = self.layout.get_squares(index)
+            offset = index - start
+            if not self.is_valid(squares, side, index):
+                resolved[offset] = 1
+                continue
+
+            children = set()
+            win_exit = None
+            for new_squares, captured, promotion in self.generate_moves(squares, side):
+                if captured < 0 and not promotion:
+                    children.add(self.layout.get_index(new_squares, side ^ 1))
+                    continue
+                value = self.probe_exit(new_squares, side, captured, promotion)
+                if value == 0:
+                    flags[offset] |= DRAW_EXIT
+                elif value < LOSS_OFFSET:
+                    loss_exits[offset] = max(loss_exits[offset], value)
+                elif win_exit is None or value - LOSS_OFFSET + 1 < win_exit:
+                    win_exit = value - LOSS_OFFSET + 1
+
+            remaining[offset] = len(children)
+            if win_exit is not None:
+                flags[offset] |= WIN_EXIT
+                entries.append((index, win_exit, WON))
+            elif not children and not flags[offset] & DRAW_EXIT:
+                if loss_exits[offset]:
+                    entries.append((index, loss_exits[offset] + 1, LOST))
+                else:
+                    # No moves at all: checkmate, or stalemate which stays a draw
+                    occupied = sum(1 << square for square in squares)
+                    if self.is_attacked(squares[side], side ^ 1, squares, occupied):
+                        entries.append((index, 0, LOST))
+                    else:
+                        resolved[offset] = 1
+        return remaining, flags, loss_exits, resolved, entries
+
+    def find_predecessors(self, indices):
+        """
+        For each index, the distinct indices of the positions one move earlier, found by un-making
+        every move the side not to move could have just made. Captures and promotions lead here
+        from other tables, so only plain moves are un-made.
+        """
+        predecessors = []
+        for index in indices:
+            squares, side = self.layout.get_squares(index)
+            mover = side ^ 1
+            occupied = 0
+            for square in squares:
+                occupied |= 1 << square
+            found = set()
+            for i in self.side_pieces[mover]:
+                piece_type = self.pieces[i][1]
+                square = squares[i]
+                if piece_type == PAWN:
+                    step = -8 if mover == WHITE else 8
+                    origins = 0
+                    origin = square - step
+                    if 1 <= origin // 8 <= 6 and not occupied >> origin & 1:
+                        origins |= 1 << origin
+                        # A double step lands on the fourth rank from the pawn's side
+                        if square // 8 == (4 if mover == WHITE else 3) and not occupied >> (origin - step) & 1:
+                            origins |= 1 << (origin - step)
+                else:
+                    origins = self.get_targets(piece_type, mover, square, occupied) & ~occupied
+
+                while origins:
+                    origin = (origins & -origins).bit_length() - 1
+                    origins &= origins - 1
+                    previous = list(squares)
+                    previous[i] = origin
+                    previous_occupied = (occupied & ~(1 << square)) | (1 << origin)
+                    # The side to move now could not have been in check with the mover to move
+                    if self.is_attacked(previous[side], mover, previous, previous_occupied):
+                        continue
+                    found.add(self.layout.get_index(previous, mover))
+            predecessors.append(found)
+        return predecessors
+
+    def generate(self, workers=1, progress=print):
+        """
+        Work out the table. Returns it as a bytearray of one value per index (see Tablebase.py).
+        """
+        total = 2 * self.layout.size
+        start_time = time.perf_counter()
+        executor = None
+        if workers > 1:
+            executor = ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(self.name, self.directory))
+
+        # Scan every index
+        remaining = bytearray()
+        flags = bytearray()
+        loss_exits = bytearray()
+        resolved = bytearray()
+        levels = []
+        chunk_size = PROGRESS_INTERVAL if executor is None else max(total // (workers * CHUNKS_PER_WORKER), 1)
+        ranges = [(start, min(start + chunk_size, total)) for start in range(0, total, chunk_size)]
+        if executor is None:
+            results = (self.scan(start, end) for start, end in ranges)
+        else:
+            results = executor.map(scan_range, *zip(*ranges))
+        for (start, end), (chunk_remaining, chunk_flags, chunk_loss_exits, chunk_resolved, entries) in zip(ranges, results):
+            remaining += chunk_remaining
+            flags += chunk_flags
+            loss_exits += chunk_loss_exits
+            resolved += chunk_resolved
+            for index, plies, kind in entries:
+                self.add_entry(levels, plies, index, kind)
+            progress(f"{self.name}: scanned {end}/{total} positions ({time.perf_counter() - start_time:.1f}s)")
+
+        # Resolve positions one ply further from mate at a time
+        values = bytearray(total)
+        plies = 0
+        while plies < len(levels):
+            batch = []
+            for index, kind in levels[plies]:
+                if not resolved[index]:
+                    resolved[index] = 1
+                    if plies >= LOSS_OFFSET:
+                        raise ValueError(f"{self.name} has mates longer than a table byte can hold")
+                    values[index] = plies if kind == WON else LOSS_OFFSET + plies
+                    batch.append((index, kind))
+            levels[plies] = None
+
+            indices = [index for index, kind in batch]
+            if executor is None or len(indices) < workers * CHUNKS_PER_WORKER:
+                predecessor_lists = self.find_predecessors(indices)
+            else:
+                size = len(indices) // (workers * CHUNKS_PER_WORKER) + 1
+                chunks = [indices[start:start + size] for start in range(0, len(indices), size)]
+                predecessor_lists = [found for result in executor.map(find_predecessors, chunks) for found in result]
+
+            for (index, kind), predecessors in zip(batch, predecessor_lists):
+                for predecessor in predecessors:
+                    if resolved[predecessor]:
+                        continue
+                    if kind == LOST:
+                        # A move to a lost position wins
+                        self.add_entry(levels, plies + 1, predecessor, WON)
+                    else:
+                        remaining[predecessor] -= 1
+                        # Every move loses, unless a capture or promotion holds the draw or wins
+                        if not remaining[predecessor] and not flags[predecessor] & (WIN_EXIT | DRAW_EXIT):
+                            self.add_entry(levels, max(plies, loss_exits[predecessor]) + 1, predecessor, LOST)
+            if batch:
+                kind_name = "won" if batch[0][1] == WON else "lost"
+                progress(f"{self.name}: {len(batch)} positions {kind_name} in {plies} plies ({time.perf_counter() - start_time:.1f}s)")
+            plies += 1
+
+        if executor is not None:
+            executor.shutdown()
+        return values
+
+    def add_entry(self, levels, plies, index, kind):
+        while len(levels) <= plies:
+            levels.append([])
+        levels[plies].append((index, kind))
+
+    def close(self):
+        self.tablebase.close()
+
+
+def get_dependencies(name):
+    """
+    The tables a table's captures and promotions lead to, smallest first, ending with the table itself.
+    """
+    order = []
+
+    def visit(name):
+        if name in order or name in DRAWN_MATERIAL:
+            return
+        pieces = get_layout(name).pieces
+        for i, (color, piece_type) in enumerate(pieces):
+            if piece_type == KING:
+                continue
+            others = pieces[:i] + pieces[i + 1:]
+            visit(material_name([t for c, t in others if c == WHITE], [t for c, t in others if c == BLACK])[0])
+            if piece_type == PAWN:
+                for promotion in PROMOTION_TYPES:
+                    promoted = others + [(color, promotion)]
+                    visit(material_name([t for c, t in promoted if c == WHITE], [t for c, t in promoted if c == BLACK])[0])
+        order.append(name)
+
+    visit(name)
+    return order
+
+
+def build_tables(names, directory, workers=1, force=False, progress=print):
+    """
+    Build the named tables, and the smaller ones they need, into directory.
+    Tables already there are kept unless force is set. Returns the names of the tables built.
+    """
+    os.makedirs(directory, exist_ok=True)
+    built = []
+    for name in names:
+        # Accept either side first, e.g. KvKQ
+        white, black = name.upper().split("V")
+        name = material_name([5 - "KQRBNP".index(letter) for letter in white], [5 - "KQRBNP".index(letter) for letter in black])[0]
+        for table in get_dependencies(name):
+            path = os.path.join(directory, table + TABLE_EXTENSION)
+            if table in built or (os.path.exists(path) and not force):
+                continue
+            generator = TablebaseGenerator(table, directory)
+            values = generator.generate(workers, progress)
+            generator.close()
+            # Written under another name first, so a half-written table is never opened
+            with open(path + ".tmp", "wb") as file:
+                file.write(values)
+            os.replace(path + ".tmp", path)
+            wins = sum(1 for value in values if 0 < value < LOSS_OFFSET)
+            longest = max((value for value in values if value < LOSS_OFFSET), default=0)
+            progress(f"{table}: written to {path}, {wins} wins, longest mate {longest} plies")
+            built.append(table)
+    return built
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build endgame tablebases by retrograde analysis.")
+    parser.add_argument("tables", nargs="*", default=DEFAULT_TABLES, help=f"material such as KQvK (default: {' '.join(DEFAULT_TABLES)})")
+    parser.add_argument("--directory", default=DEFAULT_DIRECTORY, help="where the tables are written")
+    parser.add_argument("--workers", type=int, default=1, help="processes to build each table with")
+    parser.add_argument("--force", action="store_true", help="rebuild tables that already exist")
+    args = parser.parse_args()
+
+    start_time = time.perf_counter()
+    built = build_tables(args.tables, args.directory, args.workers, args.force)
+    print(f"{len(built)} tables built in {time.perf_counter() - start_time:.1f}s")
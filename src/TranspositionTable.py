@@ -0,0 +1,80 @@
+from array import array
+
+# Bound types
+EXACT, LOWER_BOUND, UPPER_BOUND = 1, 2, 3
+
+# Bytes per entry: key (8), score (4), move (4), depth, bound and age (1 each)
+ENTRY_SIZE = 19
+
+'''
+Fixed-size hash table of search results indexed by the low bits of the
+position's Zobrist key. Entries live in flat typed arrays, so the memory cap
+is exact and no objects are allocated per store.
+
+Replacement policies:
+    "always"  - a new result always overwrites the slot
+    "depth"   - keep the deeper result, unless it was stored by an earlier search
+'''
+
+class TranspositionTable:
+    def __init__(self, max_memory_mb=16, replacement_policy="depth"):
+        if replacement_policy not in ("always", "depth"):
+            raise ValueError("Unknown replacement policy: " + str(replacement_policy))
+        self.replacement_policy = replacement_policy
+
+        # Largest power of two that fits the memory cap
+        entries = 1
+        while entries * 2 * ENTRY_SIZE <= max_memory_mb * 1024 * 1024:
+            entries *= 2
+        self.size = entries
+        self.mask = entries - 1
+
+        self.keys = array('Q', bytes(8 * entries))
+        self.scores = array('i', bytes(4 * entries))
+        self.moves = array('I', bytes(4 * entries))
+        self.depths = array('b', bytes(entries))
+        self.bounds = array('B', bytes(entries))
+        self.ages = array('B', bytes(entries))
+
+        self.age = 0
+        self.probes = 0
+        self.hits = 0
+
+    def new_search(self):
+        # Entries from earlier searches stay usable but become easier to replace
+        self.age = (self.age + 1) & 0xFF
+
+    def clear(self):
+        # A slot with no bound is empty
+        self.bounds = array('B', bytes(self.size))
+
+    def probe(self, key):
+        """
+        Return (depth, bound, score, move) stored for the key, or None.
+        """
+        self.probes += 1
+        index = key & self.mask
+        if self.bounds[index] and self.keys[index] == key:
+            self.hits += 1
+            return self.depths[index], self.bounds[index], self.scores[index], self.moves[index]
+        return None
+
+    def store(self, key, depth, bound, score, move):
+        index = key & self.mask
+        if (
+            self.replacement_policy == "depth"
+            and self.bounds[index]
+            and self.ages[index] == self.age
+            and self.keys[index] != key
+            and self.depths[index] > depth
+        ):
+            return
+        self.keys[index] = key
+        self.depths[index] = depth
+        self.bounds[index] = bound
+        self.scores[index] = score
+        self.moves[index] = move or 0
+        self.ages[index] = self.age
+
+    def get_memory_usage(self):
+        return self.size * ENTRY_SIZE
@@ -0,0 +1,267 @@
+import os
+import sys
+import threading
+import time
+from Board import Board, START_FEN
+from ChessAI import ChessAI, CHECKMATE_SCORE, MATE_BOUND
+from Move import move_name
+
+'''
+Text front end speaking the Universal Chess Interface on stdin/stdout, for
+chess GUIs, tournament managers and batch analysis. It does not need pygame.
+
+    python3 src/UciEngine.py
+
+Supported commands: uci, isready, ucinewgame, setoption (Hash, Threads, TablebasePath),
+position [startpos | fen <fen>] [moves ...], go [depth | movetime | nodes |
+wtime/btime/winc/binc/movestogo | infinite | ponder], ponderhit, stop and quit.
+
+go ponder searches without a time limit until ponderhit or stop. On ponderhit
+the ponder search is stopped and a normal search of the same position starts
+with the time the go command gave, picking up what pondering left in the
+transposition table.
+'''
+
+ENGINE_NAME = "Chess Game Engine"
+ENGINE_AUTHOR = "Chess Game Engine authors"
+
+# Moves assumed left in the game when the GUI does not say, for splitting the clock
+DEFAULT_MOVES_TO_GO = 30
+# Kept back from every move so that slow I/O does not lose on time
+MOVE_OVERHEAD = 0.05
+# Seconds between repeated stop requests while waiting for a search to end
+STOP_RETRY_INTERVAL = 0.05
+
+GO_ARGUMENTS = ["depth", "movetime", "nodes", "wtime", "btime", "winc", "binc", "movestogo"]
+
+
+class UciEngine:
+    def __init__(self, output=sys.stdout):
+        self.output = output
+        # Search threads print too, so lines are written one at a time
+        self.output_lock = threading.Lock()
+        self.tt_memory_mb = 16
+        self.workers = 1
+        # Directory of tables built by TablebaseGenerator.py, if any
+        self.tablebase_path = None
+        self.board = Board()
+        self.ai = None
+        self.new_game()
+        self.search_thread = None
+        self.search_infinite = False
+        # While pondering, the (move_time, infinite) of the search to start on ponderhit
+        self.ponder_limits = None
+        # Set while a ponder search is stopped by ponderhit, so that it ends without a bestmove
+        self.ponder_hit_received = False
+        # Set by stop; an infinite search only answers once it is
+        self.stop_received = threading.Event()
+
+    def send(self, line):
+        with self.output_lock:
+            self.output.write(line + "\n")
+            self.output.flush()
+
+    def new_game(self):
+        if self.ai is not None:
+            self.ai.close()
+        self.ai = ChessAI(
+            self.board.side_to_move, tt_memory_mb=self.tt_memory_mb, workers=self.workers,
+            tablebase_path=self.tablebase_path
+        )
+
+    def run(self, input=sys.stdin):
+        for line in input:
+            if not self.handle_command(line):
+                break
+        # At the end of piped input a bounded search still gets to report its move
+        self.finish_search()
+        self.ai.close()
+
+    def handle_command(self, line):
+        """
+        Act on one line of input. Returns False when the engine should quit.
+        """
+        words = line.split()
+        if not words:
+            return True
+        command = words[0]
+
+        if command == "uci":
+            self.send(f"id name {ENGINE_NAME}")
+            self.send(f"id author {ENGINE_AUTHOR}")
+            self.send("option name Hash type spin default 16 min 1 max 1024")
+            self.send("option name Threads type spin default 1 min 1 max 64")
+            self.send("option name TablebasePath type string default <empty>")
+            self.send("option name Ponder type check default false")
+            self.send("uciok")
+        elif command == "isready":
+            self.send("readyok")
+        elif command == "ucinewgame":
+            self.finish_search()
+            self.new_game()
+        elif command == "setoption":
+            self.finish_search()
+            self.set_option(words[1:])
+        elif command == "position":
+            self.finish_search()
+            self.set_position(words[1:])
+        elif command == "go":
+            self.finish_search()
+            self.go(words[1:])
+        elif command == "ponderhit":
+            self.ponder_hit()
+        elif command == "stop":
+            self.stop_search()
+        elif command == "quit":
+            self.stop_search()
+            return False
+        # Unknown commands are ignored, as the protocol asks
+        return True
+
+    def set_option(self, words):
+        # setoption name <name> value <value>
+        if "name" not in words or "value" not in words:
+            return
+        name = " ".join(words[words.index("name") + 1:words.index("value")]).lower()
+        value = " ".join(words[words.index("value") + 1:])
+        if name == "hash" and value.isdigit():
+            self.tt_memory_mb = max(1, int(value))
+            self.new_game()
+        elif name == "threads" and value.isdigit():
+            self.workers = max(1, int(value))
+            self.new_game()
+        elif name == "tablebasepath":
+            if value in ("", "<empty>"):
+                self.tablebase_path = None
+            elif os.path.isdir(value):
+                self.tablebase_path = value
+            else:
+                self.send(f"info string no tablebase directory {value}")
+                return
+            self.new_game()
+
+    def set_position(self, words):
+        # position startpos [moves ...] or position fen <six fields> [moves ...]
+        moves = []
+        if "moves" in words:
+            moves = words[words.index("moves") + 1:]
+            words = words[:words.index("moves")]
+        if words and words[0] == "fen":
+            fen = " ".join(words[1:])
+        else:
+            fen = START_FEN
+
+        board = Board()
+        board.set_fen(fen)
+        for name in moves:
+            legal_moves = board.move_generator.generate_legal_moves(board, board.side_to_move)
+            move = next((move for move in legal_moves if move_name(move) == name), None)
+            if move is None:
+                self.send(f"info string illegal move {name}")
+                break
+            board.make_move(move)
+        self.board = board
+
+    def go(self, words):
+        limits = {}
+        for i, word in enumerate(words[:-1]):
+            if word in GO_ARGUMENTS and words[i + 1].lstrip("-").isdigit():
+                limits[word] = int(words[i + 1])
+        infinite = "infinite" in words
+        ponder = "ponder" in words
+
+        ai = self.ai
+        ai.set_color(self.board.side_to_move)
+        ai.max_depth = limits.get("depth", 64)
+        ai.node_budget = limits.get("nodes")
+        clock, increment = ("wtime", "winc") if ai.color == "White" else ("btime", "binc")
+        if "movetime" in limits:
+            move_time = max(limits["movetime"] / 1000 - MOVE_OVERHEAD, 0.01)
+        elif clock in limits and not infinite:
+            time_left = limits[clock] / 1000
+            moves_to_go = limits.get("movestogo", DEFAULT_MOVES_TO_GO)
+            # allocate_time scales this by game phase, by at most 1.25
+            ai.time_budget = time_left / moves_to_go + limits.get(increment, 0) / 1000 * 0.75
+            move_time = max(min(ai.allocate_time(self.board), time_left / 2) - MOVE_OVERHEAD, 0.01)
+        else:
+            # Searching to a depth or node count, or until stopped
+            move_time = float('inf')
+            if not limits:
+                infinite = True
+
+        if ponder:
+            self.ponder_limits = (move_time, infinite)
+            self.start_search(float('inf'), True)
+        else:
+            self.start_search(move_time, infinite)
+
+    def start_search(self, move_time, infinite):
+        self.stop_received.clear()
+        self.search_infinite = infinite
+        self.search_thread = threading.Thread(target=self.search, args=(self.board, move_time, infinite), daemon=True)
+        self.search_thread.start()
+
+    def ponder_hit(self):
+        # The expected move was played: search for real, with the time the go command gave
+        if self.ponder_limits is None:
+            return
+        move_time, infinite = self.ponder_limits
+        self.ponder_hit_received = True
+        self.stop_search()
+        self.ponder_hit_received = False
+        self.start_search(move_time, infinite)
+
+    def search(self, board, move_time, infinite):
+        start_time = time.perf_counter()
+
+        def send_info(iteration):
+            nodes = self.ai.nodes + self.ai.qnodes
+            elapsed = time.perf_counter() - start_time
+            pv = self.ai.get_principal_variation(board, iteration["depth"])
+            self.send(
+                f"info depth {iteration['depth']} score {self.format_score(iteration['score'])} "
+                f"nodes {nodes} nps {int(nodes / max(elapsed, 1e-6))} time {int(elapsed * 1000)} "
+                f"pv {' '.join(move_name(move) for move in pv)}"
+            )
+
+        self.ai.info_callback = send_info
+        best_move = self.ai.calculate_move(board, move_time=move_time)
+        self.ai.info_callback = None
+
+        # The protocol only allows bestmove after stop in an infinite search, even if it ended early
+        if infinite:
+            self.stop_received.wait()
+        # A ponder search ended by ponderhit makes way for the real search without answering
+        if self.ponder_hit_received:
+            return
+        self.send(f"bestmove {move_name(best_move) if best_move else '0000'}")
+
+    def stop_search(self):
+        if self.search_thread is not None:
+            self.stop_received.set()
+            # Asked again until the thread ends, as a search only just starting clears the request
+            while self.search_thread.is_alive():
+                self.ai.stop()
+                self.search_thread.join(STOP_RETRY_INTERVAL)
+            self.search_thread = None
+        self.ponder_limits = None
+
+    def finish_search(self):
+        # Commands sent before bestmove (as piped scripts do) wait for the search, unless it would never end
+        if self.search_infinite:
+            self.stop_search()
+        elif self.search_thread is not None:
+            self.search_thread.join()
+            self.search_thread = None
+
+    def format_score(self, score):
+        if abs(score) > MATE_BOUND:
+            # Mate in moves, not plies, negative when the engine is getting mated
+            plies = CHECKMATE_SCORE - abs(score)
+            moves = (plies + 1) // 2
+            return f"mate {moves if score > 0 else -moves}"
+        return f"cp {score}"
+
+
+if __name__ == "__main__":
+    UciEngine().run()
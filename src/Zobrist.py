@@ -0,0 +1,23 @@
+import random
+
+'''
+Random 64-bit keys for Zobrist hashing. A position's key is the XOR of the
+keys of everything in it, so moving a piece or changing a right only needs
+the old and new keys XORed in. A fixed seed keeps keys identical between runs.
+'''
+
+_generator = random.Random(20240101)
+
+
+def _random_key():
+    return _generator.getrandbits(64)
+
+
+# PIECE_KEYS[color][piece type][square]
+PIECE_KEYS = [[[_random_key() for square in range(64)] for piece_type in range(6)] for color in range(2)]
+# XORed in when black is to move
+SIDE_KEY = _random_key()
+# One key per combination of the four castling rights, none when no rights are left
+CASTLING_KEYS = [0] + [_random_key() for rights in range(1, 16)]
+# One key per file of the en passant square
+EN_PASSANT_KEYS = [_random_key() for file in range(8)]